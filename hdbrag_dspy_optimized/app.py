@@ -1,77 +1,153 @@
 import os
 import argparse
-import dspy
-from pathlib import Path
+import threading
+from concurrent.futures import Future
 from dotenv import load_dotenv
-from src.retriever import get_hdb_index
-from src.model import HDBRAG
+from src import telemetry
+
+# dspy, llama_index and the models are imported inside the functions below, so that
+# with --fast-start the prompt appears before they have finished loading
 
 def setup_model(model_name: str):
-    """Setup DSPy LM based on model name."""
+    """Setup DSPy LM based on model name. Its calls share the model's adaptive concurrency limit."""
+    from src.lm_limiter import AdaptiveLM
     if model_name == "openai":
         if not os.getenv("OPENAI_API_KEY"):
             raise ValueError("OPENAI_API_KEY not found in environment.")
-        return dspy.LM("gpt-4o-mini")
+        return AdaptiveLM("gpt-4o-mini")
     elif model_name == "ollama":
-        return dspy.LM('ollama/qwen3:0.6b', api_base='http://localhost:11434')
+        return AdaptiveLM('ollama/qwen3:0.6b', api_base='http://localhost:11434')
     else:
         raise ValueError(f"Unsupported model: {model_name}")
 
-def main():
-    # 1. Parse Arguments
-    parser = argparse.ArgumentParser(description="HDB RAG Expert Chatbot")
-    parser.add_argument("--model", type=str, default="ollama", choices=["openai", "ollama"], help="Model to use for chat")
-    args = parser.parse_args()
-
-    load_dotenv()
+def load_rag(args):
+    """Set up the LM, load the knowledge base and build HDBRAG. Returns (rag, recent sink)."""
+    import dspy
+    from src.retriever import get_hdb_index
+    from src.model import HDBRAG
+    from src.cache import RETRIEVAL_CACHE_PATH, RetrievalCache, SemanticCache
 
     # 3. Setup DSPy LM
-    print(f"🤖 Initializing HDB RAG Expert with model: {args.model}...")
     try:
         lm = setup_model(args.model)
-        dspy.settings.configure(lm=lm)
+        dspy.settings.configure(lm=lm, track_usage=args.timings or bool(args.trace_file))
     except Exception as e:
-        print(f"❌ Error setting up model {args.model}: {e}")
-        return
+        raise RuntimeError(f"Error setting up model {args.model}: {e}") from e
 
     # 5. Initialize Knowledge Base
     try:
         index = get_hdb_index()
     except Exception as e:
-        print(f"❌ Error loading knowledge base: {e}")
-        return
+        raise RuntimeError(f"Error loading knowledge base: {e}") from e
+
+    recent = telemetry.tracer.add_sink(telemetry.RecentSink()) if args.timings else None
+    if args.trace_file:
+        telemetry.tracer.add_sink(telemetry.JSONLSink(args.trace_file))
 
     # 6. Instantiate RAG Module
-    rag = HDBRAG(index=index, k=3)
+    cache = SemanticCache(threshold=args.cache_threshold) if args.cache else None
+    retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_PATH) if args.retrieval_cache else None
+    adaptive = {"adaptive": args.adaptive}
+    if args.adaptive_threshold is not None:
+        adaptive["adaptive_threshold"] = args.adaptive_threshold
+    rag = HDBRAG(index=index, k=3, cache=cache, retrieval_cache=retrieval_cache, **adaptive)
+    return rag, recent
+
+def load_rag_in_background(args):
+    """Run load_rag and a retrieval warm-up on a daemon thread. Returns a Future of (rag, recent)."""
+    future = Future()
+
+    def run():
+        try:
+            rag, recent = load_rag(args)
+            # Retrieval only: a warm-up LM call would queue ahead of the first question
+            rag.warmup(lm=False)
+            future.set_result((rag, recent))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="load-rag", daemon=True).start()
+    return future
+
+def main():
+    # 1. Parse Arguments
+    parser = argparse.ArgumentParser(description="HDB RAG Expert Chatbot")
+    parser.add_argument("--model", type=str, default="ollama", choices=["openai", "ollama"], help="Model to use for chat")
+    parser.add_argument("--fast-start", action="store_true", help="Show the prompt at once and load the index and models in the background")
+    parser.add_argument("--cache", action="store_true", help="Serve paraphrased questions from the semantic answer cache")
+    parser.add_argument("--cache-threshold", type=float, default=0.92, help="Cosine similarity required for a cache hit")
+    parser.add_argument("--retrieval-cache", action="store_true", help="Reuse query embeddings and rerank scores from data/retrieval_cache.sqlite")
+    parser.add_argument("--adaptive", action="store_true", help="Skip query expansion and HyDE when the plain question retrieves confidently")
+    parser.add_argument("--adaptive-threshold", type=float, default=None, help="Top rerank score needed to skip expansion (default 0.9)")
+    parser.add_argument("--doc-id", action="append", help="Only answer from this page, e.g. singles (repeatable)")
+    parser.add_argument("--section", action="append", help="Only answer from sections with this heading (repeatable)")
+    parser.add_argument("--no-stream", action="store_true", help="Print the answer only once it is complete")
+    parser.add_argument("--timings", action="store_true", help="Print a per-stage latency breakdown after each answer")
+    parser.add_argument("--trace-file", type=str, help="Append per-query stage timings to this JSONL file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    filters = {field: values for field, values in (("doc_id", args.doc_id), ("section", args.section)) if values}
+
+    print(f"🤖 Initializing HDB RAG Expert with model: {args.model}...")
+    if args.fast_start:
+        loading = load_rag_in_background(args)
+        rag = recent = None
+    else:
+        try:
+            rag, recent = load_rag(args)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            return
 
     print(f"\n✅ System Ready! Ask your questions using {args.model}.")
+    if filters:
+        print(f"🔎 Answering only from {filters}")
     print("(Type 'quit', 'exit', or 'q' to stop)\n")
 
     # 7. Chat Loop
     while True:
         try:
             query = input("👤 You: ").strip()
-            
+
             if query.lower() in ["quit", "exit", "q", ""]:
                 if not query: continue
                 print("👋 Goodbye!")
                 break
 
+            if rag is None:
+                if not loading.done():
+                    print("⏳ Still loading the knowledge base...")
+                try:
+                    rag, recent = loading.result()
+                except Exception as e:
+                    print(f"❌ {e}")
+                    break
+
             print("🔍 Searching and thinking...")
-            
-            # Run the RAG program
-            prediction = rag(question=query)
-
-            # Display results
-            print(f"\n🤖 Agent: {prediction.answer}")
-            
-            # Cited Contexts (Optional: show where it came from)
-            if prediction.context:
-                print("\n📚 Sources:")
-                for i, ctx in enumerate(prediction.context):
-                    # Show a snippet of the context for verification
-                    snippet = ctx[:100].replace('\n', ' ') + "..."
-                    print(f"   [{i+1}] {snippet}")
+
+            # Run the RAG program, printing sources and answer as soon as each is available
+            streamed = False
+            for event, payload in rag.stream(query, tokens=not args.no_stream, filters=filters or None):
+                if event == "sources":
+                    # Cited Contexts (Optional: show where it came from)
+                    if payload:
+                        print("\n📚 Sources:")
+                    for i, ctx in enumerate(payload):
+                        # Show a snippet of the context for verification
+                        snippet = ctx.long_text[:100].replace('\n', ' ') + "..."
+                        print(f"   [{i+1}] {snippet}")
+                    print("\n🤖 Agent: ", end="", flush=True)
+                elif event == "token":
+                    print(payload, end="", flush=True)
+                    streamed = True
+                elif event == "answer":
+                    # Cached answers and non-streaming LMs arrive in one piece
+                    print("" if streamed else payload.answer)
+            if recent is not None and recent.last is not None:
+                print("\n" + telemetry.format_breakdown(recent.last))
+                if args.adaptive:
+                    print(f"   {rag.fast_path_stats}")
             print("-" * 50)
 
         except KeyboardInterrupt:
@@ -0,0 +1,129 @@
+import argparse
+import json
+import time
+from pathlib import Path
+import numpy as np
+from benchmark_utils import REPORTS_DIR, git_commit
+from src.ann_index import ANN_INDEXES, make_ann_index
+from src.retriever import STORAGE_DIR
+from src.vector_store import EMBEDDINGS_FILE, MMAP_DIR_NAME
+
+# Search knob values swept for each ANN kind
+DEFAULT_SWEEPS = {
+    "hnsw": [16, 32, 64, 128, 256],
+    "ivfpq": [1, 4, 16, 64, 256],
+}
+
+def load_embeddings(storage_dir):
+    """Embedding matrix of an index built with vector_store="mmap"."""
+    path = Path(storage_dir) / MMAP_DIR_NAME / EMBEDDINGS_FILE
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found. Build the index with vector_store='mmap' first.")
+    return np.load(path).astype(np.float32)
+
+def synthetic_embeddings(num_rows, dim, clusters=256, seed=0):
+    """Clustered unit vectors, roughly shaped like sentence embeddings of many similar pages."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    matrix = centers[rng.integers(0, clusters, num_rows)] + 0.5 * rng.normal(size=(num_rows, dim))
+    return normalize_rows(matrix.astype(np.float32))
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def make_queries(matrix, num_queries, noise=0.3, seed=1):
+    """Perturbed corpus rows, so every query has close but not identical neighbours."""
+    rng = np.random.default_rng(seed)
+    rows = matrix[rng.integers(0, len(matrix), num_queries)]
+    return normalize_rows(rows + noise * rng.normal(size=rows.shape).astype(np.float32) / np.sqrt(matrix.shape[1]))
+
+def exact_top_k(matrix, queries, k):
+    latencies = []
+    results = []
+    for q in queries:
+        t0 = time.perf_counter()
+        scores = matrix @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(set(top.tolist()))
+    return results, latencies
+
+def latency_stats(latencies):
+    return {
+        "p50": round(float(np.percentile(latencies, 50)), 3),
+        "p95": round(float(np.percentile(latencies, 95)), 3),
+        "qps": round(len(latencies) / (sum(latencies) / 1000), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ANN recall@k against exact search at each efSearch / nprobe setting.")
+    parser.add_argument("--storage-dir", type=str, default=str(STORAGE_DIR), help="mmap index to take embeddings from")
+    parser.add_argument("--synthetic", type=int, default=None, help="Use N synthetic vectors instead of an index")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of synthetic vectors")
+    parser.add_argument("--ann", nargs="+", default=list(ANN_INDEXES), choices=list(ANN_INDEXES), help="ANN kinds to benchmark")
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: data/benchmarks/ann_<commit>.json)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        matrix = synthetic_embeddings(args.synthetic, args.dim)
+        source = f"synthetic:{args.synthetic}x{args.dim}"
+    else:
+        matrix = normalize_rows(load_embeddings(args.storage_dir))
+        source = args.storage_dir
+    k = min(args.k, len(matrix))
+    queries = make_queries(matrix, args.num_queries)
+
+    truth, exact_latencies = exact_top_k(matrix, queries, k)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "source": source,
+        "num_rows": len(matrix),
+        "dim": matrix.shape[1],
+        "num_queries": len(queries),
+        "k": k,
+        "exact_latency_ms": latency_stats(exact_latencies),
+        "ann": {},
+    }
+    print(f"{source}: {len(matrix)} rows, exact p50={report['exact_latency_ms']['p50']:.3f} ms")
+
+    for kind in args.ann:
+        start = time.perf_counter()
+        index = make_ann_index(kind, matrix.shape[1]).build(matrix)
+        build_seconds = time.perf_counter() - start
+        print(f"{kind}: built in {build_seconds:.1f}s with {index.build_params()}")
+
+        settings = []
+        for value in DEFAULT_SWEEPS[kind]:
+            setattr(index, index.search_param, value)
+            latencies = []
+            found = 0
+            for q, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                # Same as MmapVectorStore: over-fetch, then re-score candidates exactly
+                rows = index.search(q, k * index.refine_factor)
+                rows = rows[np.argsort(-(matrix[rows] @ q))[:k]]
+                latencies.append((time.perf_counter() - t0) * 1000)
+                found += len(expected & set(rows.tolist()))
+            recall = round(found / (len(queries) * k), 4)
+            stats = latency_stats(latencies)
+            settings.append({index.search_param: value, "recall": recall, "latency_ms": stats})
+            print(f"  {index.search_param}={value:<5} recall@{k}={recall:.4f}  p50={stats['p50']:.3f} ms  {stats['qps']:.0f} q/s")
+
+        report["ann"][kind] = {
+            "build_seconds": round(build_seconds, 2),
+            "build_params": index.build_params(),
+            "settings": settings,
+        }
+
+    output = Path(args.output) if args.output else REPORTS_DIR / f"ann_{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from benchmark_utils import REPORTS_DIR, git_commit
+from src.ingestion.html_parser import (
+    CHUNK_TOKENS, OVERLAP_TOKENS, chunk_text_by_structure, count_tokens, parse_html, strip_junk,
+)
+
+WORDS = (
+    "applicants must meet the income ceiling for the enhanced cpf housing grant and the "
+    "flat must be bought from hdb within the minimum occupation period of five years "
+    "singles aged 35 and above may apply for a two room flexi flat in any town"
+).split()
+
+def synthetic_html(paragraphs, sections, seed=0):
+    """A page of `paragraphs` paragraphs of 3-6 sentences, spread over `sections` headings."""
+    rng = random.Random(seed)
+    per_section = max(1, paragraphs // sections)
+    body = ["<html><body><nav>Home | Buying a Flat</nav><main>"]
+    for p in range(paragraphs):
+        if p % per_section == 0:
+            body.append(f"<h2>Section {p // per_section}: Eligibility Conditions</h2>")
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            words = rng.choices(WORDS, k=rng.randint(8, 25))
+            sentences.append(" ".join(words).capitalize() + ".")
+        tag = "li" if p % 7 == 0 else "p"
+        body.append(f"<{tag}>{' '.join(sentences)}</{tag}>")
+    body.append("</main><footer>Copyright HDB</footer></body></html>")
+    return "\n".join(body)
+
+def benchmark(html, chunk_tokens=CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS, repeat=3):
+    """Best-of-`repeat` seconds to parse and to chunk `html`, and the chunk statistics."""
+    parse_s, chunk_s = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        soup = parse_html(html)
+        strip_junk(soup)
+        parse_s.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        chunks = chunk_text_by_structure(soup, chunk_tokens, overlap_tokens)
+        chunk_s.append(time.perf_counter() - start)
+    sizes = [count_tokens(c["text"]) for c in chunks]
+    return {
+        "html_mb": round(len(html.encode("utf-8")) / 1e6, 3),
+        "parse_s": round(min(parse_s), 4),
+        "chunk_s": round(min(chunk_s), 4),
+        "chunk_mb_per_s": round(len(html.encode("utf-8")) / 1e6 / min(chunk_s), 2),
+        "chunks": len(chunks),
+        "chunks_per_s": round(len(chunks) / min(chunk_s), 1),
+        "chunk_tokens_mean": round(sum(sizes) / len(sizes), 1) if sizes else 0,
+        "chunk_tokens_max": max(sizes, default=0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunk_text_by_structure throughput on large synthetic HTML.")
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[1000, 4000, 16000], help="Page sizes to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per page; the fastest is reported")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS)
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: data/benchmarks/chunking_<commit>.json)")
+    args = parser.parse_args()
+
+    count_tokens("warm up")  # load the tokenizer outside the timings
+    report = {"commit": git_commit(), "timestamp": time.time(), "chunk_tokens": args.chunk_tokens,
+              "overlap_tokens": args.overlap_tokens, "runs": []}
+    print(f"{'layout':<14} {'paras':>6} {'MB':>6} {'parse s':>8} {'chunk s':>8} {'MB/s':>7} {'chunks':>7} {'tok mean':>9} {'tok max':>8}")
+    # Many short sections, and the same text under a single heading (one very long section)
+    for layout in ("sections", "one_section"):
+        for paragraphs in args.paragraphs:
+            sections = max(1, paragraphs // 5) if layout == "sections" else 1
+            result = benchmark(synthetic_html(paragraphs, sections), args.chunk_tokens, args.overlap_tokens, args.repeat)
+            report["runs"].append({"layout": layout, "paragraphs": paragraphs, **result})
+            print(
+                f"{layout:<14} {paragraphs:>6} {result['html_mb']:>6.2f} {result['parse_s']:>8.3f} {result['chunk_s']:>8.3f} "
+                f"{result['chunk_mb_per_s']:>7.2f} {result['chunks']:>7} {result['chunk_tokens_mean']:>9} {result['chunk_tokens_max']:>8}"
+            )
+
+    output = Path(args.output) if args.output else REPORTS_DIR / f"chunking_{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report saved to {output}")
+
+if __name__ == "__main__":
+    main()
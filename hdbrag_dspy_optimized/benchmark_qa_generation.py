@@ -0,0 +1,62 @@
+import json
+import tempfile
+import time
+import argparse
+from pathlib import Path
+from dspy.utils.dummies import DummyLM
+from src.ingestion.qa_generator import generate_usage_examples
+
+class SlowDummyLM(DummyLM):
+    """Stub LM that answers instantly but sleeps to simulate backend latency."""
+    def __init__(self, latency, num_answers):
+        answer = {
+            "reasoning": "The context describes a housing grant.",
+            "user_query": "Am I eligible for the housing grant?",
+            "grounded_answer": "Eligibility depends on the criteria in the context.",
+        }
+        super().__init__([answer] * num_answers)
+        self.latency = latency
+
+    def __call__(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().__call__(*args, **kwargs)
+
+def write_synthetic_chunks(path, num_chunks):
+    chunks = [
+        {
+            "chunk_id": f"synthetic_{i}",
+            "doc_id": "synthetic",
+            "section": "Eligibility",
+            "text": f"[Eligibility] Synthetic chunk {i}. " + "Applicants must meet the income ceiling. " * 5,
+        }
+        for i in range(num_chunks)
+    ]
+    path.write_text(json.dumps(chunks), encoding="utf-8")
+
+def benchmark(num_examples=40, latency=0.2, worker_counts=(1, 4, 8)):
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_path = Path(tmp) / "chunks.json"
+        write_synthetic_chunks(chunks_path, num_examples)
+
+        print(f"{'workers':>8} {'examples':>9} {'seconds':>8} {'examples/s':>11}")
+        for workers in worker_counts:
+            output_path = Path(tmp) / f"qa_pairs_{workers}.json"
+            lm = SlowDummyLM(latency, num_answers=num_examples * 2)
+            start = time.perf_counter()
+            results = generate_usage_examples(
+                num_examples=num_examples,
+                output_file=str(output_path),
+                workers=workers,
+                lm=lm,
+                chunks_path=chunks_path,
+            ) or []
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>8} {len(results):>9} {elapsed:>8.2f} {len(results) / elapsed:>11.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark QA generation throughput against a stub LM.")
+    parser.add_argument("--num", type=int, default=40, help="Examples to generate per run")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated LM latency in seconds")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Worker counts to compare")
+    args = parser.parse_args()
+    benchmark(num_examples=args.num, latency=args.latency, worker_counts=args.workers)
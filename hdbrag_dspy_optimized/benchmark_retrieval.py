@@ -0,0 +1,170 @@
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.embeddings import resolve_embed_model
+from benchmark_utils import REPORTS_DIR, git_commit
+from src.retriever import DATA_DIR, HDBRetriever, get_hdb_index
+
+QA_SPLIT_PATH = DATA_DIR / "qa_split.json"
+K_VALUES = (1, 3, 5, 10)
+
+# Retriever configurations under test: name -> HDBRetriever switches
+CONFIGS = {
+    "vector": {"use_vector": True, "use_bm25": False, "rerank": False},
+    "bm25": {"use_vector": False, "use_bm25": True, "rerank": False},
+    "fused": {"use_vector": True, "use_bm25": True, "rerank": False},
+    "fused_rerank": {"use_vector": True, "use_bm25": True, "rerank": True},
+}
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def load_ground_truth(path, split="all"):
+    """Questions with the chunk text (`context`) and `doc_id` they were generated from."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    # qa_split.json is {"train": [...], ...}; qa_pairs.json is a flat list
+    if isinstance(data, dict):
+        items = [item for name, items in data.items() if split in ("all", name) for item in items]
+    else:
+        items = data
+    return [item for item in items if item.get("question") and item.get("context")]
+
+def first_relevant_rank(nodes, item):
+    """1-based rank of the first retrieved chunk matching the source chunk (and doc), or None."""
+    context = normalize(item["context"])
+    chunk_rank = doc_rank = None
+    for rank, n in enumerate(nodes, start=1):
+        if chunk_rank is None and normalize(n.node.get_content()) == context:
+            chunk_rank = rank
+        if doc_rank is None and n.node.metadata.get("doc_id") == item.get("doc_id"):
+            doc_rank = rank
+    return chunk_rank, doc_rank
+
+def evaluate_config(retriever, items, max_k, warmup=2):
+    for item in items[:warmup]:
+        retriever.retrieve_nodes(item["question"], k=max_k)
+
+    latencies = []
+    chunk_ranks = []
+    doc_ranks = []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        nodes = retriever.retrieve_nodes(item["question"], k=max_k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        chunk_rank, doc_rank = first_relevant_rank(nodes, item)
+        chunk_ranks.append(chunk_rank)
+        doc_ranks.append(doc_rank)
+    elapsed = time.perf_counter() - start
+
+    def recall_at(ranks, k):
+        return round(sum(1 for r in ranks if r is not None and r <= k) / len(ranks), 4)
+
+    def mrr(ranks):
+        return round(sum(1.0 / r for r in ranks if r is not None) / len(ranks), 4)
+
+    return {
+        "recall": {f"@{k}": recall_at(chunk_ranks, k) for k in K_VALUES if k <= max_k},
+        "doc_recall": {f"@{k}": recall_at(doc_ranks, k) for k in K_VALUES if k <= max_k},
+        "mrr": mrr(chunk_ranks),
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies)), 2),
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p95": round(float(np.percentile(latencies, 95)), 2),
+            "p99": round(float(np.percentile(latencies, 99)), 2),
+        },
+        "throughput_qps": round(len(items) / elapsed, 2),
+    }
+
+def compare_reports(report, baseline, recall_tolerance=0.01, latency_tolerance=0.2):
+    """Print metric deltas against a baseline report and return the list of regressions."""
+    regressions = []
+    for name, metrics in report["configs"].items():
+        base = baseline.get("configs", {}).get(name)
+        if base is None:
+            continue
+        for key, value in metrics["recall"].items():
+            delta = value - base["recall"].get(key, value)
+            print(f"{name:<14} recall{key:<4} {value:.4f} ({delta:+.4f})")
+            if delta < -recall_tolerance:
+                regressions.append(f"{name} recall{key} dropped by {-delta:.4f}")
+        delta = metrics["mrr"] - base["mrr"]
+        print(f"{name:<14} mrr        {metrics['mrr']:.4f} ({delta:+.4f})")
+        if delta < -recall_tolerance:
+            regressions.append(f"{name} mrr dropped by {-delta:.4f}")
+        p50, base_p50 = metrics["latency_ms"]["p50"], base["latency_ms"]["p50"]
+        print(f"{name:<14} p50 ms     {p50:.2f} ({p50 - base_p50:+.2f})")
+        if base_p50 and p50 > base_p50 * (1 + latency_tolerance):
+            regressions.append(f"{name} p50 latency rose from {base_p50:.2f} to {p50:.2f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HDBRetriever recall, MRR and latency over qa_split.json.")
+    parser.add_argument("--qa-path", type=str, default=str(QA_SPLIT_PATH), help="qa_split.json or qa_pairs.json")
+    parser.add_argument("--split", type=str, default="all", help="Split to use from qa_split.json (train/dev/test/all)")
+    parser.add_argument("--embed-model", type=str, default="local:BAAI/bge-small-en-v1.5", help="LlamaIndex embed model spec; local:* runs offline")
+    parser.add_argument("--vector-store", type=str, default="simple", choices=["simple", "mmap"], help="Vector store used when building the benchmark index")
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS), help="Retriever configurations to run")
+    parser.add_argument("--k", type=int, default=10, help="Depth retrieved per question")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: data/benchmarks/retrieval_<commit>.json)")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier report to compare against; exits 1 on regression")
+    args = parser.parse_args()
+
+    items = load_ground_truth(args.qa_path, args.split)[:args.limit]
+    if not items:
+        print(f"No questions with source context found in {args.qa_path}")
+        sys.exit(1)
+
+    # A separate index per embedding model, so the benchmark never mixes vector spaces
+    Settings.embed_model = resolve_embed_model(args.embed_model)
+    model_slug = re.sub(r"[^A-Za-z0-9]+", "_", args.embed_model).strip("_")
+    if args.vector_store != "simple":
+        model_slug += f"_{args.vector_store}"
+    storage_dir = DATA_DIR / "benchmark_index" / model_slug
+    start = time.perf_counter()
+    index = get_hdb_index(storage_dir=storage_dir, vector_store=args.vector_store)
+    load_seconds = time.perf_counter() - start
+    print(f"Index ready in {load_seconds:.2f}s ({args.vector_store} vector store)")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "embed_model": args.embed_model,
+        "vector_store": args.vector_store,
+        "index_load_seconds": round(load_seconds, 3),
+        "qa_path": args.qa_path,
+        "split": args.split,
+        "num_questions": len(items),
+        "k": args.k,
+        "configs": {},
+    }
+    for name in args.configs:
+        retriever = HDBRetriever(index=index, k=args.k, storage_dir=storage_dir, **CONFIGS[name])
+        metrics = evaluate_config(retriever, items, args.k)
+        report["configs"][name] = metrics
+        recall = ", ".join(f"R{key}={value:.3f}" for key, value in metrics["recall"].items())
+        print(f"{name:<14} {recall}, MRR={metrics['mrr']:.3f}, "
+              f"p50={metrics['latency_ms']['p50']:.1f} ms, {metrics['throughput_qps']:.1f} q/s")
+
+    output = Path(args.output) if args.output else REPORTS_DIR / f"retrieval_{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
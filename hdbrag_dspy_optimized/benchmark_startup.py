@@ -0,0 +1,115 @@
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from benchmark_utils import REPORTS_DIR, git_commit
+
+# Modules app.py needs before it can answer, timed in a fresh interpreter each
+IMPORT_MODULES = ["app", "dspy", "llama_index.core", "src.retriever", "src.model"]
+QUESTION = "What is the Enhanced CPF Housing Grant?"
+PROMPT_MARKER = "You:"
+ANSWER_MARKER = "-" * 50
+
+def time_import(module):
+    """Seconds to import `module` in a new interpreter."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+class OutputWatcher:
+    """Collects a child's stdout on a thread and records when each marker first appears."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ""
+        self._cond = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while True:
+            # read1 returns as soon as anything is available, so prompts without a newline arrive
+            data = self.stream.read1(4096)
+            with self._cond:
+                if not data:
+                    self.buffer += "\0"
+                    self._cond.notify_all()
+                    return
+                self.buffer += data.decode("utf-8", errors="replace")
+                self._cond.notify_all()
+
+    def wait_for(self, marker, start=0, timeout=600):
+        """Wait until `marker` appears after offset `start`; returns the offset after it."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while marker not in self.buffer[start:]:
+                remaining = deadline - time.monotonic()
+                if "\0" in self.buffer or remaining <= 0:
+                    raise RuntimeError(f"{marker!r} not printed; output so far:\n{self.buffer[-2000:]}")
+                self._cond.wait(remaining)
+            return self.buffer.index(marker, start) + len(marker)
+
+def time_first_answer(model, fast_start, question=QUESTION, timeout=600):
+    """Seconds from launching app.py to its prompt, and to the end of its first answer."""
+    command = [sys.executable, "-u", "app.py", "--model", model, "--no-stream"]
+    if fast_start:
+        command.append("--fast-start")
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        output = OutputWatcher(process.stdout)
+        offset = output.wait_for(PROMPT_MARKER, timeout=timeout)
+        prompt_seconds = time.perf_counter() - start
+        # Ask straight away, as an impatient user would
+        process.stdin.write(f"{question}\n".encode("utf-8"))
+        process.stdin.flush()
+        output.wait_for(ANSWER_MARKER, start=offset, timeout=timeout)
+        answer_seconds = time.perf_counter() - start
+        process.stdin.write(b"quit\n")
+        process.stdin.flush()
+        process.wait(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return prompt_seconds, answer_seconds
+
+def summarize(values):
+    return {"median": round(float(np.median(values)), 3), "min": round(float(min(values)), 3), "runs": len(values)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py import time, time-to-prompt and time-to-first-answer.")
+    parser.add_argument("--model", type=str, default="ollama", choices=["openai", "ollama"], help="Model app.py answers with")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement")
+    parser.add_argument("--imports-only", action="store_true", help="Skip the end-to-end runs, which need the LM")
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: data/benchmarks/startup_<commit>.json)")
+    args = parser.parse_args()
+
+    report = {"commit": git_commit(), "timestamp": time.time(), "model": args.model, "imports": {}, "app": {}}
+
+    # 1. Import time of each module, in a fresh interpreter every run
+    for module in IMPORT_MODULES:
+        report["imports"][module] = summarize([time_import(module) for _ in range(args.repeat)])
+        print(f"import {module:<18} {report['imports'][module]['median']:.3f}s")
+
+    # 2. Time to prompt and to the first answer, loading eagerly and with --fast-start
+    if not args.imports_only:
+        for mode, fast_start in (("eager", False), ("fast_start", True)):
+            runs = [time_first_answer(args.model, fast_start) for _ in range(args.repeat)]
+            report["app"][mode] = {
+                "time_to_prompt_s": summarize([prompt for prompt, _ in runs]),
+                "time_to_first_answer_s": summarize([answer for _, answer in runs]),
+            }
+            print(
+                f"{mode:<11} prompt {report['app'][mode]['time_to_prompt_s']['median']:.2f}s  "
+                f"first answer {report['app'][mode]['time_to_first_answer_s']['median']:.2f}s"
+            )
+
+    output = Path(args.output) if args.output else REPORTS_DIR / f"startup_{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report saved to {output}")
+
+if __name__ == "__main__":
+    main()
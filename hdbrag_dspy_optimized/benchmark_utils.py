@@ -0,0 +1,12 @@
+import subprocess
+from pathlib import Path
+
+# Kept free of dspy / llama_index imports so light benchmarks start fast
+REPORTS_DIR = Path(__file__).resolve().parent / "data" / "benchmarks"
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,86 @@
+import json
+import os
+import zlib
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+import numpy as np
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+import src.rerank
+import src.retriever
+
+class HashEmbedding(MockEmbedding):
+    """Offline embedding: the sum of a fixed random vector per word, so shared words mean similar vectors."""
+    def _vector(self, text):
+        vector = np.zeros(self.embed_dim)
+        for word in text.lower().split():
+            vector += np.random.default_rng(zlib.crc32(word.encode("utf-8"))).normal(size=self.embed_dim)
+        return vector.tolist()
+
+    def _get_query_embedding(self, query):
+        return self._vector(query)
+
+    def _get_text_embedding(self, text):
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts):
+        return [self._vector(text) for text in texts]
+
+# Six pages (file names) with one topic each
+TOPICS = {
+    "enhanced-cpf-housing-grant": "grant eligibility income ceiling",
+    "minimum-occupation-period": "minimum occupation period rules",
+    "fresh-start-housing-scheme": "fresh start housing scheme",
+    "singles-scheme": "singles scheme age 35",
+    "housing-loan": "housing loan from HDB or a bank",
+    "priority-schemes": "priority schemes for married couples with a child",
+}
+
+class WordOverlapCrossEncoder:
+    """Stands in for the cross-encoder: scores a pair by the words the query and passage share."""
+    def predict(self, pairs, **kwargs):
+        return np.array([float(len(set(q.lower().split()) & set(p.lower().split()))) for q, p in pairs])
+
+class OfflineRerank:
+    def __init__(self, model=None, top_n=3):
+        self._model = WordOverlapCrossEncoder()
+        self.top_n = top_n
+
+def make_chunks(n=24):
+    chunks = []
+    for i in range(n):
+        page, topic = list(TOPICS.items())[i % len(TOPICS)]
+        # Stored like process_file does, with the file name's dashes as underscores
+        doc_id = page.replace("-", "_")
+        chunks.append({
+            "chunk_id": f"{doc_id}_{i}", "doc_id": doc_id, "source": f"{page}.html", "source_path": f"{page}.html",
+            "section": topic.title(), "text": f"[{topic.title()}] Chunk {i} explains the {topic}. Detail number {i * 7}.",
+        })
+    return chunks
+
+def write_chunks(path, chunks):
+    path.write_text(json.dumps(chunks), encoding="utf-8")
+    return path
+
+@pytest.fixture
+def offline_models(monkeypatch):
+    """Deterministic offline embedding, LLM and reranker for the duration of a test."""
+    embed_model, llm = Settings._embed_model, Settings._llm
+    Settings.embed_model = HashEmbedding(embed_dim=32)
+    Settings.llm = MockLLM()
+    monkeypatch.setattr(src.retriever, "SentenceTransformerRerank", OfflineRerank)
+    yield Settings.embed_model
+    Settings._embed_model, Settings._llm = embed_model, llm
+    # Drop the schedulers holding the stand-in cross-encoder
+    with src.rerank._SCHEDULERS_LOCK:
+        src.rerank._SCHEDULERS.clear()
+
+@pytest.fixture
+def chunks_path(tmp_path):
+    return write_chunks(tmp_path / "chunks.json", make_chunks())
+
+@pytest.fixture
+def hdb_index(offline_models, chunks_path, tmp_path):
+    """A small index over `chunks_path`, persisted to tmp_path / "index_storage"."""
+    return src.retriever.get_hdb_index(data_path=chunks_path, storage_dir=tmp_path / "index_storage")
@@ -2,11 +2,19 @@ import dspy
 import json
 import random
 import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from difflib import SequenceMatcher
 from dspy import settings
 from dotenv import load_dotenv
 from src.retriever import get_hdb_index
 from src.model import HDBRAG
-from src.signatures import JudgeQA
+from src.signatures import JudgeQA, JudgeQABatch
+from src.cache import RetrievalCache, RetrievalSnapshot, VerdictStore, normalize_answer
+from src.lm_limiter import AdaptiveLM, limiter_stats, max_concurrency
+from src import telemetry
 
 # Configuration
 QA_SPLIT_PATH = 'data/qa_split.json'
@@ -14,7 +22,22 @@ OPTIMIZED_RAG_PATH = "data/optimized_rag_qwen3.json"
 EVAL_RESULTS_PATH = "data/evaluation_results.json"
 STUDENT_MODEL = 'ollama/qwen3:0.6b'
 JUDGE_MODEL = 'ollama/qwen3:0.6b'
+JUDGE_VERDICTS_PATH = 'data/judge_verdicts.jsonl'
+RETRIEVAL_CACHE_PATH = 'data/retrieval_cache.sqlite'  # query embeddings and rerank scores, reused across runs
+# Retrieval results per question and index version, replayed instead of re-retrieving during
+# evaluation and MIPROv2 trials (which only change prompts and demos). False retrieves live.
+USE_RETRIEVAL_SNAPSHOT = True
+RETRIEVAL_SNAPSHOT_PATH = 'data/retrieval_snapshot.sqlite'
+JUDGE_BATCH_SIZE = 4  # triples per judge prompt; 1 disables batched judging
+JUDGE_BATCH_WAIT = 0.05  # seconds to wait for concurrent metric calls to join a batch
+ANSWER_MATCH_RATIO = 0.95  # near-exact answers are accepted without asking the judge
+# Tokens whose addition or removal flips an answer while barely changing its text
+NEGATIONS = frozenset({"not", "no", "never", "none", "nor", "neither", "cannot", "without", "t", "nt"})
+NEGATING_PREFIXES = ("in", "un", "non", "dis", "il", "im", "ir")
 OLLAMA_API_BASE = 'http://localhost:11434'
+# Adaptive retrieval thresholds to compare on dev before optimizing, e.g. (0.8, 0.9, 0.95).
+# Each run logs its score and how often expansion and HyDE were skipped.
+ADAPTIVE_THRESHOLDS = ()
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,8 +47,9 @@ def setup_dspy():
     """Initialize DSPy settings and models."""
     load_dotenv()
     
-    student = dspy.LM(STUDENT_MODEL, api_base=OLLAMA_API_BASE)
-    judge_lm = dspy.LM(JUDGE_MODEL, api_base=OLLAMA_API_BASE, cache=True, max_tokens=512, temperature=0)
+    # Both share per-model adaptive concurrency limits (see src/lm_limiter.py)
+    student = AdaptiveLM(STUDENT_MODEL, api_base=OLLAMA_API_BASE)
+    judge_lm = AdaptiveLM(JUDGE_MODEL, api_base=OLLAMA_API_BASE, cache=True, max_tokens=512, temperature=0)
     
     settings.configure(lm=student)
     return student, judge_lm
@@ -47,32 +71,164 @@ def load_split_data(file_path):
         splits[split_name] = examples
     return splits
 
-def get_metric(judge_lm):
-    """Define the metric function using a judge model."""
-    judge = dspy.Predict(JudgeQA)
-    def metric(example, pred, trace=None):
+def parse_verdict(value):
+    """Coerce a judge output ("True", "yes", 1, True, ...) to 1.0 or 0.0."""
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return 1.0 if value >= 0.5 else 0.0
+    return 1.0 if str(value).strip().lower().strip(".") in ("true", "yes", "1", "1.0", "correct") else 0.0
+
+def answers_match(gold, predicted, ratio=ANSWER_MATCH_RATIO):
+    """
+    Whether a predicted answer is close enough to the gold answer to accept it without
+    the judge. Near-identical answers only count when the words that differ add or drop
+    no negation (including prefixes such as "ineligible") and the numbers are the same.
+    """
+    gold, predicted = normalize_answer(gold), normalize_answer(predicted)
+    if not gold:
+        return False
+    if gold == predicted:
+        return True
+    if SequenceMatcher(None, gold, predicted).ratio() < ratio:
+        return False
+    gold_tokens, predicted_tokens = gold.split(), predicted.split()
+    numbers = lambda tokens: [t for t in tokens if any(c.isdigit() for c in t)]
+    if numbers(gold_tokens) != numbers(predicted_tokens):
+        return False
+    gold_counts, predicted_counts = Counter(gold_tokens), Counter(predicted_tokens)
+    differing = (gold_counts - predicted_counts) + (predicted_counts - gold_counts)
+    words = set(gold_tokens) | set(predicted_tokens)
+    for token in differing:
+        if token in NEGATIONS:
+            return False
+        if any(token.startswith(p) and token[len(p):] in words for p in NEGATING_PREFIXES):
+            return False
+    return True
+
+class JudgeMetric:
+    """
+    LM-as-judge metric with a persistent verdict store.
+
+    Each (question, gold, predicted) triple is judged at most once per judge model,
+    across evaluations, MIPROv2 minibatches and runs. Answers that match the gold
+    answer (near-)exactly are accepted without an LM call. With `batch_size > 1`,
+    metric calls arriving concurrently from evaluation threads share one judge prompt.
+    """
+    def __init__(self, judge_lm, store=None, batch_size=1, batch_wait=JUDGE_BATCH_WAIT):
+        self.judge_lm = judge_lm
+        self.model = getattr(judge_lm, "model", None)
+        self.store = store
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.judge = dspy.Predict(JudgeQA)
+        self.batch_judge = dspy.Predict(JudgeQABatch)
+        self.short_circuits = 0
+        self._pending = []
+        self._in_flight = 0   # batches being judged
+        self._lock = threading.Lock()
+
+    def __call__(self, example, pred, trace=None):
         # Guard against bad predictions
         if not hasattr(pred, "answer"):
             return 0.0
         if pred.answer is None or pred.answer.strip() == "":
             return 0.0
 
+        triple = (example.question, example.answer, pred.answer)
         try:
-            with dspy.settings.context(lm=judge_lm):
-                result = judge(
-                    question=example.question,
-                    gold_answer=example.answer,
-                    predicted_answer=pred.answer
-                )
-            # Coerce to float for Evaluate
-            return float(result.is_accurate)
+            if self.batch_size > 1:
+                return self._judge_batched(triple)
+            return self.judge_many([triple])[0]
         except Exception as e:
             logger.error(f"Judge failure: {e}")
             return 0.0
-    return metric
 
-def save_evaluation_results(label, score, model_name, file_path):
-    """Save evaluation results to a JSON file."""
+    def _cheap_verdict(self, triple):
+        """Verdict from the store or from a near-exact answer match, without calling the LM."""
+        key = VerdictStore.key(self.model, *triple) if self.store is not None else None
+        if key is not None:
+            verdict = self.store.get(key)
+            if verdict is not None:
+                return key, verdict
+        if answers_match(triple[1], triple[2]):
+            self.short_circuits += 1
+            return key, 1.0
+        return key, None
+
+    def judge_many(self, triples):
+        """Judge a list of triples, batching up to `batch_size` uncached ones per prompt."""
+        verdicts = [None] * len(triples)
+        todo = []
+        for i, triple in enumerate(triples):
+            key, verdict = self._cheap_verdict(triple)
+            if verdict is not None:
+                verdicts[i] = verdict
+            else:
+                todo.append((i, key, triple))
+
+        for start in range(0, len(todo), max(1, self.batch_size)):
+            batch = todo[start:start + max(1, self.batch_size)]
+            for (i, key, _), verdict in zip(batch, self._call_judge([t for _, _, t in batch])):
+                verdicts[i] = verdict
+                if key is not None:
+                    self.store.put(key, verdict)
+        return verdicts
+
+    def _call_judge(self, triples):
+        with dspy.settings.context(lm=self.judge_lm):
+            if len(triples) > 1:
+                items = "\n\n".join(
+                    f"[{n}] Question: {q}\nGold answer: {gold}\nPredicted answer: {predicted}"
+                    for n, (q, gold, predicted) in enumerate(triples, start=1)
+                )
+                result = self.batch_judge(items=items)
+                if isinstance(result.verdicts, list) and len(result.verdicts) == len(triples):
+                    return [parse_verdict(v) for v in result.verdicts]
+                logger.warning("Batched judge returned a malformed verdict list; judging one by one")
+
+            return [
+                parse_verdict(self.judge(question=q, gold_answer=gold, predicted_answer=predicted).is_accurate)
+                for q, gold, predicted in triples
+            ]
+
+    def _judge_batched(self, triple):
+        """
+        Queue the triple; the first caller of a window judges everything queued meanwhile.
+        A caller that finds no other judge call queued or in flight judges straight away.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((triple, future))
+            leader = len(self._pending) == 1
+            wait = leader and self._in_flight > 0
+            if leader:
+                self._in_flight += 1
+        if leader:
+            try:
+                if wait:
+                    time.sleep(self.batch_wait)
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                try:
+                    verdicts = self.judge_many([t for t, _ in batch])
+                    for (_, f), verdict in zip(batch, verdicts):
+                        f.set_result(verdict)
+                except Exception as e:
+                    for _, f in batch:
+                        f.set_exception(e)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+        return future.result()
+
+def get_metric(judge_lm, batch_size=JUDGE_BATCH_SIZE):
+    """Define the metric function using a judge model, backed by the verdict store."""
+    return JudgeMetric(judge_lm, store=VerdictStore(JUDGE_VERDICTS_PATH), batch_size=batch_size)
+
+def save_evaluation_results(label, score, model_name, file_path, stage_latencies=None, fast_path_rate=None,
+                            lm_concurrency=None):
+    """Save evaluation results (and optionally p50/p95/p99 stage latencies) to a JSON file."""
     results = {}
     try:
         with open(file_path, 'r') as f:
@@ -85,23 +241,44 @@ def save_evaluation_results(label, score, model_name, file_path):
         "model": model_name,
         "timestamp": dspy.settings.lm.history[-1]['timestamp'] if hasattr(dspy.settings.lm, 'history') and dspy.settings.lm.history else None
     }
+    if stage_latencies:
+        results[label]["stage_latencies_ms"] = stage_latencies
+    if fast_path_rate is not None:
+        results[label]["fast_path_rate"] = fast_path_rate
+    if lm_concurrency:
+        results[label]["lm_concurrency"] = lm_concurrency
     
     with open(file_path, 'w') as f:
         json.dump(results, f, indent=4)
     logger.info(f"Results for '{label}' saved to {file_path}")
 
-def run_evaluation(rag_module, devset, metric, label):
-    """Run evaluation and save results."""
+def run_evaluation(rag_module, devset, metric, label, record_latencies=True, num_threads=None):
+    """Run evaluation and save results, including per-stage latency percentiles."""
     logger.info(f"Starting {label} evaluation...")
     evaluator = dspy.Evaluate(
         devset=devset,
         metric=metric,
-        num_threads=4,
+        # Enough threads to reach the LM limiters' ceiling; the limiters decide how many calls run
+        num_threads=num_threads or max_concurrency(dspy.settings.lm, metric.judge_lm),
         display_progress=True,
     )
-    results = evaluator(rag_module)
+    histogram = telemetry.tracer.add_sink(telemetry.HistogramSink()) if record_latencies else None
+    rag_module.fast_path_stats.reset()
+    try:
+        results = evaluator(rag_module)
+    finally:
+        if histogram is not None:
+            telemetry.tracer.remove_sink(histogram)
+    stage_latencies = histogram.percentiles() if histogram is not None else None
     logger.info(f"{label.capitalize()} Evaluation Results: {results}")
-    save_evaluation_results(label, float(results.score), STUDENT_MODEL, EVAL_RESULTS_PATH)
+    fast_path_rate = None
+    if rag_module.adaptive:
+        logger.info(f"Adaptive retrieval: {rag_module.fast_path_stats}")
+        fast_path_rate = rag_module.fast_path_stats.rate()
+    lm_concurrency = limiter_stats()
+    logger.info(f"LM concurrency: {lm_concurrency}")
+    save_evaluation_results(label, float(results.score), STUDENT_MODEL, EVAL_RESULTS_PATH, stage_latencies, fast_path_rate,
+                            lm_concurrency)
     return results
 
 def main():
@@ -122,11 +299,26 @@ def main():
     
     # 3. Initialize RAG
     index = get_hdb_index()
-    rag = HDBRAG(index=index, k=3)
+    retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_PATH)
+    snapshot = RetrievalSnapshot(RETRIEVAL_SNAPSHOT_PATH) if USE_RETRIEVAL_SNAPSHOT else None
+    rag = HDBRAG(index=index, k=3, retrieval_cache=retrieval_cache, retrieval_snapshot=snapshot)
+    if snapshot is not None:
+        # Retrieve every split's questions once up front; later runs replay them
+        questions = [example.question for examples in splits.values() for example in examples]
+        start = time.perf_counter()
+        retrieved = rag.retriever.precompute(questions)
+        logger.info(
+            f"Retrieval snapshot: retrieved {retrieved} new questions in {time.perf_counter() - start:.1f}s, "
+            f"{len(snapshot)} queries stored in {RETRIEVAL_SNAPSHOT_PATH}"
+        )
     
     # 4. Initial Evaluation
     run_evaluation(rag, dev_examples, metric, "initial_dev_pre_optimization")
     run_evaluation(rag, test_examples, metric, "initial_test_pre_optimization")
+    for threshold in ADAPTIVE_THRESHOLDS:
+        adaptive_rag = HDBRAG(index=index, k=3, retrieval_cache=retrieval_cache, retrieval_snapshot=snapshot,
+                              adaptive=True, adaptive_threshold=threshold)
+        run_evaluation(adaptive_rag, dev_examples, metric, f"adaptive_{threshold}_dev_pre_optimization")
     
     # 5. Optimization
     logger.info("Starting optimization with MIPROv2...")
@@ -135,7 +327,7 @@ def main():
         auto='light',
         max_bootstrapped_demos=1,
         max_labeled_demos=1,
-        num_threads=4
+        num_threads=max_concurrency(student_lm, judge_lm)
     )
     
     optimized_rag = teleprompter.compile(
@@ -149,10 +341,17 @@ def main():
     logger.info(f"Optimized RAG saved to {OPTIMIZED_RAG_PATH}")
     
     # 6. Final Evaluation
-    final_rag = HDBRAG(index=index, k=3)
+    final_rag = HDBRAG(index=index, k=3, retrieval_cache=retrieval_cache, retrieval_snapshot=snapshot)
     final_rag.load(OPTIMIZED_RAG_PATH)
     run_evaluation(final_rag, dev_examples, metric, "final_dev_post_optimization")
     run_evaluation(final_rag, test_examples, metric, "final_test_post_optimization")
+    logger.info(
+        f"Judge: {metric.store.hits} stored verdicts reused, "
+        f"{metric.short_circuits} answer-match short circuits, {len(metric.store)} verdicts stored"
+    )
+    logger.info(f"Retrieval cache: {retrieval_cache.stats()}")
+    if snapshot is not None:
+        logger.info(f"Retrieval snapshot: {snapshot.stats()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
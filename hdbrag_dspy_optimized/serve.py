@@ -0,0 +1,327 @@
+import argparse
+import gc
+import json
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import dspy
+from dotenv import load_dotenv
+from app import setup_model
+from src.retriever import get_hdb_index
+from src.model import ADAPTIVE_THRESHOLD, HDBRAG
+from src.cache import RETRIEVAL_CACHE_PATH, RetrievalCache, SemanticCache
+from src.metadata_index import FILTER_FIELDS
+from src.rerank import rerank_stats
+from src.lm_limiter import limiter_stats
+from src import telemetry
+
+class WorkerState:
+    """
+    Admission control and warm-up status of one worker process.
+
+    At most `max_inflight` questions run at once; up to `max_queue` more wait for a slot
+    for at most `queue_timeout` seconds. Anything beyond that is rejected straight away
+    with 503, so an overloaded worker sheds load instead of piling up threads.
+    """
+    def __init__(self, rag, max_inflight=4, max_queue=16, queue_timeout=30.0):
+        self.rag = rag
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.status = "warming"
+        self.warmup_ms = None
+        self.warmup_error = None
+
+        self._slots = threading.Semaphore(max_inflight)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.running = 0
+        self.served = 0
+        self.rejected = 0
+
+    def warmup(self):
+        # Retrieval only (embedding, BM25, cross-encoder): no LM calls per worker start
+        try:
+            warmup_ms = self.rag.warmup(lm=False)
+        except Exception as e:
+            self.status = "failed"
+            self.warmup_error = str(e)
+            return
+        self.warmup_ms = round(warmup_ms, 1)
+        self.status = "ready"
+
+    @contextmanager
+    def admit(self):
+        """Yield the queue wait in ms, or None when the request has to be rejected."""
+        with self._lock:
+            if self.admitted >= self.max_inflight + self.max_queue:
+                self.rejected += 1
+                yield None
+                return
+            self.admitted += 1
+
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        try:
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                yield None
+                return
+            with self._lock:
+                self.running += 1
+            yield (time.perf_counter() - start) * 1000
+        finally:
+            with self._lock:
+                self.admitted -= 1
+                if acquired:
+                    self.running -= 1
+                    self.served += 1
+            if acquired:
+                self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "pid": os.getpid(),
+                "warmup_ms": self.warmup_ms,
+                "warmup_error": self.warmup_error,
+                "running": self.running,
+                "queued": self.admitted - self.running,
+                "served": self.served,
+                "rejected": self.rejected,
+                "rerank": rerank_stats(),
+                "lm": limiter_stats(),
+                "fast_path_rate": round(self.rag.fast_path_stats.rate(), 4) if self.rag.adaptive else None,
+            }
+
+def source_payload(context):
+    return [{"text": c.long_text} for c in context]
+
+def parse_filters(filters):
+    """Check a request's "filters" object; returns it, or None if absent. Raises ValueError."""
+    if filters is None:
+        return None
+    if not isinstance(filters, dict) or set(filters) - set(FILTER_FIELDS):
+        raise ValueError(f'"filters" must be an object with keys among {list(FILTER_FIELDS)}')
+    for values in filters.values():
+        values = [values] if isinstance(values, str) else values
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError('"filters" values must be a string or a list of strings')
+    return filters
+
+class HDBRAGHandler(BaseHTTPRequestHandler):
+    """
+    GET  /healthz  liveness, always 200 while the worker runs
+    GET  /readyz   200 once warm-up finished, 503 while warming or if it failed
+    POST /ask      {"question": "...", "stream": false}; with "stream": true the reply is
+                   server-sent events: `sources` as soon as retrieval is done, `token` for
+                   each piece of the answer as the LM writes it, then `answer`.
+                   An optional "filters" object, e.g. {"doc_id": "singles"}, limits the
+                   answer to those pages or sections
+    """
+    server_version = "HDBRAG/0.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event(self, event, payload):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self.send_json(HTTPStatus.OK, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/readyz":
+            stats = self.state.stats()
+            ready = stats["status"] == "ready"
+            self.send_json(HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE, stats)
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            question = str(request["question"]).strip()
+        except (ValueError, KeyError, TypeError):
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": 'expected a JSON body with "question"'})
+            return
+        if not question:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": "empty question"})
+            return
+        try:
+            filters = parse_filters(request.get("filters"))
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        if self.state.status != "ready":
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": f"worker {self.state.status}"}, {"Retry-After": "5"})
+            return
+
+        with self.state.admit() as queue_wait_ms:
+            if queue_wait_ms is None:
+                self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "server busy"}, {"Retry-After": "1"})
+                return
+            if request.get("stream"):
+                self.stream_answer(question, queue_wait_ms, filters)
+            else:
+                self.answer(question, queue_wait_ms, filters)
+
+    def answer(self, question, queue_wait_ms, filters=None):
+        try:
+            prediction = self.state.rag(question=question, filters=filters)
+        except Exception as e:
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        self.send_json(HTTPStatus.OK, {
+            "answer": prediction.answer,
+            "sources": source_payload(prediction.context),
+            "queue_wait_ms": round(queue_wait_ms, 1),
+        })
+
+    def stream_answer(self, question, queue_wait_ms, filters=None):
+        # No Content-Length: the event stream ends when the connection closes
+        self.close_connection = True
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event, payload in self.state.rag.stream(question, tokens=True, filters=filters):
+                if event == "sources":
+                    self.send_event("sources", {"sources": source_payload(payload), "queue_wait_ms": round(queue_wait_ms, 1)})
+                elif event == "token":
+                    self.send_event("token", {"text": payload})
+                elif event == "answer":
+                    self.send_event("answer", {"answer": payload.answer})
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        except Exception as e:
+            self.send_event("error", {"error": str(e)})
+
+def run_worker(server, rag, args):
+    """Serve on the (inherited) listening socket until SIGTERM."""
+    if args.torch_threads:
+        # Keep N workers from each starting one intra-op thread per core
+        import torch
+        torch.set_num_threads(args.torch_threads)
+
+    server.state = WorkerState(rag, max_inflight=args.max_inflight, max_queue=args.max_queue,
+                               queue_timeout=args.queue_timeout)
+    threading.Thread(target=server.state.warmup, name="warmup", daemon=True).start()
+    # Workers forked by a restart inherit the parent's handlers
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve HDBRAG over HTTP with pre-forked workers")
+    parser.add_argument("--model", type=str, default="ollama", choices=["openai", "ollama"], help="Model to use for answers")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes forked after the index and models are loaded")
+    parser.add_argument("--max-inflight", type=int, default=4, help="Questions answered concurrently per worker")
+    parser.add_argument("--max-queue", type=int, default=16, help="Questions waiting per worker before returning 503")
+    parser.add_argument("--queue-timeout", type=float, default=30.0, help="Seconds a question may wait for a slot")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Cross-encoder threads per worker")
+    parser.add_argument("--cache", action="store_true", help="Serve paraphrased questions from the semantic answer cache, shared by workers through data/semantic_cache.sqlite")
+    parser.add_argument("--retrieval-cache", action="store_true", help="Reuse query embeddings and rerank scores from data/retrieval_cache.sqlite")
+    parser.add_argument("--adaptive", action="store_true", help="Skip query expansion and HyDE when the plain question retrieves confidently")
+    parser.add_argument("--adaptive-threshold", type=float, default=ADAPTIVE_THRESHOLD, help="Top rerank score needed to skip expansion")
+    parser.add_argument("--trace-file", type=str, help="Append per-query stage timings to this JSONL file")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    # 1. Load everything once in the parent; forked workers share it copy-on-write
+    # (an index built with vector_store="mmap" is shared through the page cache)
+    print(f"🤖 Loading HDB RAG Expert with model: {args.model}...")
+    dspy.settings.configure(lm=setup_model(args.model))
+    index = get_hdb_index()
+    cache = SemanticCache() if args.cache else None
+    retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_PATH) if args.retrieval_cache else None
+    rag = HDBRAG(index=index, k=3, cache=cache, retrieval_cache=retrieval_cache,
+                 adaptive=args.adaptive, adaptive_threshold=args.adaptive_threshold)
+    rag.retriever.bm25_retriever  # load the persisted BM25 statistics now
+    rag.retriever.reranker  # and the cross-encoder, which is otherwise loaded on first use
+    if args.trace_file:
+        telemetry.tracer.add_sink(telemetry.JSONLSink(args.trace_file))
+
+    # 2. Bind before forking so all workers accept on the same socket
+    server = ThreadingHTTPServer((args.host, args.port), HDBRAGHandler)
+    server.verbose = args.verbose
+    if args.workers <= 1:
+        print(f"✅ Serving on http://{args.host}:{args.port} (1 worker)")
+        run_worker(server, rag, args)
+        return
+
+    # Objects loaded so far are never freed; keep the GC from touching (and copying) their pages
+    gc.freeze()
+
+    # 3. Fork workers and restart any that die
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(server, rag, args)
+            finally:
+                os._exit(0)
+        return pid
+
+    workers = {spawn() for _ in range(args.workers)}
+    print(f"✅ Serving on http://{args.host}:{args.port} ({args.workers} workers)")
+
+    stopping = False
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️  Worker {pid} exited, restarting")
+            workers.add(spawn())
+    server.server_close()
+    print("👋 Server stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import math
+import warnings
+from pathlib import Path
+import numpy as np
+
+# Search-time knobs; everything else in ann_params is a build parameter
+SEARCH_PARAMS = ("ef_search", "nprobe")
+
+class HNSWIndex:
+    """
+    HNSW graph over L2-normalised rows (hnswlib, inner-product space).
+
+    `M` and `ef_construction` are fixed at build time. `ef_search` trades recall for
+    latency per query and can be changed on a loaded index.
+    """
+    kind = "hnsw"
+    search_param = "ef_search"
+    build_param_names = ("M", "ef_construction")
+    file_name = "ann_hnsw.bin"
+    # Distances are exact, so no extra candidates are needed for re-scoring
+    refine_factor = 1
+
+    def __init__(self, dim, M=16, ef_construction=200, ef_search=64):
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("ann='hnsw' requires hnswlib (pip install hnswlib)") from e
+        return hnswlib
+
+    def build_params(self):
+        return {"M": self.M, "ef_construction": self.ef_construction}
+
+    def build(self, matrix):
+        hnswlib = self._hnswlib()
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.init_index(max_elements=max(len(matrix), 1), M=self.M, ef_construction=self.ef_construction)
+        if len(matrix):
+            self._index.add_items(np.asarray(matrix, dtype=np.float32), np.arange(len(matrix)))
+        return self
+
+    def search(self, query, k):
+        """Return candidate row ids for one query, best first."""
+        count = self._index.get_current_count()
+        k = min(k, count)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        self._index.set_ef(max(self.ef_search, k))
+        labels, _ = self._index.knn_query(np.asarray(query, dtype=np.float32).reshape(1, -1), k=k)
+        return labels[0].astype(np.int64)
+
+    def save(self, path):
+        self._index.save_index(str(path))
+
+    def load(self, path, num_rows):
+        hnswlib = self._hnswlib()
+        self._index = hnswlib.Index(space="ip", dim=self.dim)
+        self._index.load_index(str(path), max_elements=max(num_rows, 1))
+        return self
+
+class IVFPQIndex:
+    """
+    Inverted file with product-quantised residuals (faiss IndexIVFPQ, inner product).
+
+    `nlist`, `m` (sub-quantizers) and `nbits` are fixed at build time and clamped to
+    what the corpus size and dimension allow. `nprobe` is the number of lists scanned
+    per query, the recall/latency knob. PQ distances are coarse, so `refine_factor`
+    times more candidates are returned for exact re-scoring against the full matrix.
+    """
+    kind = "ivfpq"
+    search_param = "nprobe"
+    build_param_names = ("nlist", "m", "nbits", "refine_factor")
+    file_name = "ann_ivfpq.faiss"
+
+    def __init__(self, dim, nlist=1024, m=16, nbits=8, nprobe=16, refine_factor=4):
+        self.dim = dim
+        self.refine_factor = refine_factor
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self._index = None
+
+    @staticmethod
+    def _faiss():
+        try:
+            import faiss
+        except ImportError as e:
+            raise ImportError("ann='ivfpq' requires faiss (pip install faiss-cpu)") from e
+        return faiss
+
+    def build_params(self):
+        return {"nlist": self.nlist, "m": self.m, "nbits": self.nbits, "refine_factor": self.refine_factor}
+
+    def build(self, matrix):
+        faiss = self._faiss()
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        n = len(matrix)
+        # faiss k-means wants at least 39 training points per centroid, both for the
+        # coarse lists and for the 2**nbits codes of each sub-quantizer
+        self.nlist = max(1, min(self.nlist, n // 39))
+        self.nbits = max(1, min(self.nbits, int(math.log2(max(n // 39, 2)))))
+        self.m = max(d for d in range(1, min(self.m, self.dim) + 1) if self.dim % d == 0)
+
+        quantizer = faiss.IndexFlatIP(self.dim)
+        self._index = faiss.IndexIVFPQ(quantizer, self.dim, self.nlist, self.m, self.nbits, faiss.METRIC_INNER_PRODUCT)
+        if n:
+            self._index.train(matrix)
+            self._index.add(matrix)
+        return self
+
+    def search(self, query, k):
+        """Return candidate row ids for one query, best first."""
+        k = min(k, self._index.ntotal)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        self._index.nprobe = self.nprobe
+        _, labels = self._index.search(np.asarray(query, dtype=np.float32).reshape(1, -1), k)
+        labels = labels[0]
+        return labels[labels >= 0].astype(np.int64)
+
+    def save(self, path):
+        self._faiss().write_index(self._index, str(path))
+
+    def load(self, path, num_rows):
+        self._index = self._faiss().read_index(str(path))
+        return self
+
+ANN_INDEXES = {cls.kind: cls for cls in (HNSWIndex, IVFPQIndex)}
+
+def ann_params_for(kind, params):
+    """
+    The entries of `params` that apply to `kind`: its build parameters and its search
+    knob. The rest (e.g. `nprobe` for hnsw) are dropped with a warning.
+    """
+    if kind not in ANN_INDEXES:
+        raise ValueError(f"Unknown ann {kind!r}, expected one of {sorted(ANN_INDEXES)}")
+    cls = ANN_INDEXES[kind]
+    names = (*cls.build_param_names, cls.search_param)
+    ignored = sorted(set(params) - set(names))
+    if ignored:
+        warnings.warn(f"ann={kind!r} ignores {ignored}; it takes {list(names)}", stacklevel=3)
+    return {key: value for key, value in params.items() if key in names}
+
+def make_ann_index(kind, dim, **params):
+    """Create an unbuilt ANN index of the given kind ("hnsw" or "ivfpq"), ignoring parameters of other kinds."""
+    params = ann_params_for(kind, params)
+    return ANN_INDEXES[kind](dim, **params)
+
+def load_ann_index(directory, kind, dim, num_rows, params):
+    """Open an ANN index saved by `save` in `directory`."""
+    index = make_ann_index(kind, dim, **params)
+    return index.load(Path(directory) / index.file_name, num_rows)
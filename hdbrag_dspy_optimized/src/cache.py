@@ -0,0 +1,558 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import dspy
+from llama_index.core import Settings
+from .retriever import DATA_DIR, STORAGE_DIR, get_index_version
+
+SEMANTIC_CACHE_PATH = DATA_DIR / "semantic_cache.sqlite"
+JUDGE_VERDICTS_PATH = DATA_DIR / "judge_verdicts.jsonl"
+RETRIEVAL_CACHE_PATH = DATA_DIR / "retrieval_cache.sqlite"
+RETRIEVAL_SNAPSHOT_PATH = DATA_DIR / "retrieval_snapshot.sqlite"
+
+def normalize_answer(text):
+    """Lowercase, drop punctuation and collapse whitespace, for hashing and answer matching."""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", (text or "").lower())).strip()
+
+def normalize_query(text):
+    """Collapse whitespace, so re-typed or re-parsed queries share cache entries."""
+    return " ".join((text or "").split())
+
+class LRUCache:
+    """Thread-safe in-process LRU map holding at most `max_entries` items."""
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+class RetrievalCache:
+    """
+    Two-level cache for HDBRetriever: query embeddings and cross-encoder scores.
+
+    Embeddings are keyed by embed model and normalized query text. Rerank scores are
+    keyed by reranker model, query, chunk_id and a hash of the chunk content, so
+    an edited chunk is simply a miss. Level one is an in-process LRU. With a `path`,
+    level two is a SQLite file shared by runs and processes, pruned back to
+    `max_disk_entries` rows per table by least-recent use.
+    """
+    def __init__(self, path=None, max_memory_entries=50000, max_disk_entries=1000000):
+        self.path = Path(path) if path else None
+        self.max_disk_entries = max_disk_entries
+        self.embeddings = LRUCache(max_memory_entries)
+        self.scores = LRUCache(max_memory_entries)
+        self.hits = {"embedding": 0, "score": 0}
+        self.misses = {"embedding": 0, "score": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+
+    def __deepcopy__(self, memo):
+        # Shared by every copy of a program, like the tracer
+        return self
+
+    def _db(self):
+        # One connection per process (serve.py forks after the cache is created)
+        if self._conn is None or self._conn_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for table, column in (("embeddings", "vector BLOB"), ("scores", "score REAL")):
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, {column}, last_used REAL)"
+                )
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def embedding_key(model, query):
+        return hashlib.sha256(f"{model}\x1f{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def score_key(model, query, chunk_id, text_hash):
+        parts = [model, normalize_query(query), chunk_id, text_hash]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _get_many(self, kind, memory, table, keys, decode):
+        values = [memory.get(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing and self.path is not None:
+            found = {}
+            with self._lock:
+                db = self._db()
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = db.execute(
+                        f"SELECT key, {'vector' if table == 'embeddings' else 'score'} FROM {table} "
+                        f"WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    found.update((key, decode(value)) for key, value in rows)
+                if found:
+                    db.executemany(f"UPDATE {table} SET last_used = ? WHERE key = ?",
+                                   [(time.time(), key) for key in found])
+                    db.commit()
+            for key, value in found.items():
+                memory.put(key, value)
+            values = [found.get(key, value) if value is None else value for key, value in zip(keys, values)]
+        hits = sum(value is not None for value in values)
+        with self._lock:
+            self.hits[kind] += hits
+            self.misses[kind] += len(values) - hits
+        return values
+
+    def _put_many(self, memory, table, items, encode):
+        for key, value in items:
+            memory.put(key, value)
+        if self.path is None or not items:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                           [(key, encode(value), now) for key, value in items])
+            self._writes += len(items)
+            if self._writes >= 1000:
+                self._writes = 0
+                db.execute(
+                    f"DELETE FROM {table} WHERE key IN (SELECT key FROM {table} ORDER BY last_used DESC "
+                    f"LIMIT -1 OFFSET ?)", (self.max_disk_entries,)
+                )
+            db.commit()
+
+    def get_embeddings(self, model, queries):
+        """Cached embeddings for the queries, None where missing."""
+        keys = [self.embedding_key(model, q) for q in queries]
+        return self._get_many("embedding", self.embeddings, "embeddings", keys,
+                              lambda blob: np.frombuffer(blob, dtype=np.float32).tolist())
+
+    def put_embeddings(self, model, queries, embeddings):
+        items = [(self.embedding_key(model, q), list(e)) for q, e in zip(queries, embeddings)]
+        self._put_many(self.embeddings, "embeddings", items,
+                       lambda vector: np.asarray(vector, dtype=np.float32).tobytes())
+
+    def get_scores(self, model, entries):
+        """Cached scores for (query, chunk_id, content_hash) entries, None where missing."""
+        keys = [self.score_key(model, *entry) for entry in entries]
+        return self._get_many("score", self.scores, "scores", keys, float)
+
+    def put_scores(self, model, entries, scores):
+        items = [(self.score_key(model, *entry), float(score)) for entry, score in zip(entries, scores)]
+        self._put_many(self.scores, "scores", items, float)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses),
+                    "memory_entries": {"embedding": len(self.embeddings), "score": len(self.scores)}}
+
+class RetrievalSnapshot:
+    """
+    Table of retrieval results for `SnapshotRetriever`: the node ids and scores each query
+    retrieved, plus its BM25/vector agreement, keyed by index scope (its storage dir),
+    index version, retriever settings and normalized query text.
+
+    Rows are held in memory and, with a `path`, in a SQLite file that several indexes can
+    share. Rows recorded against another version of the same index are never returned,
+    and are deleted the first time that index is used with the file.
+    """
+    def __init__(self, path=RETRIEVAL_SNAPSHOT_PATH):
+        self.path = Path(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}  # (scope, index_version) -> {key: entry}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _db(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(snapshot)")]
+            if columns and "scope" not in columns:
+                # Written before rows were scoped per index: cannot tell whose they are
+                self._conn.execute("DROP TABLE snapshot")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshot (key TEXT PRIMARY KEY, scope TEXT, index_version TEXT, entry TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS snapshot_scope ON snapshot (scope)")
+        return self._conn
+
+    @staticmethod
+    def key(scope, index_version, settings, query):
+        parts = [scope or "", index_version or "", settings, normalize_query(query)]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _load(self, scope, index_version):
+        # Called with the lock held; returns the rows of this index version
+        rows = self._rows.get((scope, index_version))
+        if rows is not None:
+            return rows
+        for loaded in [loaded for loaded in self._rows if loaded[0] == scope]:
+            del self._rows[loaded]
+        rows = {}
+        if self.path is not None:
+            db = self._db()
+            db.execute("DELETE FROM snapshot WHERE scope = ? AND index_version IS NOT ?", (scope, index_version))
+            db.commit()
+            rows = {
+                key: json.loads(entry)
+                for key, entry in db.execute(
+                    "SELECT key, entry FROM snapshot WHERE scope = ? AND index_version IS ?", (scope, index_version)
+                )
+            }
+        self._rows[(scope, index_version)] = rows
+        return rows
+
+    def get(self, scope, index_version, settings, queries):
+        """Stored entries for the queries, None where missing."""
+        with self._lock:
+            rows = self._load(scope, index_version)
+            entries = [rows.get(self.key(scope, index_version, settings, q)) for q in queries]
+            hits = sum(entry is not None for entry in entries)
+            self.hits += hits
+            self.misses += len(entries) - hits
+        return entries
+
+    def put(self, scope, index_version, settings, queries, entries):
+        items = [(self.key(scope, index_version, settings, q), entry) for q, entry in zip(queries, entries)]
+        with self._lock:
+            self._load(scope, index_version).update(items)
+            if self.path is not None:
+                db = self._db()
+                db.executemany("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?)",
+                               [(key, scope, index_version, json.dumps(entry)) for key, entry in items])
+                db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(rows) for rows in self._rows.values())
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": sum(len(rows) for rows in self._rows.values())}
+
+# Live SemanticCache instances, flushed at exit and reset in forked children by one
+# module-level hook each rather than a registration per instance
+_SEMANTIC_CACHES = weakref.WeakSet()
+
+def _flush_semantic_caches():
+    for cache in list(_SEMANTIC_CACHES):
+        cache.flush()
+
+def _reset_semantic_caches_after_fork():
+    for cache in list(_SEMANTIC_CACHES):
+        cache._after_fork()
+
+atexit.register(_flush_semantic_caches)
+os.register_at_fork(after_in_child=_reset_semantic_caches_after_fork)
+
+class SemanticCache:
+    """
+    Answer cache for HDBRAG keyed by question meaning rather than exact text.
+
+    A question is embedded with the index's embedding model and served from the cache
+    when a stored question is at least `threshold` cosine-similar. Entries are evicted
+    LRU once `max_entries` is reached and expire after `ttl_seconds`. The cache is
+    dropped whenever the index version changes.
+
+    Entries are matched in memory. With a `path` they are also written to a SQLite file
+    by a background thread, one row at a time, so storing an answer never blocks the
+    request. Forked serve.py workers share the file: each only inserts and touches its
+    own rows, and picks up the rows of the others at most every `refresh_seconds`.
+    """
+    def __init__(self, path=SEMANTIC_CACHE_PATH, threshold=0.92, max_entries=1000,
+                 ttl_seconds=7 * 24 * 3600, embed_model=None, storage_dir=STORAGE_DIR, refresh_seconds=5.0):
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed_model = embed_model
+        self.storage_dir = storage_dir
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._matrix = None          # stacked embeddings of _matrix_keys
+        self._matrix_keys = []
+        self._last_rowid = 0         # newest row read from the file
+        self._refreshed_at = 0.0
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._pending = None         # writes for the background thread
+        self.index_version = get_index_version(storage_dir)
+        self.hits = 0
+        self.misses = 0
+        self.load()
+        _SEMANTIC_CACHES.add(self)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _after_fork(self):
+        # Locks held by the parent's threads at fork time would never be released here,
+        # and writes queued before the fork belong to the parent
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending = None
+
+    def _db(self):
+        # Called with _db_lock held; one connection per process (serve.py forks after the cache is created)
+        if self._conn is None or self._conn_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (question TEXT PRIMARY KEY, index_version TEXT, "
+                "embedding BLOB, answer TEXT, context TEXT, created_at REAL, last_used REAL)"
+            )
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _write(self, sql, params=()):
+        """Queue a statement for the background writer."""
+        if self.path is None:
+            return
+        if self._pending is None:
+            self._pending = queue.Queue()
+            # The writer only holds a weak reference, so it does not keep the cache alive,
+            # and is woken up to exit once the cache is collected
+            threading.Thread(target=self._write_loop, args=(weakref.ref(self), self._pending),
+                             name="semantic-cache-writer", daemon=True).start()
+            weakref.finalize(self, self._pending.put, None)
+        self._pending.put((sql, params))
+
+    @staticmethod
+    def _write_loop(cache_ref, pending):
+        while True:
+            writes = [pending.get()]
+            while True:
+                try:
+                    writes.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            cache = cache_ref()
+            try:
+                if cache is None:
+                    return
+                with cache._db_lock:
+                    db = cache._db()
+                    for sql, params in writes:
+                        db.execute(sql, params)
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"Semantic cache write failed: {e}")
+            finally:
+                del cache
+                for _ in writes:
+                    pending.task_done()
+
+    def flush(self):
+        """Wait until queued writes are on disk."""
+        if self._pending is not None:
+            self._pending.join()
+
+    def embed(self, question):
+        """Embed and L2-normalise a question so cosine similarity is a dot product."""
+        embed_model = self.embed_model or Settings.embed_model
+        vector = np.asarray(embed_model.get_query_embedding(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_index_version(self):
+        version = get_index_version(self.storage_dir)
+        if version != self.index_version:
+            self._entries.clear()
+            self._matrix = None
+            self._last_rowid = 0
+            self.index_version = version
+            self._write("DELETE FROM entries WHERE index_version IS NOT ?", (version,))
+
+    def _expire(self):
+        if self.ttl_seconds is None:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+            self._write("DELETE FROM entries WHERE created_at < ?", (cutoff,))
+
+    def _refresh(self):
+        # Called with the lock held: read rows added since the last read, by this or another process
+        if self.path is None or not self.path.exists():
+            return
+        self._refreshed_at = time.monotonic()
+        try:
+            with self._db_lock:
+                rows = self._db().execute(
+                    "SELECT rowid, question, embedding, answer, context, created_at FROM entries "
+                    "WHERE rowid > ? AND index_version IS ? ORDER BY last_used",
+                    (self._last_rowid, self.index_version),
+                ).fetchall()
+        except sqlite3.Error:
+            return
+        for rowid, question, embedding, answer, context, created_at in rows:
+            self._last_rowid = max(self._last_rowid, rowid)
+            if question in self._entries:
+                continue
+            self._entries[question] = {
+                "embedding": np.frombuffer(embedding, dtype=np.float32),
+                "answer": answer,
+                "context": json.loads(context),
+                "created_at": created_at,
+            }
+            self._matrix = None
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._matrix = None
+
+    def lookup(self, question, embedding=None):
+        """Return the cached Prediction for a semantically equivalent question, or None."""
+        embedding = self.embed(question) if embedding is None else embedding
+        with self._lock:
+            self._check_index_version()
+            if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                self._refresh()
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[key]["embedding"] for key in self._matrix_keys])
+            similarities = self._matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            # The LRU order changes but the stacked rows stay valid
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry = self._entries[key]
+            self._write("UPDATE entries SET last_used = ? WHERE question = ?", (time.time(), key))
+            return dspy.Prediction(
+                context=[dspy.Prediction(long_text=text) for text in entry["context"]],
+                answer=entry["answer"],
+            )
+
+    def store(self, question, prediction, embedding=None):
+        """Cache a prediction (answer plus context) for the question; it is persisted in the background."""
+        embedding = self.embed(question) if embedding is None else embedding
+        with self._lock:
+            self._check_index_version()
+            entry = {
+                "embedding": np.asarray(embedding, dtype=np.float32),
+                "answer": prediction.answer,
+                "context": [c.long_text for c in prediction.context],
+                "created_at": time.time(),
+            }
+            self._entries[question] = entry
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._write(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (question, self.index_version, entry["embedding"].tobytes(), entry["answer"],
+                 json.dumps(entry["context"]), entry["created_at"], entry["created_at"]),
+            )
+            self._write(
+                "DELETE FROM entries WHERE question IN (SELECT question FROM entries ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._write("DELETE FROM entries")
+
+    def load(self):
+        """Load persisted entries of the current index version, dropping those of other versions."""
+        if self.path is None or not self.path.exists():
+            return
+        with self._db_lock:
+            db = self._db()
+            db.execute("DELETE FROM entries WHERE index_version IS NOT ?", (self.index_version,))
+            db.commit()
+        with self._lock:
+            self._refresh()
+            self._expire()
+
+class VerdictStore:
+    """
+    Persistent judge verdicts keyed by the judge model and the normalized
+    (question, gold answer, predicted answer) triple.
+
+    Verdicts are appended to a JSONL file, so concurrent evaluation threads and
+    interrupted optimization runs never lose what was already judged.
+    """
+    def __init__(self, path=JUDGE_VERDICTS_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._verdicts = {}
+        self.hits = 0
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partially written last line
+                    self._verdicts[entry["key"]] = entry["verdict"]
+
+    @staticmethod
+    def key(model, question, gold_answer, predicted_answer):
+        parts = [model or ""] + [normalize_answer(t) for t in (question, gold_answer, predicted_answer)]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self.hits += 1
+            return verdict
+
+    def put(self, key, verdict):
+        with self._lock:
+            self._verdicts[key] = verdict
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "verdict": verdict}) + "\n")
+
+    def __len__(self):
+        return len(self._verdicts)
@@ -0,0 +1,112 @@
+import re
+from .ingestion.tokens import count_tokens
+
+# Token budget for the passages handed to GenerateAnswer (about k + 2 chunks of 800 characters)
+CONTEXT_TOKENS = 1024
+# Word-shingle Jaccard similarity above which a passage counts as a near-duplicate
+NEAR_DUPLICATE_SIMILARITY = 0.8
+SHINGLE_SIZE = 3
+# Overlap between consecutive chunks is up to 40 tokens of whole sentences; look a little further to be safe
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 20
+
+# "[Section] " or, on a continuation chunk, "[Section] ... "
+_SECTION_PREFIX = re.compile(r"^\[([^\]]*)\]\s*(?:\.\.\.\s*)?")
+_CHUNK_INDEX = re.compile(r"_(\d+)$")
+
+def split_section(text):
+    """Split a chunk into its "[section]" label (or None) and the text after it."""
+    match = _SECTION_PREFIX.match(text)
+    if not match:
+        return None, text
+    return match.group(1), text[match.end():]
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def _similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _strip_overlap(previous, body):
+    """Drop the start of `body` that repeats the end of `previous` (the chunker's overlap)."""
+    for size in range(min(len(previous), len(body), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        head = body[:size].rstrip()
+        if len(head) >= MIN_OVERLAP_CHARS and previous.endswith(head):
+            return body[size:].lstrip()
+    return body
+
+def _position(node):
+    """(doc_id, chunk index) of a node, or None when its position in the page is unknown."""
+    doc_id = node.metadata.get("doc_id")
+    match = _CHUNK_INDEX.search(node.metadata.get("chunk_id", ""))
+    if doc_id is None or not match:
+        return None
+    return doc_id, int(match.group(1))
+
+def _render(group):
+    """Join a doc's selected chunks, merging consecutive ones into a single passage."""
+    passages = []
+    previous_index = previous_section = None
+    for index, node in group:
+        section, body = split_section(node.get_content())
+        if passages and previous_index is not None and index == previous_index + 1:
+            body = _strip_overlap(passages[-1], body)
+            if section not in (None, previous_section):
+                body = f"[{section}] {body}"
+            passages[-1] = f"{passages[-1]} {body}".strip()
+        else:
+            passages.append(node.get_content())
+        previous_index, previous_section = index, section
+    return passages
+
+def pack_context(nodes, max_tokens=CONTEXT_TOKENS, stats=None):
+    """
+    Choose the passages for answer generation from scored retrieval results.
+
+    Near-duplicates of a better-scored passage are dropped, the rest are added by
+    score while they fit in `max_tokens`, and consecutive chunks of the same page are
+    merged with their repeated "[section] ..." prefix and overlap removed. Returns the
+    passages, best first. `stats` (e.g. a tracer span) gets the counts.
+    """
+    ranked = sorted(nodes, key=lambda n: n.score if n.score is not None else float("-inf"), reverse=True)
+
+    kept_shingles = []
+    groups = {}    # group key -> [(chunk index, node)]
+    costs = {}     # group key -> tokens of the rendered group
+    order = []     # group keys, best first
+    total = near_duplicates = over_budget = 0
+    for n in ranked:
+        _, body = split_section(n.node.get_content())
+        shingles = _shingles(body)
+        if any(_similarity(shingles, kept) >= NEAR_DUPLICATE_SIMILARITY for kept in kept_shingles):
+            near_duplicates += 1
+            continue
+
+        # Chunks of the same page share a group so consecutive ones can be merged
+        position = _position(n.node)
+        key, index = position if position else (n.node.node_id, None)
+        group = sorted(groups.get(key, []) + [(index, n.node)], key=lambda item: item[0] or 0)
+        cost = sum(count_tokens(p) for p in _render(group))
+        if total - costs.get(key, 0) + cost > max_tokens:
+            over_budget += 1
+            continue
+
+        kept_shingles.append(shingles)
+        if key not in groups:
+            order.append(key)
+        total += cost - costs.get(key, 0)
+        groups[key], costs[key] = group, cost
+
+    passages = [p for key in order for p in _render(groups[key])]
+    if stats is not None:
+        stats.update({
+            "packed": len(passages),
+            "tokens": total,
+            "near_duplicates": near_duplicates,
+            "over_budget": over_budget,
+            "merged": sum(len(g) for g in groups.values()) - len(passages),
+        })
+    return passages
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+# Fields of a chunk as written by process_directory, in column order
+CHUNK_FIELDS = ("chunk_id", "doc_id", "source", "source_path", "section", "text")
+CHUNK_STORE_SUFFIXES = (".sqlite", ".db")
+# Rows fetched per round trip while streaming
+FETCH_SIZE = 1000
+
+def is_chunk_store(path):
+    return Path(path).suffix in CHUNK_STORE_SUFFIXES
+
+def _to_chunk(row):
+    # Fields a chunk never had are stored as NULL; leave them out again
+    return {field: value for field, value in zip(CHUNK_FIELDS, row) if value is not None}
+
+class ChunkStore:
+    """
+    Read-only view of a chunks file written by `ChunkStoreWriter`.
+
+    Chunks live in one SQLite table in the order they were written, with indexes on
+    `chunk_id`, `doc_id` and `section`. Iteration streams rows from disk, and `get`,
+    `filter` and `chunk_ids` only read the rows they return, so nothing needs the
+    whole corpus in memory.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Chunk store not found at {self.path}")
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _select(self, where="", params=()):
+        cursor = self._conn.execute(f"SELECT {', '.join(CHUNK_FIELDS)} FROM chunks {where} ORDER BY rowid", params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield _to_chunk(row)
+
+    def __iter__(self):
+        return self._select()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def __contains__(self, chunk_id):
+        return self._conn.execute("SELECT 1 FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone() is not None
+
+    def get(self, chunk_id):
+        """The chunk with this chunk_id, or None."""
+        row = self._conn.execute(
+            f"SELECT {', '.join(CHUNK_FIELDS)} FROM chunks WHERE chunk_id = ?", (chunk_id,)
+        ).fetchone()
+        return _to_chunk(row) if row else None
+
+    def filter(self, doc_id=None, section=None):
+        """Chunks of one page and/or section, in corpus order."""
+        clauses, params = [], []
+        if doc_id is not None:
+            clauses.append("doc_id = ?")
+            params.append(doc_id)
+        if section is not None:
+            clauses.append("section = ?")
+            params.append(section)
+        return self._select("WHERE " + " AND ".join(clauses) if clauses else "", params)
+
+    def chunk_ids(self, min_chars=0):
+        """chunk_ids of all chunks whose text is at least `min_chars` long, without reading the text."""
+        rows = self._conn.execute(
+            "SELECT chunk_id FROM chunks WHERE text_chars >= ? ORDER BY rowid", (min_chars,)
+        )
+        return [chunk_id for chunk_id, in rows]
+
+    def doc_ids(self):
+        return [doc_id for doc_id, in self._conn.execute("SELECT DISTINCT doc_id FROM chunks ORDER BY doc_id")]
+
+class ChunkStoreWriter:
+    """
+    Builds a chunk store, used by `ChunkWriter` for `.sqlite` paths.
+
+    Rows are written to a temporary file that replaces `path` only once it is complete,
+    so readers never see a half-written store. The same chunks in the same order always
+    give the same rows and rowids.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.count = 0
+        self._tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._conn = None
+
+    def __enter__(self):
+        self._tmp_path.unlink(missing_ok=True)
+        self._conn = sqlite3.connect(self._tmp_path)
+        # A crash only loses the temporary file, so skip the journal
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE chunks (chunk_id TEXT NOT NULL, doc_id TEXT, source TEXT, source_path TEXT, "
+            "section TEXT, text TEXT, text_chars INTEGER NOT NULL)"
+        )
+        return self
+
+    def write(self, chunk):
+        text = chunk.get("text") or ""
+        self._conn.execute(
+            "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [chunk.get(field) for field in CHUNK_FIELDS] + [len(text)],
+        )
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._conn.close()
+            self._tmp_path.unlink(missing_ok=True)
+            return
+        # Indexes are cheaper to build once at the end than to maintain per insert
+        self._conn.execute("CREATE UNIQUE INDEX idx_chunks_chunk_id ON chunks (chunk_id)")
+        self._conn.execute("CREATE INDEX idx_chunks_doc_id ON chunks (doc_id)")
+        self._conn.execute("CREATE INDEX idx_chunks_section ON chunks (section)")
+        self._conn.commit()
+        self._conn.close()
+        os.replace(self._tmp_path, self.path)
+
+def iter_chunks(path):
+    """Yield chunks from a chunk store, or from a `.jsonl` or `.json` chunks file."""
+    path = Path(path)
+    if is_chunk_store(path):
+        with ChunkStore(path) as store:
+            yield from store
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix == ".jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def default_chunks_path(data_dir):
+    """data/chunks.sqlite when it has been built, otherwise the original data/chunks.json."""
+    store_path = Path(data_dir) / "chunks.sqlite"
+    return store_path if store_path.exists() else Path(data_dir) / "chunks.json"
+
+def convert_chunks(source_path, store_path):
+    """Convert a chunks.json / .jsonl file into a chunk store. Returns the number of chunks."""
+    with ChunkStoreWriter(store_path) as writer:
+        for chunk in iter_chunks(source_path):
+            writer.write(chunk)
+    return writer.count
+
+if __name__ == "__main__":
+    DATA_DIR = Path(__file__).parent.parent.parent / "data"
+
+    parser = argparse.ArgumentParser(description="Convert chunks.json (or .jsonl) into a SQLite chunk store.")
+    parser.add_argument("source", nargs="?", default=str(DATA_DIR / "chunks.json"), help="Chunks file to convert")
+    parser.add_argument("output", nargs="?", default=str(DATA_DIR / "chunks.sqlite"), help="Chunk store to write")
+    args = parser.parse_args()
+
+    count = convert_chunks(Path(args.source), Path(args.output))
+    print(f"Converted {count} chunks from {args.source} to {args.output}")
@@ -1,5 +1,7 @@
 import requests
 import os
+import json
+import asyncio
 from pathlib import Path
 import time
 from bs4 import BeautifulSoup
@@ -17,6 +19,13 @@ SEED_URLS = [
 MAX_DEPTH = 3
 MAX_PAGES = 50
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+# Persisted crawl state (frontier, visited set, ETag/Last-Modified) for the async crawler
+CRAWL_STATE_FILE = ".crawl_state.json"
+
 def is_valid_url(url):
     """Check if URL is valid for crawling."""
     parsed = urlparse(url)
@@ -27,13 +36,29 @@ def is_valid_url(url):
         not any(parsed.path.lower().endswith(ext) for ext in ['.pdf', '.zip', '.jpg', '.png', '.mp4'])
     )
 
+def url_to_filename(url):
+    """Map a page URL to a flat, collision-free file name."""
+    safe_name = urlparse(url).path.strip("/").replace("/", "_") + ".html"
+    if not safe_name or safe_name == ".html":
+        safe_name = "index.html"
+    return safe_name
+
+def extract_links(html, base_url, url_filter=is_valid_url):
+    """Return crawlable absolute links (fragments removed) found in a page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for link in soup.find_all('a', href=True):
+        # Remove fragment identifier
+        next_url = urljoin(base_url, link['href']).split('#')[0]
+        if url_filter(next_url):
+            links.append(next_url)
+    return links
+
 def download_hdb_pages(output_dir: Path, dry_run: bool = False):
     if not dry_run:
         output_dir.mkdir(parents=True, exist_ok=True)
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
+    headers = HEADERS
     
     # Queue stores (url, depth)
     queue = deque([(url, 0) for url in SEED_URLS])
@@ -57,28 +82,15 @@ def download_hdb_pages(output_dir: Path, dry_run: bool = False):
             
             if not dry_run:
                 # Save content
-                # ... naming logic ...
-                # improved naming to avoid collisions
-                safe_name = urlparse(url).path.strip("/").replace("/", "_") + ".html"
-                if not safe_name or safe_name == ".html":
-                     safe_name = "index.html"
-                
-                target_path = output_dir / safe_name
+                target_path = output_dir / url_to_filename(url)
                 target_path.write_text(response.text, encoding="utf-8")
             
             pages_processed += 1
             
             # If we haven't reached max depth, find more links
             if depth < MAX_DEPTH:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                links = soup.find_all('a', href=True)
-                
-                for link in links:
-                    next_url = urljoin(url, link['href'])
-                    # Remove fragment identifier
-                    next_url = next_url.split('#')[0]
-                    
-                    if next_url not in visited and is_valid_url(next_url):
+                for next_url in extract_links(response.text, url):
+                    if next_url not in visited:
                         visited.add(next_url)
                         queue.append((next_url, depth + 1))
             
@@ -88,12 +100,216 @@ def download_hdb_pages(output_dir: Path, dry_run: bool = False):
         except Exception as e:
             print(f"  Error processing {url}: {e}")
 
+class TokenBucket:
+    """Async token-bucket rate limiter: `rate` requests per second with bursts up to `capacity`."""
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class CrawlState:
+    """
+    Frontier, visited set and HTTP validators persisted between crawler runs.
+
+    If a previous run was interrupted its frontier is resumed. Otherwise a new crawl
+    starts from the seeds but keeps the ETag / Last-Modified validators, so unchanged
+    pages come back as 304 and are not downloaded again.
+    """
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.pending = {}      # url -> depth, queued or in flight
+        self.visited = set()   # every url ever enqueued in this crawl
+        self.validators = {}   # url -> {"etag": ..., "last_modified": ...}
+        self.pages_processed = 0
+
+    @classmethod
+    def load(cls, path: Path = None, seed_urls=SEED_URLS):
+        state = cls(path)
+        data = {}
+        if path is not None and path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+        state.validators = data.get("validators", {})
+        if data.get("pending"):
+            state.pending = {url: depth for url, depth in data["pending"]}
+            state.visited = set(data.get("visited", []))
+            state.pages_processed = data.get("pages_processed", 0)
+        else:
+            state.pending = {url: 0 for url in seed_urls}
+            state.visited = set(seed_urls)
+        return state
+
+    @property
+    def resumed(self):
+        return self.pages_processed > 0
+
+    def save(self):
+        if self.path is None:
+            return
+        data = {
+            "pending": [[url, depth] for url, depth in self.pending.items()],
+            "visited": sorted(self.visited),
+            "validators": self.validators,
+            "pages_processed": self.pages_processed,
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+async def crawl_hdb_pages_async(output_dir: Path, dry_run: bool = False, seed_urls=SEED_URLS,
+                                max_pages: int = MAX_PAGES, max_depth: int = MAX_DEPTH,
+                                concurrency: int = 8, per_host_limit: int = 4, rate: float = 4.0,
+                                url_filter=is_valid_url, state_path: Path = None):
+    """
+    Concurrent, resumable version of download_hdb_pages.
+
+    Requests share one pooled aiohttp session, are limited to `per_host_limit` in flight
+    per host and are paced by a token bucket of `rate` requests per second. Pages that
+    answer 304 Not Modified keep their saved copy, which is still parsed for links.
+    Returns the number of pages processed.
+    """
+    import aiohttp
+
+    if not dry_run:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    if state_path is None and not dry_run:
+        state_path = output_dir / CRAWL_STATE_FILE
+
+    state = CrawlState.load(state_path, seed_urls)
+    bucket = TokenBucket(rate)
+    host_limits = {}
+    # Pages being fetched count against max_pages, so concurrent workers cannot overshoot it
+    slots = asyncio.Condition()
+    reserved = 0
+    queue = asyncio.Queue()
+    for url, depth in state.pending.items():
+        queue.put_nowait((url, depth))
+
+    mode_str = "DRY RUN" if dry_run else "LIVE"
+    resume_str = f", resuming after {state.pages_processed} pages" if state.resumed else ""
+    print(f"Starting async HDB crawl ({mode_str}) to {output_dir}{resume_str}...")
+    print(f"Max depth: {max_depth}, Max pages: {max_pages}, Rate: {rate}/s, Per-host limit: {per_host_limit}")
+
+    async def fetch(session, url, conditional):
+        headers = dict(HEADERS)
+        validator = state.validators.get(url, {}) if conditional else {}
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+
+        host = urlparse(url).netloc
+        limit = host_limits.setdefault(host, asyncio.Semaphore(per_host_limit))
+        async with limit:
+            await bucket.acquire()
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return None, response.headers
+                response.raise_for_status()
+                return await response.text(), response.headers
+
+    async def reserve():
+        """Wait for a free page slot; False once max_pages pages have been processed."""
+        nonlocal reserved
+        async with slots:
+            # A slot held by a fetch that fails is handed to a waiting worker
+            await slots.wait_for(lambda: state.pages_processed + reserved < max_pages
+                                 or state.pages_processed >= max_pages)
+            if state.pages_processed >= max_pages:
+                return False
+            reserved += 1
+            return True
+
+    async def release():
+        nonlocal reserved
+        async with slots:
+            reserved -= 1
+            slots.notify_all()
+
+    async def worker(session):
+        while True:
+            url, depth = await queue.get()
+            reserved_slot = False
+            try:
+                reserved_slot = await reserve()
+                if not reserved_slot:
+                    continue
+                target_path = output_dir / url_to_filename(url)
+                # Only revalidate pages we still have a saved copy of
+                html, response_headers = await fetch(session, url, conditional=target_path.exists())
+                indent = "  " * depth
+                prefix = f"[{state.pages_processed+1}/{max_pages}]"
+
+                if html is None:
+                    print(f"{prefix} {indent}-> Not modified: {url}")
+                    html = target_path.read_text(encoding="utf-8") if target_path.exists() else ""
+                else:
+                    print(f"{prefix} {indent}-> Fetched: {url}")
+                    if not dry_run:
+                        target_path.write_text(html, encoding="utf-8")
+                    state.validators[url] = {
+                        "etag": response_headers.get("ETag"),
+                        "last_modified": response_headers.get("Last-Modified"),
+                    }
+                state.pages_processed += 1
+
+                # If we haven't reached max depth, find more links
+                if depth < max_depth and html:
+                    for next_url in extract_links(html, url, url_filter):
+                        if next_url not in state.visited:
+                            state.visited.add(next_url)
+                            state.pending[next_url] = depth + 1
+                            queue.put_nowait((next_url, depth + 1))
+            except Exception as e:
+                print(f"  Error processing {url}: {e}")
+            finally:
+                if reserved_slot:
+                    await release()
+                state.pending.pop(url, None)
+                if not dry_run:
+                    state.save()
+                queue.task_done()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host_limit)
+    timeout = aiohttp.ClientTimeout(total=15)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    # Links left over once max_pages was reached are not a resumable frontier
+    state.pending.clear()
+    if not dry_run:
+        state.save()
+    print(f"Crawl finished: {state.pages_processed} pages")
+    return state.pages_processed
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Recursively download HDB documentation.")
     parser.add_argument("--dry-run", action="store_true", help="Print actions without saving files")
     parser.add_argument("--output", type=str, help="Output directory path")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the concurrent, resumable crawler")
+    parser.add_argument("--concurrency", type=int, default=8, help="Async crawler: total concurrent requests")
+    parser.add_argument("--per-host", type=int, default=4, help="Async crawler: concurrent requests per host")
+    parser.add_argument("--rate", type=float, default=4.0, help="Async crawler: requests per second")
     
     args = parser.parse_args()
     
@@ -105,4 +321,13 @@ if __name__ == "__main__":
     else:
         HDB_RAW_DIR = project_root / "data" / "hdb_raw"
     
-    download_hdb_pages(HDB_RAW_DIR, dry_run=args.dry_run)
+    if args.use_async:
+        asyncio.run(crawl_hdb_pages_async(
+            HDB_RAW_DIR,
+            dry_run=args.dry_run,
+            concurrency=args.concurrency,
+            per_host_limit=args.per_host,
+            rate=args.rate,
+        ))
+    else:
+        download_hdb_pages(HDB_RAW_DIR, dry_run=args.dry_run)
@@ -1,13 +1,39 @@
 from bs4 import BeautifulSoup
 import re
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
+try:
+    from .chunk_store import ChunkStoreWriter, is_chunk_store, iter_chunks  # noqa: F401 (iter_chunks is re-exported)
+    from .tokens import count_tokens
+except ImportError:
+    # Run as a script: python src/ingestion/html_parser.py
+    from chunk_store import ChunkStoreWriter, is_chunk_store, iter_chunks  # noqa: F401
+    from tokens import count_tokens
+
+# Chunk size limits in tokens (about the 800 / 150 characters used before)
+CHUNK_TOKENS = 200
+OVERLAP_TOKENS = 40
+
+# A sentence ends at . ! or ? followed by whitespace and something that can start a sentence
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
 
 def load_html(path: Path):
     return path.read_text(encoding="utf-8", errors="ignore")
 
-def parse_html(html: str):
-    return BeautifulSoup(html, "html.parser")
+def resolve_parser(parser: str = "html.parser"):
+    """Map "auto" to lxml when it is installed, falling back to the pure-Python parser."""
+    if parser != "auto":
+        return parser
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+def parse_html(html: str, parser: str = "html.parser"):
+    return BeautifulSoup(html, resolve_parser(parser))
 
 def strip_junk(soup):
     for tag in soup([
@@ -17,17 +43,52 @@ def strip_junk(soup):
     ]):
         tag.decompose()
 
-def chunk_text_by_structure(soup, chunk_size=800, overlap=150):
+def split_sentences(text):
+    return [s for s in _SENTENCE_END.split(text) if s]
+
+def _split_long(sentence, max_tokens, count):
+    """Split a sentence longer than `max_tokens` (e.g. a flattened table) at word boundaries."""
+    pieces, words, size = [], [], 0
+    for word in sentence.split(" "):
+        n = count(" " + word)
+        if words and size + n > max_tokens:
+            pieces.append(" ".join(words))
+            words, size = [], 0
+        words.append(word)
+        size += n
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+def chunk_text_by_structure(soup, chunk_tokens=CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS, count=count_tokens):
     """
     Chunks text by respecting HTML structure (sections/paragraphs).
     Injects the section header into each chunk for better context.
+
+    A chunk holds whole sentences up to `chunk_tokens` tokens, counting its "[section]"
+    prefix and the spaces joining its sentences, and never spans a heading. Longer
+    sentences are split at words.
+    A chunk that fills up is continued by one starting "[section] ... " and repeating its
+    last sentences, up to `overlap_tokens`. Sentences are counted once each, so the
+    whole page is chunked in one linear pass.
     """
     chunks = []
     content = extract_main_content(soup)
     
     current_section = "General"
-    current_chunk_text = ""
-    
+    # Each sentence is counted with the space before it, so the sizes add up to the
+    # joined text's (the prefix is counted without its trailing space)
+    prefix_tokens = count(f"[{current_section}] ...")
+    sentences = []      # sentences of the current chunk, joined on flush
+    sizes = []          # their token counts
+    size = prefix_tokens
+    new_sentences = 0   # sentences that are not just overlap from the previous chunk
+    continued = False
+
+    def flush():
+        prefix = f"[{current_section}] ... " if continued else f"[{current_section}] "
+        chunks.append({"text": prefix + " ".join(sentences), "section": current_section})
+
     # Process elements sequentially to maintain order and context
     for tag in content.find_all(["h1", "h2", "h3", "p", "li"]):
         text = tag.get_text(" ", strip=True)
@@ -35,40 +96,41 @@ def chunk_text_by_structure(soup, chunk_size=800, overlap=150):
             continue
             
         if tag.name.startswith("h"):
-            # New section starts
+            # Headers are break points: the section's last chunk ends here, without overlap
+            if new_sentences:
+                flush()
             current_section = text
-            # We don't necessarily start a new chunk here if the current one is small,
-            # but usually headers are good break points.
-            if current_chunk_text:
-                # Flush current chunk
-                chunks.append({
-                    "text": current_chunk_text.strip(),
-                    "section": current_section
-                })
-                current_chunk_text = ""
-        else:
-            # Append text with section context prepended if chunk is new
-            if not current_chunk_text:
-                current_chunk_text = f"[{current_section}] "
-            
-            current_chunk_text += text + " "
-            
-            # If chunk exceeds size, save it and start new one with overlap
-            if len(current_chunk_text) > chunk_size:
-                chunks.append({
-                    "text": current_chunk_text.strip(),
-                    "section": current_section
-                })
-                # Simple overlap: keep last N chars (ideally last sentence, but keeping it simple for now)
-                overlap_text = current_chunk_text[-overlap:] if len(current_chunk_text) > overlap else ""
-                current_chunk_text = f"[{current_section}] ... {overlap_text}"
+            prefix_tokens = count(f"[{current_section}] ...")
+            sentences, sizes, size, new_sentences, continued = [], [], prefix_tokens, 0, False
+            continue
+
+        for sentence in split_sentences(text):
+            n = count(" " + sentence)
+            room = max(1, chunk_tokens - prefix_tokens)
+            parts = _split_long(sentence, room, count) if n > room else [sentence]
+            for part in parts:
+                n = count(" " + part) if len(parts) > 1 else n
+                if new_sentences and size + n > chunk_tokens:
+                    flush()
+                    # Carry the trailing whole sentences that fit in the overlap
+                    keep, kept = 0, 0
+                    while keep < len(sizes) and kept + sizes[-1 - keep] <= overlap_tokens:
+                        kept += sizes[-1 - keep]
+                        keep += 1
+                    # ...as long as the next sentence still fits after them
+                    while keep and prefix_tokens + kept + n > chunk_tokens:
+                        keep -= 1
+                        kept -= sizes[len(sizes) - 1 - keep]
+                    sentences, sizes, size = sentences[len(sentences) - keep:], sizes[len(sizes) - keep:], prefix_tokens + kept
+                    new_sentences, continued = 0, True
+                sentences.append(part)
+                sizes.append(n)
+                size += n
+                new_sentences += 1
 
     # Final flush
-    if current_chunk_text:
-        chunks.append({
-            "text": current_chunk_text.strip(),
-            "section": current_section
-        })
+    if new_sentences:
+        flush()
         
     return chunks
 
@@ -94,71 +156,133 @@ def html_to_clean_text(path):
 
     return normalize_text(text)
 
-def extract_with_headings(soup):
-    content = extract_main_content(soup)
+class ChunkWriter:
+    """
+    Streams chunks to disk as they are produced instead of holding the corpus in memory.
 
-    lines = []
-    for tag in content.find_all(["h1", "h2", "h3", "p", "li"]):
-        if tag.name.startswith("h"):
-            header_text = tag.get_text(strip=True)
-            if header_text:
-                lines.append(f"___SECTION_START___ {header_text} ___SECTION_END___")
+    A `.jsonl` path gets one compact JSON object per line, and a `.sqlite` path a chunk
+    store (see `ChunkStore`). Any other path gets the same indented JSON array that
+    `chunks.json` has always used, written incrementally.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.jsonl = path.suffix == ".jsonl"
+        self._store = ChunkStoreWriter(path) if is_chunk_store(path) else None
+        self._count = 0
+        self._f = None
+
+    @property
+    def count(self):
+        return self._store.count if self._store is not None else self._count
+
+    def __enter__(self):
+        if self._store is not None:
+            self._store.__enter__()
+            return self
+        self._f = open(self.path, "w", encoding="utf-8")
+        if not self.jsonl:
+            self._f.write("[")
+        return self
+
+    def write(self, chunk):
+        if self._store is not None:
+            self._store.write(chunk)
+        elif self.jsonl:
+            self._f.write(json.dumps(chunk) + "\n")
         else:
-            text = tag.get_text(" ", strip=True)
-            if text:
-                lines.append(text)
+            item = json.dumps(chunk, indent=2).replace("\n", "\n  ")
+            self._f.write(("," if self._count else "") + "\n  " + item)
+        self._count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._store is not None:
+            return self._store.__exit__(exc_type, exc, tb)
+        if not self.jsonl:
+            self._f.write("\n]" if self._count else "]")
+        self._f.close()
+
+def process_file(html_path: Path, project_root: Path, source_name: str, parser: str = "html.parser",
+                 chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS):
+    """Parse and chunk a single HTML file. Runs inside worker processes."""
+    # Calculate source_path relative to project root
+    try:
+        relative_source_path = str(html_path.relative_to(project_root))
+    except ValueError:
+        relative_source_path = str(html_path)
 
-    return " ".join(lines)
+    html_content = load_html(html_path)
+    soup = parse_html(html_content, parser)
+    strip_junk(soup)
+    
+    doc_id = html_path.stem.replace("-", "_")
+    
+    # Perform improved chunking
+    chunks_meta = chunk_text_by_structure(soup, chunk_tokens, overlap_tokens)
+    return [
+        {
+            "chunk_id": f"{doc_id}_{i}",
+            "doc_id": doc_id,
+            "source": source_name,
+            "source_path": relative_source_path,
+            "section": chunk["section"],
+            "text": chunk["text"]
+        }
+        for i, chunk in enumerate(chunks_meta)
+    ]
 
-def process_directory(source_dir: Path, chunks_output_path: Path, source_name: str = "Knowledge Base"):
+def _process_file_safe(args):
+    html_path = args[0]
+    try:
+        return html_path, process_file(*args), None
+    except Exception as e:
+        return html_path, None, e
+
+def process_directory(source_dir: Path, chunks_output_path: Path, source_name: str = "Knowledge Base",
+                      workers: int = 1, parser: str = "html.parser",
+                      chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS):
+    """
+    Parse every HTML file in source_dir and stream the chunks to chunks_output_path.
+    Chunks hold up to chunk_tokens tokens, overlapping by up to overlap_tokens.
+
+    With workers > 1 files are parsed in a process pool. Files are always handled in
+    sorted order and results are written in that order, so the output and chunk_ids
+    are identical whatever the worker count.
+    """
     chunks_output_path.parent.mkdir(parents=True, exist_ok=True)
     
-    html_files = list(source_dir.glob("*.html"))
-    print(f"Found {len(html_files)} HTML files in {source_dir}")
+    html_files = sorted(source_dir.glob("*.html"))
+    parser = resolve_parser(parser)
+    print(f"Found {len(html_files)} HTML files in {source_dir} (workers={workers}, parser={parser})")
     
     # Calculate base project path for relative paths
     project_root = Path(__file__).parent.parent.parent.parent
+    tasks = [(html_path, project_root, source_name, parser, chunk_tokens, overlap_tokens) for html_path in html_files]
     
-    all_chunks = []
-    
-    for html_path in html_files:
+    with ChunkWriter(chunks_output_path) as writer:
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_process_file_safe, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        else:
+            executor = None
+            results = map(_process_file_safe, tasks)
+        
         try:
-            # Calculate source_path relative to project root
-            try:
-                relative_source_path = str(html_path.relative_to(project_root))
-            except ValueError:
-                relative_source_path = str(html_path)
-
-            html_content = load_html(html_path)
-            soup = parse_html(html_content)
-            strip_junk(soup)
-            
-            clean_text = extract_with_headings(soup)
-            
-            doc_id = html_path.stem.replace("-", "_")
-            
-            # Perform improved chunking
-            chunks_meta = chunk_text_by_structure(soup)
-            for i, chunk in enumerate(chunks_meta):
-                all_chunks.append({
-                    "chunk_id": f"{doc_id}_{i}",
-                    "doc_id": doc_id,
-                    "source": source_name,
-                    "source_path": relative_source_path,
-                    "section": chunk["section"],
-                    "text": chunk["text"]
-                })
-                
-            print(f"Processed: {html_path.name} -> Added {len(chunks_meta)} chunks")
-        except Exception as e:
-            print(f"Error processing {html_path.name}: {e}")
-
-    # Save consolidated chunks
-    chunks_output_path.write_text(json.dumps(all_chunks, indent=2), encoding="utf-8")
-    print(f"\nSaved {len(all_chunks)} chunks to {chunks_output_path}")
+            # map() yields in submission order, so each file is written as soon as it
+            # and every file before it have finished
+            for html_path, chunks, error in results:
+                if error is not None:
+                    print(f"Error processing {html_path.name}: {error}")
+                    continue
+                for chunk in chunks:
+                    writer.write(chunk)
+                print(f"Processed: {html_path.name} -> Added {len(chunks)} chunks")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    print(f"\nSaved {writer.count} chunks to {chunks_output_path}")
 
 if __name__ == "__main__":
-    import os
     # Default to current project structure
     CURRENT_DIR = Path(__file__).parent
     # Data is in root data/ (2 levels up from src/ingestion/)
@@ -167,13 +291,21 @@ if __name__ == "__main__":
     
     # Configuration via Environment Variables
     SOURCE_DIR = Path(os.getenv("SOURCE_DIR", BASE_DATA_DIR / "hdb_raw"))
-    CHUNKS_OUTPUT = Path(os.getenv("CHUNKS_OUTPUT", BASE_DATA_DIR / "chunks.json"))
+    CHUNKS_OUTPUT = Path(os.getenv("CHUNKS_OUTPUT", BASE_DATA_DIR / "chunks.sqlite"))
     SOURCE_NAME = os.getenv("SOURCE_NAME", "HDB Housing Guide")
+    WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+    PARSER = os.getenv("HTML_PARSER", "html.parser")
+    CHUNK_SIZE = int(os.getenv("CHUNK_TOKENS", CHUNK_TOKENS))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP_TOKENS", OVERLAP_TOKENS))
     
     print(f"--- Data Ingestion Pipeline ---")
     print(f"Source Directory: {SOURCE_DIR}")
     print(f"Output File:      {CHUNKS_OUTPUT}")
     print(f"Source Name:      {SOURCE_NAME}")
+    print(f"Workers:          {WORKERS}")
+    print(f"HTML Parser:      {PARSER}")
+    print(f"Chunk Tokens:     {CHUNK_SIZE} (overlap {CHUNK_OVERLAP})")
     print(f"-------------------------------")
     
-    process_directory(SOURCE_DIR, CHUNKS_OUTPUT, SOURCE_NAME)
+    process_directory(SOURCE_DIR, CHUNKS_OUTPUT, SOURCE_NAME, workers=WORKERS, parser=PARSER,
+                      chunk_tokens=CHUNK_SIZE, overlap_tokens=CHUNK_OVERLAP)
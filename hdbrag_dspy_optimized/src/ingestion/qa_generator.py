@@ -2,32 +2,142 @@ import json
 import random
 import argparse
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 import dspy
 from src.signatures import GenerateRAGUsageExample
+from src.ingestion.chunk_store import ChunkStore, default_chunks_path, is_chunk_store, iter_chunks
+from src.lm_limiter import MAX_RETRIES, RETRY_BACKOFF_S, AdaptiveLM, get_limiter, is_overload, max_concurrency
 
 # Load environment variables
 load_dotenv()
 
-def generate_usage_examples(num_examples=10, output_file="data/qa_pairs.json"):
+def checkpoint_path(output_path):
+    """JSONL file that finished examples are appended to until the output file is written."""
+    return output_path.with_suffix(output_path.suffix + ".partial.jsonl")
+
+def load_existing_examples(output_path):
+    """Examples in the output file plus those checkpointed by an earlier (possibly crashed) run."""
+    examples = []
+    if output_path.exists():
+        try:
+            with open(output_path, "r") as f:
+                examples = json.load(f)
+        except json.JSONDecodeError:
+            pass
+    checkpoint = checkpoint_path(output_path)
+    if checkpoint.exists():
+        with open(checkpoint, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    examples.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # partially written last line
+    # A crash between writing the output and removing the checkpoint leaves duplicates
+    return list({example.get("context"): example for example in examples}.values())
+
+def save_examples(results, output_path):
+    """Atomically rewrite the output file so a crash never leaves it half-written, then drop the checkpoint."""
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, output_path)
+    checkpoint_path(output_path).unlink(missing_ok=True)
+
+def sample_chunks(chunks_path, num_chunks, exclude_texts=(), min_chars=101):
+    """Randomly pick chunks with at least `min_chars` of text, skipping texts in `exclude_texts`."""
+    if is_chunk_store(chunks_path):
+        # Sample chunk_ids and read only the chunks that are picked
+        with ChunkStore(chunks_path) as store:
+            chunk_ids = store.chunk_ids(min_chars=min_chars)
+            random.shuffle(chunk_ids)
+            sampled = []
+            for chunk_id in chunk_ids:
+                if len(sampled) == num_chunks:
+                    break
+                chunk = store.get(chunk_id)
+                if chunk["text"] not in exclude_texts:
+                    sampled.append(chunk)
+            return sampled
+
+    valid_chunks = [
+        c for c in iter_chunks(chunks_path)
+        if c.get("text") and len(c.get("text", "")) >= min_chars and c["text"] not in exclude_texts
+    ]
+    return random.sample(valid_chunks, min(num_chunks, len(valid_chunks)))
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+def generate_with_retry(generator, context, limiter, max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF_S,
+                        retry_overload=True):
+    """
+    Call the generator, retrying failures (e.g. unparseable output) with jittered
+    exponential backoff. Every attempt waits for `limiter`. Retries bypass the LM cache
+    so they get a fresh response. `retry_overload=False` leaves overload errors to an
+    `AdaptiveLM`, which has already retried them.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            if attempt == 0:
+                return generator(context=context)
+            return generator(context=context, config={"cache": False})
+        except Exception as e:
+            if attempt == max_retries or (not retry_overload and is_overload(e)):
+                raise
+            time.sleep(backoff * (2 ** attempt) + random.uniform(0, backoff))
+
+def generate_usage_examples(num_examples=10, output_file="data/qa_pairs.json", workers=None, rate=None,
+                            max_retries=MAX_RETRIES, lm=None, chunks_path=None):
+    """
+    Generate synthetic QA pairs from sampled chunks.
+
+    `num_examples` is the target size of the output file. Examples already in it are
+    kept and their chunks skipped, so an interrupted run picks up where it stopped.
+    Chunks are sent to the LM by `workers` threads (default: the LM's concurrency
+    ceiling), at most `rate` calls per second. With an `AdaptiveLM` the model's shared
+    limiter also decides how many calls run at once and retries overloaded ones. Any
+    other failure, such as output that does not parse, is retried up to `max_retries`
+    times. Every finished example is appended to a JSONL checkpoint straight away; the
+    output file is written once at the end.
+    """
     # Setup DSPy
 
     # lm = dspy.LM(
-    #     'openai/gpt-4o-mini', 
+    #     'openai/gpt-4o-mini',
     #     cache=True,
     #     max_tokens=512,
     #     temperature=0.7 # Slight temperature for more diverse realistic queries
     # )
-    lm = dspy.LM('ollama/qwen3:0.6b', api_base='http://localhost:11434', cache=True, max_tokens=512, temperature=0.2)
+    if lm is None:
+        lm = AdaptiveLM('ollama/qwen3:0.6b', api_base='http://localhost:11434', cache=True, max_tokens=512,
+                        temperature=0.2, max_retries=max_retries)
 
     dspy.settings.configure(lm=lm)
-    
+
     # Locate data directory relative to project root
     # This script is in src/ingestion/, so go up 3 levels to get to project root
     current_dir = Path(__file__).parent.resolve()
     project_root = current_dir.parent.parent
-    
+
     # If run from root, current_dir might be different, but using __file__ is safer
     # Assuming standard structure:
     # PROJECT_ROOT/
@@ -35,73 +145,109 @@ def generate_usage_examples(num_examples=10, output_file="data/qa_pairs.json"):
     #   src/
     #     ingestion/
     #       qa_generator.py
-    
-    chunks_path = project_root / "data" / "chunks.json"
-    
+
+    if chunks_path is not None:
+        chunks_path = Path(chunks_path)
+    else:
+        chunks_path = default_chunks_path(project_root / "data")
+
     if not chunks_path.exists():
         # Fallback: check relative to CWD if running from root
-        cwd_chunks = Path("data/chunks.json")
+        cwd_chunks = default_chunks_path("data")
         if cwd_chunks.exists():
              chunks_path = cwd_chunks
         else:
             print(f"Error: {chunks_path} not found.")
             return
 
+    # Handle output path
+    output_path = Path(output_file)
+    if not output_path.is_absolute():
+        output_path = project_root / output_file
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Resume: keep finished examples and skip the chunks they came from
+    results = load_existing_examples(output_path)
+    done_contexts = {example.get("context") for example in results}
+    remaining = num_examples - len(results)
+    if results:
+        print(f"Found {len(results)} existing examples in {output_path}")
+    if remaining <= 0:
+        print("Nothing to generate.")
+        if checkpoint_path(output_path).exists():
+            save_examples(results, output_path)
+        return results
+
     print(f"Loading chunks from: {chunks_path}")
-    with open(chunks_path, "r") as f:
-        chunks = json.load(f)
-    
-    # Filter for valid chunks (has text and reasonable length)
-    valid_chunks = [c for c in chunks if c.get("text") and len(c.get("text", "")) > 100]
-    
-    if not valid_chunks:
+    # Randomly sample valid chunks (has text and reasonable length)
+    sampled_chunks = sample_chunks(chunks_path, remaining, exclude_texts=done_contexts)
+
+    if not sampled_chunks:
         print("Error: No valid chunks found.")
-        return
+        if checkpoint_path(output_path).exists():
+            save_examples(results, output_path)
+        return results
 
-    # Randomly sample chunks
-    sampled_chunks = random.sample(valid_chunks, min(num_examples, len(valid_chunks)))
-    
     generator = dspy.ChainOfThought(GenerateRAGUsageExample)
-    
-    results = []
-    print(f"Generating {len(sampled_chunks)} usage examples...")
-    
-    for i, chunk in enumerate(sampled_chunks):
+    workers = workers or max_concurrency(lm)
+    limiter = RateLimiter(rate)
+
+    print(f"Generating {len(sampled_chunks)} usage examples with {workers} worker(s)...")
+    start = time.perf_counter()
+
+    def generate(chunk):
         context = chunk["text"]
-        try:
-            # Generate prediction using DSPy
-            prediction = generator(context=context)
-            
-            example = {
-                "doc_id": chunk.get("doc_id", "unknown"),
-                "section": chunk.get("section", "unknown"),
-                "question": prediction.user_query,
-                "answer": prediction.grounded_answer,
-                "context": context
-            }
+        # Generate prediction using DSPy
+        prediction = generate_with_retry(generator, context, limiter, max_retries,
+                                         retry_overload=not isinstance(lm, AdaptiveLM))
+        return {
+            "doc_id": chunk.get("doc_id", "unknown"),
+            "section": chunk.get("section", "unknown"),
+            "question": prediction.user_query,
+            "answer": prediction.grounded_answer,
+            "context": context
+        }
+
+    generated = 0
+    checkpoint = checkpoint_path(output_path)
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(checkpoint, "a", encoding="utf-8") as f:
+        futures = [executor.submit(generate, chunk) for chunk in sampled_chunks]
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                example = future.result()
+            except Exception as e:
+                print(f"[{i+1}] Error generating example: {e}")
+                continue
             results.append(example)
-            print(f"[{i+1}] Generated: {prediction.user_query[:50]}...")
-            
-        except Exception as e:
-            print(f"[{i+1}] Error generating example: {e}")
-            
-    # Save results
-    # Handle output path
-    output_path = Path(output_file)
-    if not output_path.is_absolute():
-        output_path = project_root / output_file
-        
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=2)
-    
-    print(f"\nSuccessfully generated {len(results)} examples to {output_path}")
+            generated += 1
+            # Checkpoint after every example by appending one line, not rewriting the output
+            f.write(json.dumps(example) + "\n")
+            f.flush()
+            print(f"[{i+1}] Generated: {example['question'][:50]}...")
+
+    save_examples(results, output_path)
+
+    elapsed = time.perf_counter() - start
+    throughput = generated / elapsed if elapsed else 0.0
+    print(f"\nSuccessfully generated {generated} examples to {output_path} ({throughput:.2f} examples/s)")
+    if isinstance(lm, AdaptiveLM):
+        print(f"LM concurrency: {get_limiter(lm.model).stats()}")
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate realistic RAG usage examples from HDB chunks using DSPy.")
     parser.add_argument("--num", type=int, default=10, help="Number of examples to generate")
     parser.add_argument("--output", type=str, default="data/qa_pairs.json", help="Output file path (relative to project root)")
-    
+    parser.add_argument("--workers", type=int, default=None, help="Worker threads (default: the LM's concurrency ceiling)")
+    parser.add_argument("--rate", type=float, default=None, help="Maximum LM calls per second")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Retries of failed LM calls, with jittered backoff")
+
     args = parser.parse_args()
-    generate_usage_examples(num_examples=args.num, output_file=args.output)
+    generate_usage_examples(
+        num_examples=args.num,
+        output_file=args.output,
+        workers=args.workers,
+        rate=args.rate,
+        max_retries=args.retries,
+    )
@@ -0,0 +1,18 @@
+_token_counter = None
+
+def count_tokens(text):
+    """
+    Tokens in `text` with tiktoken's cl100k_base (LlamaIndex's default tokenizer), or
+    ~4 characters per token without it. Shared by the chunker and context packing so
+    chunk sizes and the context budget are measured the same way.
+    """
+    global _token_counter
+    if _token_counter is None:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            _token_counter = lambda t: len(encoding.encode(t))
+        except Exception:
+            # Not installed, or the encoding cannot be downloaded offline
+            _token_counter = lambda t: max(1, (len(t) + 3) // 4)
+    return _token_counter(text)
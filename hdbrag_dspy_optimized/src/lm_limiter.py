@@ -0,0 +1,223 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+import numpy as np
+import dspy
+
+# Concurrency bounds per model name; "default" applies to models not listed
+MODEL_LIMITS = {
+    "default": {"initial": 4, "min_limit": 1, "max_limit": 16},
+}
+LATENCY_TOLERANCE = 2.0   # back off once latency per token exceeds this multiple of the baseline
+BACKOFF = 0.5             # multiplicative decrease on overload
+MAX_RETRIES = 3           # retries of a call that timed out, was rate limited or hit a server error
+RETRY_BACKOFF_S = 1.0     # base of the exponential retry delay, with full jitter
+METRICS_WINDOW_S = 60.0   # throughput and error rate are measured over this window
+BASELINE_WINDOW_S = 120.0 # the latency baseline is the lowest seen within this window
+
+# One limiter per model, shared by every AdaptiveLM in the process
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def is_overload(error):
+    """Whether an LM error means the backend is overloaded, rather than a bad request."""
+    import litellm
+    return isinstance(error, (
+        litellm.Timeout,
+        litellm.RateLimitError,
+        litellm.APIConnectionError,
+        litellm.ServiceUnavailableError,
+        litellm.InternalServerError,
+    ))
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit for one LM backend.
+
+    `call(fn)` waits while `limit` calls are in flight. Each successful call raises the
+    limit by 1/limit, i.e. by about one per round of calls, but only while the limit is
+    fully used. The limit is multiplied by `backoff` when a call is rate limited, times
+    out or hits a server error, or when the smoothed latency per output token grows past
+    `latency_tolerance` times its baseline (the lowest in the last `baseline_window_s`),
+    meaning the backend has started queueing. The limit so settles where the backend
+    is full and has about `latency_tolerance - 1` times its capacity waiting.
+    At most one decrease happens per round trip, so one overload only halves the limit
+    once. Overloaded calls are retried up to `max_retries` times with jittered exponential
+    backoff, each attempt taking a slot again. Cached responses do not move the limit.
+    """
+    def __init__(self, name, initial=4, min_limit=1, max_limit=16, latency_tolerance=LATENCY_TOLERANCE,
+                 backoff=BACKOFF, baseline_window_s=BASELINE_WINDOW_S, max_samples=10000):
+        self.name = name
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.baseline_window_s = baseline_window_s
+        self.in_flight = 0
+        self.queued = 0
+        self.retries = 0
+        self.increases = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+        self._rtt = None            # smoothed seconds per call
+        self._cost = None           # smoothed seconds per output token
+        self._baseline = None       # lowest smoothed cost within baseline_window_s
+        self._baseline_at = 0.0
+        self._last_decrease = 0.0
+        self._completions = deque() # (finished_at, overloaded) within METRICS_WINDOW_S
+        self.queue_wait_ms = deque(maxlen=max_samples)
+
+    def acquire(self):
+        """Block until a slot is free; returns the start time to pass to `release`."""
+        start = time.monotonic()
+        with self._cond:
+            self.queued += 1
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.queued -= 1
+            self.in_flight += 1
+            self.queue_wait_ms.append((time.monotonic() - start) * 1000)
+        return time.monotonic()
+
+    def release(self, started, overloaded=False, tokens=None, sample=True):
+        """Free a slot and adjust the limit from how the call went."""
+        now = time.monotonic()
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self._completions.append((now, overloaded))
+            while self._completions and self._completions[0][0] < now - METRICS_WINDOW_S:
+                self._completions.popleft()
+
+            if overloaded:
+                self._decrease(now)
+            elif sample:
+                rtt = now - started
+                cost = rtt / max(tokens or 1, 1)
+                self._rtt = rtt if self._rtt is None else 0.8 * self._rtt + 0.2 * rtt
+                self._cost = cost if self._cost is None else 0.8 * self._cost + 0.2 * cost
+                # Re-measured once it is old, so a faster moment does not pin it down forever
+                if self._baseline is None or self._cost <= self._baseline or now - self._baseline_at > self.baseline_window_s:
+                    self._baseline = self._cost
+                    self._baseline_at = now
+                if self._cost > self.latency_tolerance * self._baseline:
+                    self._decrease(now)
+                elif saturated and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                    self.increases += 1
+            self._cond.notify_all()
+
+    def _decrease(self, now):
+        if now - self._last_decrease < (self._rtt or 0.0):
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._last_decrease = now
+        self.decreases += 1
+
+    def call(self, fn, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF_S):
+        """Run `fn()` within the limit, retrying overload errors with jitter."""
+        for attempt in range(max_retries + 1):
+            started = self.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                overloaded = is_overload(e)
+                self.release(started, overloaded=overloaded, sample=False)
+                if not overloaded or attempt == max_retries:
+                    raise
+                with self._cond:
+                    self.retries += 1
+                time.sleep(random.uniform(0, retry_backoff * 2 ** attempt))
+                continue
+            self.release(started, tokens=_completion_tokens(result), sample=not getattr(result, "cache_hit", False))
+            return result
+
+    async def acall(self, fn, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF_S):
+        """Async `call`: `fn()` returns an awaitable. Waiting for a slot does not block the event loop."""
+        for attempt in range(max_retries + 1):
+            started = await asyncio.to_thread(self.acquire)
+            try:
+                result = await fn()
+            except Exception as e:
+                overloaded = is_overload(e)
+                self.release(started, overloaded=overloaded, sample=False)
+                if not overloaded or attempt == max_retries:
+                    raise
+                with self._cond:
+                    self.retries += 1
+                await asyncio.sleep(random.uniform(0, retry_backoff * 2 ** attempt))
+                continue
+            self.release(started, tokens=_completion_tokens(result), sample=not getattr(result, "cache_hit", False))
+            return result
+
+    def stats(self, quantiles=(50, 95)):
+        """Current limit, in-flight and queued calls, queue waits, throughput and error rate."""
+        now = time.monotonic()
+        with self._cond:
+            completions = [(t, overloaded) for t, overloaded in self._completions if t >= now - METRICS_WINDOW_S]
+            waits = list(self.queue_wait_ms)
+            report = {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "retries": self.retries,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "latency_ms": round(self._rtt * 1000, 1) if self._rtt is not None else None,
+            }
+        report["throughput_per_s"] = round(len(completions) / METRICS_WINDOW_S, 3)
+        report["error_rate"] = round(sum(o for _, o in completions) / len(completions), 4) if completions else 0.0
+        if waits:
+            for q, value in zip(quantiles, np.percentile(waits, quantiles)):
+                report[f"queue_wait_ms_p{q}"] = round(float(value), 2)
+        return report
+
+def _completion_tokens(result):
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "completion_tokens", None) if usage is not None else None
+
+def get_limiter(model):
+    """The process-wide limiter for `model`, created from MODEL_LIMITS on first use."""
+    with _LIMITERS_LOCK:
+        if model not in _LIMITERS:
+            _LIMITERS[model] = AIMDLimiter(model, **{**MODEL_LIMITS["default"], **MODEL_LIMITS.get(model, {})})
+        return _LIMITERS[model]
+
+def limiter_stats():
+    """stats() of every limiter in the process, keyed by model name."""
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.items())
+    return {model: limiter.stats() for model, limiter in limiters}
+
+def max_concurrency(*lms):
+    """Upper bound on concurrent calls to these LMs, for sizing thread pools that use them."""
+    return max(
+        {**MODEL_LIMITS["default"], **MODEL_LIMITS.get(lm.model, {})}["max_limit"]
+        for lm in lms
+    )
+
+class AdaptiveLM(dspy.LM):
+    """
+    dspy.LM whose requests go through the shared `AIMDLimiter` of its model. Overload
+    errors are retried by the limiter, up to `max_retries` times, so LiteLLM's own
+    retries are off by default.
+    """
+    def __init__(self, model, max_retries=MAX_RETRIES, **kwargs):
+        kwargs.setdefault("num_retries", 0)
+        super().__init__(model, **kwargs)
+        self.max_retries = max_retries
+
+    @property
+    def limiter(self):
+        return get_limiter(self.model)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        forward = super().forward
+        return self.limiter.call(lambda: forward(prompt=prompt, messages=messages, **kwargs), self.max_retries)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        aforward = super().aforward
+        return await self.limiter.acall(lambda: aforward(prompt=prompt, messages=messages, **kwargs), self.max_retries)
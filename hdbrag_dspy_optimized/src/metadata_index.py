@@ -0,0 +1,70 @@
+import json
+import os
+from pathlib import Path
+
+# Node metadata fields that retrieval can be filtered on
+FILTER_FIELDS = ("doc_id", "section")
+POSTINGS_FILE = "metadata_postings.json"
+
+class MetadataIndex:
+    """
+    Posting lists from metadata values to node ids, used to scope retrieval to some
+    pages or sections before any scoring happens.
+
+    Filters map a field to one value or a list of values. Values of a field are OR-ed
+    and fields are AND-ed, e.g. `{"doc_id": ["singles", "financing-a-flat"],
+    "section": "Eligibility"}`. A doc_id may be given as the page's file name, with
+    dashes, as well as in its stored form.
+    """
+    def __init__(self, postings, version=None):
+        self.postings = postings
+        self.version = version
+
+    @classmethod
+    def from_nodes(cls, nodes, version=None):
+        postings = {field: {} for field in FILTER_FIELDS}
+        for node in nodes:
+            for field in FILTER_FIELDS:
+                value = node.metadata.get(field)
+                if value is not None:
+                    postings[field].setdefault(str(value), []).append(node.node_id)
+        return cls(postings, version=version)
+
+    @staticmethod
+    def _normalize(field, value):
+        # process_file derives doc_id from the file name, replacing "-" with "_"
+        return str(value).replace("-", "_") if field == "doc_id" else str(value)
+
+    def node_ids(self, filters):
+        """Set of node ids matching `filters`; None when there is nothing to filter on."""
+        if not filters:
+            return None
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown filter fields {sorted(unknown)}, expected some of {list(FILTER_FIELDS)}")
+
+        matches = []
+        for field, values in filters.items():
+            values = [values] if isinstance(values, str) else values
+            ids = set()
+            for value in values:
+                ids.update(self.postings[field].get(self._normalize(field, value), ()))
+            matches.append(ids)
+        # Intersect starting from the shortest posting list
+        matches.sort(key=len)
+        return set.intersection(*matches)
+
+    def values(self, field):
+        """Distinct values of a filter field, e.g. to list the sections a widget can scope to."""
+        return sorted(self.postings[field])
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps({"version": self.version, "postings": self.postings}), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(data["postings"], version=data.get("version"))
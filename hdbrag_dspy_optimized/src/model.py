@@ -1,46 +1,301 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import dspy
+from dspy.streaming import StreamListener, StreamResponse
+from llama_index.core.schema import NodeWithScore
 from .signatures import GenerateAnswer, GenerateSearchQueries, GenerateHypotheticalAnswer
-from .retriever import HDBRetriever
+from .retriever import HDBRetriever, SnapshotRetriever
+from .context import CONTEXT_TOKENS, pack_context
+from . import telemetry
+
+# Adaptive retrieval skips query expansion and HyDE when the plain question's results
+# clear both: top rerank score and BM25/vector agreement
+ADAPTIVE_THRESHOLD = 0.9
+ADAPTIVE_MIN_AGREEMENT = 0.34
+
+# Question run through every stage by warmup()
+WARMUP_QUESTION = "What is the Enhanced CPF Housing Grant?"
+
+# Shared pool for the concurrent forward path. Module-level rather than an HDBRAG
+# attribute so that DSPy can still deepcopy the program during optimization.
+_EXECUTOR = None
+
+def _get_executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hdbrag")
+    return _EXECUTOR
+
+def _submit(fn, *args, **kwargs):
+    """Run fn on the shared pool with the caller's DSPy context (LM, trace) attached."""
+    ctx = contextvars.copy_context()
+    return _get_executor().submit(ctx.run, fn, *args, **kwargs)
+
+class FastPathStats:
+    """How many adaptive questions were answered without query expansion and HyDE."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.fast = 0
+
+    def record(self, fast):
+        with self._lock:
+            self.questions += 1
+            self.fast += int(fast)
+
+    def rate(self):
+        with self._lock:
+            return self.fast / self.questions if self.questions else 0.0
+
+    def reset(self):
+        with self._lock:
+            self.questions = self.fast = 0
+
+    def __deepcopy__(self, memo):
+        # Program copies made during optimization keep counting into the same totals
+        return self
+
+    def __str__(self):
+        return f"fast path {self.fast}/{self.questions} ({self.rate():.1%}), {2 * self.fast} expansion/HyDE LM calls saved"
 
 class HDBRAG(dspy.Module):
-    """The core RAG module using Chain of Thought and HDB Retrieval."""
-    def __init__(self, index, k=3):
+    """The core RAG module using Chain of Thought and HDB Retrieval.
+
+    Pass a `SemanticCache` as `cache` to answer paraphrases of earlier questions
+    without any LM or retrieval calls, and a `RetrievalCache` as `retrieval_cache`
+    to reuse query embeddings and rerank scores. Stage timings go to `tracer`
+    (default: the process-wide `telemetry.tracer`).
+
+    Retrieved passages are packed into `context_tokens` tokens by rerank score before
+    generation (see `pack_context`). `context_tokens=None` passes the top k + 2
+    passages unchanged, as before.
+
+    With `adaptive=True` the plain question is retrieved and reranked first, and query
+    expansion and HyDE only run when its results fall below `adaptive_threshold` (top
+    rerank score) or `adaptive_min_agreement` (share of the top k found by both BM25
+    and vectors).
+    `fast_path_stats` counts how often they are skipped.
+
+    `filters` (e.g. `{"doc_id": "singles", "section": "Eligibility"}`) restrict every
+    retrieval of a question to the matching chunks; see `HDBRetriever`. Filtered
+    questions bypass the semantic cache, whose entries are not scoped.
+
+    Pass a `RetrievalSnapshot` as `retrieval_snapshot` to replay recorded retrieval
+    results through a `SnapshotRetriever`, e.g. while optimizing prompts.
+    """
+    def __init__(self, index, k=3, concurrent=True, cache=None, tracer=None, retrieval_cache=None,
+                 context_tokens=CONTEXT_TOKENS, adaptive=False, adaptive_threshold=ADAPTIVE_THRESHOLD,
+                 adaptive_min_agreement=ADAPTIVE_MIN_AGREEMENT, retrieval_snapshot=None):
         super().__init__()
         self.index = index
         self.k = k
-        self.retriever = HDBRetriever(index=index, k=k)
-        
+        self.concurrent = concurrent
+        self.cache = cache
+        self.context_tokens = context_tokens
+        self.adaptive = adaptive
+        self.adaptive_threshold = adaptive_threshold
+        self.adaptive_min_agreement = adaptive_min_agreement
+        self.fast_path_stats = FastPathStats()
+        self.tracer = tracer or telemetry.tracer
+        if retrieval_snapshot is not None:
+            self.retriever = SnapshotRetriever(index=index, snapshot=retrieval_snapshot, k=k, tracer=self.tracer,
+                                               cache=retrieval_cache)
+        else:
+            self.retriever = HDBRetriever(index=index, k=k, tracer=self.tracer, cache=retrieval_cache)
+
         # Transformation layers
         self.generate_queries = dspy.Predict(GenerateSearchQueries)
         self.generate_hyde = dspy.Predict(GenerateHypotheticalAnswer)
-        
+
         # Generator
         self.generate_answer = dspy.ChainOfThought(GenerateAnswer)
 
-    def forward(self, question):
+    def forward(self, question, filters=None):
+        prediction = None
+        for event, payload in self.stream(question, filters=filters):
+            if event == "answer":
+                prediction = payload
+        return prediction
+
+    def stream(self, question, tokens=False, filters=None):
+        """Like forward, but yields ("sources", context) as soon as retrieval is done,
+        then ("answer", prediction), so callers can show the sources while the LM runs.
+
+        With `tokens=True` the answer is also yielded as ("token", text) pieces while the
+        LM writes it. Cached answers, and LMs that cannot stream, yield no tokens, so
+        callers should fall back to the final prediction's answer.
+        """
+        with self.tracer.query(question):
+            embedding = None
+            cache = None if filters else self.cache
+            if cache is not None:
+                with self.tracer.span("cache_lookup") as span:
+                    embedding = cache.embed(question)
+                    cached = cache.lookup(question, embedding=embedding)
+                    span["hit"] = cached is not None
+                if cached is not None:
+                    yield "sources", cached.context
+                    yield "answer", cached
+                    return
+
+            nodes = self._gather_context(question, filters)
+            yield "sources", self._as_passages(nodes)
+            prediction = yield from self._generate(question, nodes, tokens)
+            if cache is not None:
+                cache.store(question, prediction, embedding=embedding)
+            yield "answer", prediction
+
+    def warmup(self, question=WARMUP_QUESTION, lm=True):
+        """
+        Run `question` through every stage so the first real question does not pay for
+        loading BM25, the embedding model and the cross-encoder. With `lm=False` only
+        retrieval runs and no LM calls are made. Bypasses the semantic cache and returns
+        the time taken in ms.
+        """
+        start = time.perf_counter()
+        with self.tracer.query(question):
+            if not lm:
+                self.retriever.warmup(question)
+            else:
+                nodes = self._retrieve_concurrent(question) if self.concurrent else self._retrieve_sequential(question)
+                for _ in self._generate(question, nodes):
+                    pass
+        return (time.perf_counter() - start) * 1000
+
+    def _gather_context(self, question, filters=None):
+        if self.adaptive:
+            context = self._retrieve_adaptive(question, filters)
+        elif self.concurrent:
+            context = self._retrieve_concurrent(question, filters)
+        else:
+            context = self._retrieve_sequential(question, filters)
+
+        # 4. Filter duplicates, keeping the best rerank score of each passage
+        with self.tracer.span("dedupe", candidates=len(context)) as span:
+            unique_nodes = {}
+            for n in context:
+                text = n.node.get_content()
+                if text not in unique_nodes:
+                    unique_nodes[text] = n
+                elif (n.score or 0.0) > (unique_nodes[text].score or 0.0):
+                    unique_nodes[text] = NodeWithScore(node=unique_nodes[text].node, score=n.score)
+            span["unique"] = len(unique_nodes)
+        return list(unique_nodes.values())
+
+    @staticmethod
+    def _as_passages(nodes):
+        return [dspy.Prediction(long_text=n.node.get_content()) for n in nodes]
+
+    def _generate(self, question, nodes, tokens=False):
+        # 5. Pack the passages into the token budget
+        if self.context_tokens is None:
+            context = self._as_passages(nodes[:self.k+2])
+        else:
+            with self.tracer.span("context_packing", passages=len(nodes)) as span:
+                context = pack_context(nodes, self.context_tokens, span)
+
+        # 6. Generate
+        with self.tracer.span("generate_answer") as span:
+            if tokens:
+                prediction = None
+                for chunk in self._stream_answer(context=context, question=question):
+                    if isinstance(chunk, StreamResponse):
+                        yield "token", chunk.chunk
+                    elif isinstance(chunk, dspy.Prediction):
+                        prediction = chunk
+                if prediction is None:
+                    # The stream ended without its final Prediction (e.g. the listener
+                    # failed to parse the output): answer without streaming instead
+                    span["stream_fallback"] = True
+                    prediction = self.generate_answer(context=context, question=question)
+            else:
+                prediction = self.generate_answer(context=context, question=question)
+            span.update(telemetry.lm_token_counts(prediction))
+        return dspy.Prediction(context=self._as_passages(nodes), answer=prediction.answer)
+
+    def _stream_answer(self, **kwargs):
+        # Built per call: stream listeners keep state about the field they are reading
+        streamer = dspy.streamify(
+            self.generate_answer,
+            stream_listeners=[StreamListener(signature_field_name="answer")],
+            async_streaming=False,
+        )
+        return streamer(**kwargs)
+
+    def _expand_queries(self, question):
+        with self.tracer.span("query_expansion") as span:
+            prediction = self.generate_queries(question=question)
+            span.update(telemetry.lm_token_counts(prediction))
+        return self._parse_expansion(prediction.queries)
+
+    def _hyde(self, question):
+        with self.tracer.span("hyde") as span:
+            prediction = self.generate_hyde(question=question)
+            span.update(telemetry.lm_token_counts(prediction))
+        return prediction.answer
+
+    def _retrieve_sequential(self, question, filters=None):
         # 1. Multi-Query Expansion
-        query_expansion = self.generate_queries(question=question).queries
-        # Simple parsing if the model returns a string list
-        queries = [question]
-        if isinstance(query_expansion, list):
-            queries.extend(query_expansion)
-        elif isinstance(query_expansion, str):
-            queries.extend([q.strip() for q in query_expansion.split("\n") if q.strip()][:2])
+        queries = [question] + self._expand_queries(question)
 
         # 2. HyDE (Hypothetical Document Embeddings)
-        hyde_answer = self.generate_hyde(question=question).answer
-        queries.append(hyde_answer)
+        queries.append(self._hyde(question))
 
         # 3. Enhanced Retrieval
-        context = self.retriever(queries, k=self.k)
-        
-        # 4. Filter duplicates and generate
-        seen_texts = set()
-        unique_context = []
-        for c in context:
-            if c.long_text not in seen_texts:
-                unique_context.append(c)
-                seen_texts.add(c.long_text)
-
-        prediction = self.generate_answer(context=unique_context[:self.k+2], question=question)
-        return dspy.Prediction(context=unique_context, answer=prediction.answer)
+        return self.retriever.retrieve_nodes(queries, k=self.k, filters=filters)
+
+    def _retrieve_concurrent(self, question, filters=None):
+        # 1 + 2. Query expansion and HyDE only depend on the question, so issue both at once
+        expansion_future = _submit(self._expand_queries, question)
+        hyde_future = _submit(self._hyde, question)
+
+        # 3. Retrieval for the original question starts while the LM calls are in flight
+        original_future = _submit(self.retriever.retrieve_nodes, [question], k=self.k, filters=filters)
+
+        queries = expansion_future.result()
+        queries.append(hyde_future.result())
+
+        # Merge in the same order as the sequential path: original, expansions, HyDE
+        return original_future.result() + self.retriever.retrieve_nodes(queries, k=self.k, filters=filters)
+
+    def _retrieve_adaptive(self, question, filters=None):
+        # 1. Retrieve and rerank the plain question
+        stats = {}
+        original = self.retriever.retrieve_nodes([question], k=self.k, stats=stats, filters=filters)
+
+        # 2. Stop there if the results are confident enough
+        with self.tracer.span("adaptive") as span:
+            signals = {
+                "top_score": max((n.score or 0.0 for n in original), default=0.0),
+                # Missing when a retrieval leg is switched off; then it does not count against
+                "agreement": stats.get("agreement", [1.0])[0],
+            }
+            fast = bool(original) and (
+                signals["top_score"] >= self.adaptive_threshold
+                and signals["agreement"] >= self.adaptive_min_agreement
+            )
+            span.update({key: round(value, 4) for key, value in signals.items()})
+            span["fast_path"] = fast
+        self.fast_path_stats.record(fast)
+        if fast:
+            return original
+
+        # 3. Otherwise expand the question as usual
+        if self.concurrent:
+            expansion_future = _submit(self._expand_queries, question)
+            hyde = self._hyde(question)
+            queries = expansion_future.result() + [hyde]
+        else:
+            queries = self._expand_queries(question) + [self._hyde(question)]
+        return original + self.retriever.retrieve_nodes(queries, k=self.k, filters=filters)
+
+    @staticmethod
+    def _parse_expansion(query_expansion):
+        # Simple parsing if the model returns a string list
+        if isinstance(query_expansion, list):
+            return list(query_expansion)
+        if isinstance(query_expansion, str):
+            return [q.strip() for q in query_expansion.split("\n") if q.strip()][:2]
+        return []
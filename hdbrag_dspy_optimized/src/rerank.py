@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+# Defaults for the shared cross-encoder scheduler
+RERANK_MAX_BATCH = 128     # (query, passage) pairs per forward pass
+RERANK_MAX_WAIT_MS = 5.0   # how long the first request of a busy batch waits for company
+
+# One scheduler per (model, settings), shared by every HDBRetriever in the process
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+class RerankScheduler:
+    """
+    Dynamic batching for a cross-encoder shared by concurrent retrievals.
+
+    `score(pairs)` queues a request and blocks until its scores are ready. A single
+    worker thread takes the queued requests in order and scores up to `max_batch` pairs
+    from them in one padded forward pass. A request that arrived while others were
+    queued or being scored waits up to `max_wait_ms` for more to join its batch; one
+    arriving at an idle scheduler is dispatched straight away. Requests are never
+    split, so a request larger than `max_batch` runs alone. Batch sizes and queue waits
+    are kept for `stats()`.
+    """
+    def __init__(self, model, max_batch=RERANK_MAX_BATCH, max_wait_ms=RERANK_MAX_WAIT_MS, max_samples=10000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._queue = deque()     # (pairs, future, queued_at, idle)
+        self._scoring = False
+        self._cond = threading.Condition()
+        self._worker_pid = None
+        self.batch_pairs = deque(maxlen=max_samples)
+        self.batch_requests = deque(maxlen=max_samples)
+        self.queue_wait_ms = deque(maxlen=max_samples)
+
+    def score(self, pairs, stats=None):
+        """Scores for (query, passage) pairs; `stats` (e.g. a tracer span) gets the batch details."""
+        if not pairs:
+            return []
+        future = Future()
+        with self._cond:
+            self._ensure_worker()
+            idle = not self._queue and not self._scoring
+            self._queue.append((list(pairs), future, time.perf_counter(), idle))
+            self._cond.notify()
+        scores, details = future.result()
+        if stats is not None:
+            stats.update(details)
+        return scores
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so a forked server worker starts its own
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name="rerank-scheduler", daemon=True).start()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            batch = [self._queue.popleft()]
+            size = len(batch[0][0])
+            # Nothing else was in flight: no company is coming, so do not wait for it
+            deadline = batch[0][2] + (0 if batch[0][3] else self.max_wait_ms / 1000)
+            while size < self.max_batch:
+                if not self._queue:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                    continue
+                if size + len(self._queue[0][0]) > self.max_batch:
+                    break
+                request = self._queue.popleft()
+                batch.append(request)
+                size += len(request[0])
+            self._scoring = True
+            return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._next_batch()
+            started = time.perf_counter()
+            waits = [(started - queued_at) * 1000 for _, _, queued_at, _ in batch]
+            try:
+                scores = self.model.predict(
+                    [pair for pairs, _, _, _ in batch for pair in pairs],
+                    batch_size=max(size, 1),
+                    show_progress_bar=False,
+                )
+            except Exception as e:
+                with self._cond:
+                    self._scoring = False
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._cond:
+                self._scoring = False
+                self.batch_pairs.append(size)
+                self.batch_requests.append(len(batch))
+                self.queue_wait_ms.extend(waits)
+            offset = 0
+            for (pairs, future, _, _), wait in zip(batch, waits):
+                details = {"batch_pairs": size, "batch_requests": len(batch), "queue_wait_ms": round(wait, 2)}
+                future.set_result((scores[offset:offset + len(pairs)], details))
+                offset += len(pairs)
+
+    def stats(self, quantiles=(50, 95, 99)):
+        """Batch-size and queue-wait distributions since the scheduler started."""
+        with self._cond:
+            pairs, requests, waits = list(self.batch_pairs), list(self.batch_requests), list(self.queue_wait_ms)
+            queued = len(self._queue)
+        report = {"batches": len(pairs), "queued": queued}
+        if pairs:
+            report["batch_pairs_mean"] = round(float(np.mean(pairs)), 1)
+            report["batch_requests_mean"] = round(float(np.mean(requests)), 2)
+            for q, value in zip(quantiles, np.percentile(waits, quantiles)):
+                report[f"queue_wait_ms_p{q}"] = round(float(value), 2)
+        return report
+
+def get_rerank_scheduler(name, model, max_batch=RERANK_MAX_BATCH, max_wait_ms=RERANK_MAX_WAIT_MS):
+    """The process-wide scheduler for a reranker model, created with `model` on first use."""
+    key = (name, max_batch, max_wait_ms)
+    with _SCHEDULERS_LOCK:
+        if key not in _SCHEDULERS:
+            _SCHEDULERS[key] = RerankScheduler(model, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        return _SCHEDULERS[key]
+
+def rerank_stats():
+    """stats() of every scheduler in the process, keyed by model name."""
+    with _SCHEDULERS_LOCK:
+        schedulers = list(_SCHEDULERS.items())
+    return {name: scheduler.stats() for (name, _, _), scheduler in schedulers}
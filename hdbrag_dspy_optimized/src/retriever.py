@@ -1,98 +1,691 @@
-import json
+import hashlib
+import shutil
+import threading
+import uuid
 from pathlib import Path
+import numpy as np
 import dspy
 from llama_index.core import Document, VectorStoreIndex, StorageContext, load_index_from_storage, Settings
-from llama_index.core.retrievers import QueryFusionRetriever
+from llama_index.core.retrievers import QueryFusionRetriever, VectorIndexRetriever
+from llama_index.core.ingestion import run_transformations
 from llama_index.retrievers.bm25 import BM25Retriever
 from llama_index.core.postprocessor import SentenceTransformerRerank
+from llama_index.core.schema import QueryBundle, NodeWithScore, MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from .ingestion.chunk_store import default_chunks_path, iter_chunks
+from .vector_store import MMAP_DIR_NAME, MmapVectorStore
+from .metadata_index import POSTINGS_FILE, MetadataIndex
+from .ann_index import ANN_INDEXES, SEARCH_PARAMS
+from .rerank import RERANK_MAX_BATCH, RERANK_MAX_WAIT_MS, get_rerank_scheduler
+from . import telemetry
+
+# Constant used by LlamaIndex's reciprocal rank fusion
+RRF_K = 60.0
+RERANK_MODEL = "cross-encoder/ms-marco-TinyBERT-L-2-v2"
+
+BASE_DIR = Path(__file__).parent.parent
+DATA_DIR = BASE_DIR / "data"
+STORAGE_DIR = DATA_DIR / "index_storage"
+INDEX_VERSION_FILE = "index_version"
+BM25_DIR_NAME = "bm25"
+
+# BM25 models loaded from index_storage, shared by every HDBRetriever in the process
+_BM25_CACHE = {}
+_BM25_LOCK = threading.Lock()
+# Same for the metadata posting index
+_METADATA_INDEX_CACHE = {}
+_METADATA_INDEX_LOCK = threading.Lock()
 
 class HDBRetriever(dspy.Retrieve):
     """
     A custom DSPy retriever that uses LlamaIndex for Hybrid Search (Vector + BM25)
     and Reranking (Cross-Encoder).
+
+    With `batched=True` (default) the distinct queries of a call are embedded once,
+    scored by BM25 together and reranked in a single cross-encoder pass. Queries are
+    embedded in query mode, so instruction-tuned models get their query prefix.
+
+    The BM25 statistics are loaded lazily from `storage_dir` and shared between
+    instances. Pass `storage_dir=None` to build them in memory from the docstore.
+
+    `use_vector`, `use_bm25` and `rerank` switch individual stages off, e.g. to
+    benchmark vector-only or fused-without-rerank configurations.
+
+    Cross-encoder scoring goes through a process-wide `RerankScheduler`, which merges
+    the pairs of concurrent retrievals into batches of up to `rerank_max_batch` pairs,
+    waiting at most `rerank_wait_ms` for them. `rerank_wait_ms=None` scores each call
+    on its own.
+
+    Pass a `RetrievalCache` as `cache` to reuse query embeddings and cross-encoder
+    scores across calls (batched path only).
+
+    `filters` (e.g. `{"doc_id": "singles"}` or `{"section": ["Eligibility", "Grants"]}`)
+    restrict retrieval to matching chunks. They are resolved against the metadata
+    posting index first, so vector scoring, BM25 and reranking only see those chunks.
+    Filtered calls always take the batched path.
     """
-    def __init__(self, index, k=3):
+    def __init__(self, index, k=3, batched=True, storage_dir=STORAGE_DIR, tracer=None,
+                 use_vector=True, use_bm25=True, rerank=True,
+                 rerank_max_batch=RERANK_MAX_BATCH, rerank_wait_ms=RERANK_MAX_WAIT_MS, cache=None):
         super().__init__(k=k)
         self.index = index
+        self.batched = batched
+        self.storage_dir = storage_dir
+        self.use_vector = use_vector
+        self.use_bm25 = use_bm25
+        self.rerank = rerank
+        self.rerank_max_batch = rerank_max_batch
+        self.rerank_wait_ms = rerank_wait_ms
+        self.cache = cache
+        self.tracer = tracer or telemetry.tracer
+        self.fusion_top_k = k * 3
         
         # 1. Setup Vector Retriever
-        vector_retriever = index.as_retriever(similarity_top_k=k * 2)
-        
-        # 2. Setup BM25 Retriever
-        nodes = list(index.docstore.docs.values())
-        bm25_retriever = BM25Retriever.from_defaults(nodes=nodes, similarity_top_k=k * 2)
-        
-        # 3. Setup Hybrid Search (Query Fusion)
-        self.hybrid_retriever = QueryFusionRetriever(
-            [vector_retriever, bm25_retriever],
-            similarity_top_k=k * 3, # Get more candidates for reranking
-            num_queries=1, # Default to 1, can expansion later
-            mode="reciprocal_rerank",
-            use_async=False
-        )
+        self.vector_retriever = index.as_retriever(similarity_top_k=k * 2)
         
-        # 4. Setup Reranker
-        self.reranker = SentenceTransformerRerank(
-            model="cross-encoder/ms-marco-TinyBERT-L-2-v2", 
-            top_n=k
-        )
+        # 2 + 3. BM25 and Hybrid Search (Query Fusion) are set up on first use
+        self._bm25_retriever = None
+        self._hybrid_retriever = None
+        self._bm25_rows = None
+        self._metadata_index = None
+        
+        # 4. Reranker: loading the cross-encoder (and torch) is slow, so also on first use
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+
+    @property
+    def reranker(self):
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    self._reranker = SentenceTransformerRerank(model=RERANK_MODEL, top_n=self.k)
+        return self._reranker
+
+    @property
+    def bm25_retriever(self):
+        if self._bm25_retriever is None:
+            if self.storage_dir is None:
+                nodes = list(self.index.docstore.docs.values())
+                self._bm25_retriever = BM25Retriever.from_defaults(nodes=nodes, similarity_top_k=self.k * 2)
+            else:
+                shared = load_bm25(self.index, storage_dir=self.storage_dir)
+                # Cheap view over the shared model with this retriever's own top-k
+                self._bm25_retriever = BM25Retriever(
+                    existing_bm25=shared.bm25,
+                    stemmer=shared.stemmer,
+                    similarity_top_k=self.k * 2
+                )
+        return self._bm25_retriever
+
+    @property
+    def metadata_index(self):
+        if self._metadata_index is None:
+            if self.storage_dir is None:
+                self._metadata_index = MetadataIndex.from_nodes(self.index.docstore.docs.values())
+            else:
+                self._metadata_index = load_metadata_index(self.index, storage_dir=self.storage_dir)
+        return self._metadata_index
+
+    @property
+    def hybrid_retriever(self):
+        if self._hybrid_retriever is None:
+            self._hybrid_retriever = QueryFusionRetriever(
+                [self.vector_retriever, self.bm25_retriever],
+                similarity_top_k=self.fusion_top_k, # Get more candidates for reranking
+                num_queries=1, # Default to 1, can expansion later
+                mode="reciprocal_rerank",
+                use_async=False
+            )
+        return self._hybrid_retriever
 
     def __deepcopy__(self, memo):
         return self
 
+    def warmup(self, query):
+        """Load BM25, the embedding model and the cross-encoder by retrieving `query` once."""
+        return self.retrieve_nodes(query)
+
     def dump_state(self, **kwargs):
         return {"k": self.k}
 
     def load_state(self, state, **kwargs):
         self.k = state.get("k", self.k)
         
-    def forward(self, query_or_queries, k=None):
+    def forward(self, query_or_queries, k=None, filters=None):
+        nodes = self.retrieve_nodes(query_or_queries, k=k, filters=filters)
+        return [dspy.Prediction(long_text=n.node.get_content()) for n in nodes]
+
+    def retrieve_nodes(self, query_or_queries, k=None, stats=None, filters=None):
+        """
+        Like forward, but returns the scored LlamaIndex nodes (with metadata) instead of passages.
+
+        On the batched hybrid path, `stats["agreement"]` gets, for each query, the share of
+        the top k vector results that BM25 also ranks in its top k.
+        """
         queries = [query_or_queries] if isinstance(query_or_queries, str) else query_or_queries
         k = k if k is not None else self.k
         
-        all_passed_context = []
+        with self.tracer.query(queries[0] if queries else ""):
+            with self.tracer.span("retrieval", queries=len(queries)):
+                if filters:
+                    with self.tracer.span("retrieval.filter") as span:
+                        allowed = self.metadata_index.node_ids(filters)
+                        span["matched"] = len(allowed)
+                    if not allowed:
+                        return []
+                    groups = self._retrieve_batched(queries, k, stats, allowed)
+                elif self.batched:
+                    groups = self._retrieve_batched(queries, k, stats)
+                else:
+                    groups = self._retrieve_sequential(queries, k)
+                return [n for nodes in groups for n in nodes]
+
+    def _retrieve_sequential(self, queries, k):
+        """Hybrid retrieval + rerank one query at a time. Returns the top k nodes of each query."""
+        if self.use_vector and self.use_bm25:
+            first_pass = self.hybrid_retriever
+        else:
+            first_pass = self.vector_retriever if self.use_vector else self.bm25_retriever
+        
+        groups = []
         for query in queries:
             # First pass: Hybrid retrieval
-            nodes = self.hybrid_retriever.retrieve(query)
+            with self.tracer.span("retrieval.hybrid") as span:
+                nodes = first_pass.retrieve(query)
+                span["candidates"] = len(nodes)
             
             # Second pass: Reranking
-            from llama_index.core.schema import QueryBundle
-            reranked_nodes = self.reranker.postprocess_nodes(nodes, query_bundle=QueryBundle(query))
+            if self.rerank:
+                with self.tracer.span("retrieval.rerank", pairs=len(nodes)):
+                    nodes = self.reranker.postprocess_nodes(nodes, query_bundle=QueryBundle(query))
             
             # Return top k
-            contexts = [dspy.Prediction(long_text=n.node.get_content()) for n in reranked_nodes[:k]]
-            all_passed_context.extend(contexts)
+            groups.append(nodes[:k])
             
-        return all_passed_context
+        return groups
+
+    def _retrieve_batched(self, queries, k, stats=None, allowed=None):
+        """Hybrid retrieval + rerank for all queries with one pass per stage, optionally
+        over the `allowed` node ids only. Returns the top k nodes of each query."""
+        # Identical queries (e.g. an expansion echoing the question) are only scored once
+        unique_queries = list(dict.fromkeys(queries))
+        
+        # 1. Embed all queries in one batch and run the vector leg
+        vector_results = [[] for _ in unique_queries]
+        if self.use_vector:
+            with self.tracer.span("retrieval.embed", queries=len(unique_queries)) as span:
+                embeddings = self._embed_queries(unique_queries, span)
+            vector_retriever = self.vector_retriever
+            if allowed is not None:
+                # The vector store scores only these nodes
+                vector_retriever = VectorIndexRetriever(self.index, similarity_top_k=self.k * 2, node_ids=list(allowed))
+            with self.tracer.span("retrieval.vector") as span:
+                vector_results = [
+                    vector_retriever.retrieve(QueryBundle(query_str=q, embedding=emb))
+                    for q, emb in zip(unique_queries, embeddings)
+                ]
+                span["candidates"] = sum(len(r) for r in vector_results)
+        
+        # 2. Score BM25 for all queries together
+        bm25_results = [[] for _ in unique_queries]
+        if self.use_bm25:
+            with self.tracer.span("retrieval.bm25") as span:
+                bm25_results = self._bm25_retrieve_batch(unique_queries, allowed)
+                span["candidates"] = sum(len(r) for r in bm25_results)
+        
+        if stats is not None and self.use_vector and self.use_bm25:
+            agreement = {
+                q: self._agreement(vector_nodes, bm25_nodes, k)
+                for q, vector_nodes, bm25_nodes in zip(unique_queries, vector_results, bm25_results)
+            }
+            stats["agreement"] = [agreement[q] for q in queries]
+        
+        # 3. Reciprocal rank fusion per query, merged into one deduplicated pool
+        with self.tracer.span("retrieval.fusion") as span:
+            pool = {}
+            candidates = {}
+            for q, vector_nodes, bm25_nodes in zip(unique_queries, vector_results, bm25_results):
+                fused = self._reciprocal_rank_fusion([vector_nodes, bm25_nodes])[:self.fusion_top_k]
+                for n in fused:
+                    pool.setdefault(n.node.node_id, n.node)
+                candidates[q] = [(n.node.node_id, n.score) for n in fused]
+            span["pool"] = len(pool)
+        
+        # 4. One batched cross-encoder pass over every (query, node) pair
+        ranked = {q: [] for q in unique_queries}
+        if self.rerank:
+            pairs = [(q, node_id) for q in unique_queries for node_id, _ in candidates[q]]
+            with self.tracer.span("retrieval.rerank", pairs=len(pairs)) as span:
+                scores = self._rerank_pairs(pairs, pool, span) if pairs else []
+            for (q, node_id), score in zip(pairs, scores):
+                ranked[q].append((float(score), node_id))
+        else:
+            for q in unique_queries:
+                ranked[q] = [(score, node_id) for node_id, score in candidates[q]]
+        
+        # 5. Return top k per query, in the original query order
+        groups = []
+        for query in queries:
+            top = sorted(ranked[query], key=lambda x: x[0], reverse=True)[:k]
+            groups.append([NodeWithScore(node=pool[node_id], score=score) for score, node_id in top])
+        return groups
+
+    def _embed_queries(self, queries, stats):
+        """Query-mode embeddings (with the model's query instruction), skipping those already in the retrieval cache."""
+        embed_model = Settings.embed_model
+        if self.cache is None:
+            return [embed_model.get_query_embedding(q) for q in queries]
+        
+        # Query and text embeddings differ for instruction-tuned models such as BGE
+        model = f"{type(embed_model).__name__}:{embed_model.model_name}:query"
+        embeddings = self.cache.get_embeddings(model, queries)
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        stats["cached"] = len(queries) - len(missing)
+        if missing:
+            computed = [embed_model.get_query_embedding(queries[i]) for i in missing]
+            self.cache.put_embeddings(model, [queries[i] for i in missing], computed)
+            for i, e in zip(missing, computed):
+                embeddings[i] = e
+        return embeddings
+
+    def _rerank_pairs(self, pairs, pool, stats):
+        """Cross-encoder scores for (query, node_id) pairs, reusing cached scores."""
+        texts = {node_id: node.get_content(metadata_mode=MetadataMode.EMBED) for node_id, node in pool.items()}
+        if self.cache is None:
+            return self._score_pairs([(q, texts[node_id]) for q, node_id in pairs], stats)
+        
+        # Keyed by chunk_id and content hash: stable across rebuilds, a miss once the chunk changes
+        entries = [
+            (q, pool[node_id].metadata.get("chunk_id", node_id), hashlib.sha1(texts[node_id].encode("utf-8")).hexdigest())
+            for q, node_id in pairs
+        ]
+        scores = self.cache.get_scores(RERANK_MODEL, entries)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        stats["cached"] = len(pairs) - len(missing)
+        if missing:
+            computed = self._score_pairs([(pairs[i][0], texts[pairs[i][1]]) for i in missing], stats)
+            self.cache.put_scores(RERANK_MODEL, [entries[i] for i in missing], computed)
+            for i, score in zip(missing, computed):
+                scores[i] = score
+        return scores
+
+    def _bm25_retrieve_batch(self, queries, allowed=None):
+        """Retrieve BM25 candidates for several queries in one scoring call, optionally
+        scoring only the `allowed` node ids."""
+        bm25 = self.bm25_retriever
+        try:
+            import bm25s
+        except ImportError:
+            bm25s = None
+        if bm25s is None or not hasattr(bm25, "bm25"):
+            results = [bm25.retrieve(q) for q in queries]
+            if allowed is None:
+                return results
+            return [[n for n in nodes if n.node.node_id in allowed] for nodes in results]
+        
+        top_k = min(bm25.similarity_top_k, len(bm25.corpus))
+        weight_mask = None
+        if allowed is not None:
+            # Zero weight for every document outside the filter, so bm25s never ranks them
+            weight_mask = np.zeros(len(bm25.corpus), dtype=np.float32)
+            weight_mask[[row for row in map(self._bm25_row_of().get, allowed) if row is not None]] = 1.0
+            top_k = min(top_k, int(weight_mask.sum()))
+        if top_k == 0:
+            return [[] for _ in queries]
+        query_tokens = bm25s.tokenize(
+            queries,
+            stemmer=None if getattr(bm25, "skip_stemming", False) else bm25.stemmer,
+            show_progress=False,
+        )
+        indexes, scores = bm25.bm25.retrieve(query_tokens, k=top_k, show_progress=False, weight_mask=weight_mask)
+        
+        results = []
+        for row_indexes, row_scores in zip(indexes, scores):
+            # bm25s returns the corpus entries themselves when the model was saved with a corpus
+            entries = [(idx if isinstance(idx, dict) else bm25.corpus[int(idx)], score) for idx, score in zip(row_indexes, row_scores)]
+            results.append([
+                NodeWithScore(node=metadata_dict_to_node(entry), score=float(score))
+                for entry, score in entries
+                # Ties at score 0 can still surface masked documents
+                if allowed is None or entry["node_id"] in allowed
+            ])
+        return results
+
+    def _bm25_row_of(self):
+        """node_id -> position in the BM25 corpus, built once per retriever."""
+        if self._bm25_rows is None:
+            self._bm25_rows = {entry["node_id"]: row for row, entry in enumerate(self.bm25_retriever.corpus)}
+        return self._bm25_rows
+
+    @staticmethod
+    def _agreement(vector_nodes, bm25_nodes, k):
+        """Share of the top k vector results that are also in the top k BM25 results."""
+        def top_ids(nodes):
+            ranked = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)[:k]
+            return {n.node.node_id for n in ranked}
+        vector_ids = top_ids(vector_nodes)
+        return len(vector_ids & top_ids(bm25_nodes)) / len(vector_ids) if vector_ids else 0.0
+
+    @staticmethod
+    def _reciprocal_rank_fusion(result_lists):
+        """Same fusion as QueryFusionRetriever(mode="reciprocal_rerank")."""
+        fused_scores = {}
+        nodes = {}
+        for result in result_lists:
+            ranked = sorted(result, key=lambda n: n.score or 0.0, reverse=True)
+            for rank, n in enumerate(ranked):
+                node_id = n.node.node_id
+                nodes[node_id] = n.node
+                fused_scores[node_id] = fused_scores.get(node_id, 0.0) + 1.0 / (rank + RRF_K)
+        
+        ordered = sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in ordered]
+
+    def _score_pairs(self, pairs, stats=None):
+        """Run the cross-encoder over (query, passage) pairs, batched with concurrent callers."""
+        if self.rerank_wait_ms is None:
+            return self.reranker._model.predict(pairs)
+        scheduler = get_rerank_scheduler(
+            RERANK_MODEL, self.reranker._model,
+            max_batch=self.rerank_max_batch, max_wait_ms=self.rerank_wait_ms
+        )
+        return scheduler.score(pairs, stats)
+
+class SnapshotRetriever(HDBRetriever):
+    """
+    HDBRetriever that replays results from a `RetrievalSnapshot` instead of retrieving.
+
+    A query found in the snapshot for this index (its `storage_dir`), its current version,
+    k and retriever settings returns its stored nodes and scores without embedding, BM25 or reranking.
+    Other queries are retrieved live and, with `record=True`, added to the snapshot, so
+    expansion and HyDE queries that recur across optimization trials are replayed too.
+    Use `precompute` to fill the snapshot up front. Filtered calls always run live.
+    """
+    def __init__(self, index, snapshot, record=True, **kwargs):
+        super().__init__(index, **kwargs)
+        self.snapshot = snapshot
+        self.record = record
+        self.index_version = get_index_version(self.storage_dir) if self.storage_dir is not None else None
+        # Snapshot rows are scoped per index, so indexes sharing a snapshot file keep their own rows
+        self.scope = str(Path(self.storage_dir).resolve()) if self.storage_dir is not None else ""
+
+    def _settings(self, k):
+        """Everything besides the query and index version that changes the results."""
+        return (
+            f"k={k};batched={self.batched};vector={self.use_vector};bm25={self.use_bm25};"
+            f"rerank={RERANK_MODEL if self.rerank else None};fusion_top_k={self.fusion_top_k}"
+        )
+
+    def _replay(self, entry):
+        if entry is None:
+            return None
+        nodes = []
+        for node_id, score in entry["nodes"]:
+            node = self.index.docstore.get_node(node_id, raise_error=False)
+            if node is None:
+                # Recorded against a docstore that has since changed: retrieve again
+                return None
+            nodes.append(NodeWithScore(node=node, score=score))
+        return nodes
+
+    def retrieve_nodes(self, query_or_queries, k=None, stats=None, filters=None):
+        if filters:
+            return super().retrieve_nodes(query_or_queries, k=k, stats=stats, filters=filters)
+        queries = [query_or_queries] if isinstance(query_or_queries, str) else query_or_queries
+        k = k if k is not None else self.k
+        settings = self._settings(k)
+
+        with self.tracer.query(queries[0] if queries else ""):
+            with self.tracer.span("retrieval.snapshot", queries=len(queries)) as span:
+                entries = self.snapshot.get(self.scope, self.index_version, settings, queries)
+                groups = [self._replay(entry) for entry in entries]
+                missing = [i for i, nodes in enumerate(groups) if nodes is None]
+                span["hits"] = len(queries) - len(missing)
+
+            if missing:
+                live, live_entries = self._retrieve_live([queries[i] for i in missing], k, settings, self.record)
+                for i, nodes, entry in zip(missing, live, live_entries):
+                    groups[i] = nodes
+                    entries[i] = entry
+
+        if stats is not None and all(entry["agreement"] is not None for entry in entries):
+            stats["agreement"] = [entry["agreement"] for entry in entries]
+        return [n for nodes in groups for n in nodes]
+
+    def _retrieve_live(self, queries, k, settings, record):
+        """Retrieve queries with the full pipeline; returns their nodes and snapshot entries."""
+        stats = {}
+        with self.tracer.span("retrieval", queries=len(queries)):
+            if self.batched:
+                groups = self._retrieve_batched(queries, k, stats)
+            else:
+                groups = self._retrieve_sequential(queries, k)
+        agreement = stats.get("agreement", [None] * len(queries))
+        entries = [
+            {"nodes": [(n.node.node_id, n.score) for n in nodes], "agreement": value}
+            for nodes, value in zip(groups, agreement)
+        ]
+        if record:
+            self.snapshot.put(self.scope, self.index_version, settings, queries, entries)
+        return groups, entries
+
+    def precompute(self, questions, batch_size=32):
+        """Retrieve and record every question not yet in the snapshot. Returns how many were retrieved."""
+        questions = list(dict.fromkeys(questions))
+        settings = self._settings(self.k)
+        entries = self.snapshot.get(self.scope, self.index_version, settings, questions)
+        todo = [q for q, entry in zip(questions, entries) if self._replay(entry) is None]
+        for start in range(0, len(todo), batch_size):
+            with self.tracer.query(todo[start]):
+                self._retrieve_live(todo[start:start + batch_size], self.k, settings, record=True)
+        return len(todo)
+
+def get_index_version(storage_dir=STORAGE_DIR):
+    """Return the id stamped on the persisted index by its last (re)build, or None."""
+    version_path = Path(storage_dir) / INDEX_VERSION_FILE
+    if not version_path.exists():
+        return None
+    return version_path.read_text(encoding="utf-8").strip()
+
+def _bump_index_version(storage_dir):
+    """Stamp a new index version so caches built on the old index invalidate themselves."""
+    version = uuid.uuid4().hex
+    (Path(storage_dir) / INDEX_VERSION_FILE).write_text(version, encoding="utf-8")
+    return version
 
-def get_hdb_index(force_rebuild=False):
-    """Load or initialize the LlamaIndex for HDB chunks."""
-    base_dir = Path(__file__).parent.parent
-    data_path = base_dir / "data" / "chunks.json"
-    storage_dir = base_dir / "data" / "index_storage"
+def _persist_bm25(index, storage_dir):
+    """Build the BM25 model (tokenized corpus and term statistics) and save it in index_storage."""
+    bm25_dir = Path(storage_dir) / BM25_DIR_NAME
+    nodes = list(index.docstore.docs.values())
+    bm25_retriever = BM25Retriever.from_defaults(nodes=nodes)
+    bm25_retriever.persist(str(bm25_dir))
+    # Record which index the statistics belong to, so a stale copy is never loaded
+    version = get_index_version(storage_dir)
+    if version is not None:
+        (bm25_dir / INDEX_VERSION_FILE).write_text(version, encoding="utf-8")
+
+def load_bm25(index, storage_dir=STORAGE_DIR):
+    """
+    Return the BM25Retriever persisted next to the vector store, loading it once per process.
+
+    Indexes persisted before BM25 was saved alongside them get it built and saved on first use.
+    """
+    bm25_dir = Path(storage_dir) / BM25_DIR_NAME
+    version = get_index_version(storage_dir)
+    key = (str(bm25_dir.resolve()), version)
     
-    if force_rebuild or not storage_dir.exists():
-        if not data_path.exists():
-            raise FileNotFoundError(f"Chunks file not found at {data_path}. Run parsing first.")
-            
-        with open(data_path, 'r') as f:
-            chunks = json.load(f)
+    with _BM25_LOCK:
+        if key in _BM25_CACHE:
+            return _BM25_CACHE[key]
+        
+        version_path = bm25_dir / INDEX_VERSION_FILE
+        persisted_version = version_path.read_text(encoding="utf-8").strip() if version_path.exists() else None
+        if not bm25_dir.exists() or persisted_version != version:
+            print("Building BM25 statistics...")
+            _persist_bm25(index, storage_dir)
+        
+        bm25_retriever = BM25Retriever.from_persist_dir(str(bm25_dir))
+        # Only the current index version is ever needed
+        _BM25_CACHE.clear()
+        _BM25_CACHE[key] = bm25_retriever
+        return bm25_retriever
+
+def _persist_metadata_index(index, storage_dir):
+    """Build the doc_id / section posting lists and save them in index_storage."""
+    metadata_index = MetadataIndex.from_nodes(index.docstore.docs.values(), version=get_index_version(storage_dir))
+    metadata_index.save(Path(storage_dir) / POSTINGS_FILE)
+    return metadata_index
+
+def load_metadata_index(index, storage_dir=STORAGE_DIR):
+    """
+    Return the metadata posting index persisted next to the vector store, loading it once
+    per process. Indexes persisted before it existed get it built and saved on first use.
+    """
+    path = Path(storage_dir) / POSTINGS_FILE
+    version = get_index_version(storage_dir)
+    key = (str(path.resolve()), version)
+    
+    with _METADATA_INDEX_LOCK:
+        if key in _METADATA_INDEX_CACHE:
+            return _METADATA_INDEX_CACHE[key]
+        
+        metadata_index = MetadataIndex.load(path) if path.exists() else None
+        if metadata_index is None or metadata_index.version != version:
+            print("Building metadata posting index...")
+            metadata_index = _persist_metadata_index(index, storage_dir)
+        # Only the current index version is ever needed
+        _METADATA_INDEX_CACHE.clear()
+        _METADATA_INDEX_CACHE[key] = metadata_index
+        return metadata_index
+
+def _load_documents(data_path):
+    """Read the chunk store (or chunks.json / .jsonl) into Documents keyed by chunk_id, so re-runs can be diffed."""
+    if not data_path.exists():
+        raise FileNotFoundError(f"Chunks file not found at {data_path}. Run parsing first.")
+        
+    return [
+        Document(
+            id_=c['chunk_id'],
+            text=c['text'], 
+            metadata={
+                "chunk_id": c['chunk_id'], 
+                "section": c['section'],
+                "doc_id": c['doc_id']
+            }
+        ) for c in iter_chunks(data_path)
+    ]
+
+def update_hdb_index(index, data_path=None, storage_dir=STORAGE_DIR):
+    """
+    Sync an existing index with the chunks file, embedding only new or changed chunks.
+
+    Chunks are matched by chunk_id and compared by the Document content hash stored in
+    the docstore. Vectors of chunks that disappeared are deleted. Returns the counts of
+    added, updated, removed and unchanged chunks.
+    """
+    data_path = data_path or default_chunks_path(DATA_DIR)
+    documents = _load_documents(data_path)
+    docstore = index.docstore
+    
+    # Ids of the source documents currently indexed (the docstore also hashes their nodes)
+    known_ids = set(docstore.get_all_ref_doc_info() or {})
+
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    to_insert = []
+    for doc in documents:
+        known_hash = docstore.get_document_hash(doc.doc_id) if doc.doc_id in known_ids else None
+        known_ids.discard(doc.doc_id)
+        if known_hash is None:
+            stats["added"] += 1
+            to_insert.append(doc)
+        elif known_hash != doc.hash:
+            stats["updated"] += 1
+            index.delete_ref_doc(doc.doc_id, delete_from_docstore=True)
+            to_insert.append(doc)
+        else:
+            stats["unchanged"] += 1
+    
+    # Whatever is left in known_ids is no longer in the chunks file
+    for doc_id in known_ids:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        stats["removed"] += 1
+    
+    if to_insert:
+        # Embedded in one batch rather than one index.insert() per document
+        nodes = run_transformations(to_insert, Settings.transformations)
+        index.insert_nodes(nodes)
+        for doc in to_insert:
+            docstore.set_document_hash(doc.doc_id, doc.hash)
+    
+    if to_insert or stats["removed"]:
+        index.storage_context.persist(persist_dir=storage_dir)
+        _bump_index_version(storage_dir)
+        _persist_bm25(index, storage_dir)
+        _persist_metadata_index(index, storage_dir)
+    
+    print(
+        f"Index sync: {stats['added']} added, {stats['updated']} updated, "
+        f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+    )
+    return stats
+
+def _load_index(storage_dir, ann_params=None):
+    """Load a persisted index, opening the memory-mapped vector store if it was built with one."""
+    vector_store = None
+    if MmapVectorStore.exists(storage_dir):
+        search_params = {key: value for key, value in (ann_params or {}).items() if key in SEARCH_PARAMS}
+        vector_store = MmapVectorStore.from_persist_dir(storage_dir, **search_params)
+    storage_context = StorageContext.from_defaults(persist_dir=storage_dir, vector_store=vector_store)
+    return load_index_from_storage(storage_context)
+
+def get_hdb_index(force_rebuild=False, incremental=False, data_path=None, storage_dir=STORAGE_DIR,
+                  vector_store="simple", vector_dtype="float32", ann=None, ann_params=None):
+    """
+    Load or initialize the LlamaIndex for HDB chunks.
+
+    With `incremental=True` an existing index is synced with the chunks file via
+    `update_hdb_index` instead of being rebuilt from scratch. `data_path` defaults to
+    `data/chunks.sqlite` (falling back to `data/chunks.json`) and may point at any
+    chunks file written by the ingestion.
+
+    `vector_store="mmap"` builds the index on `MmapVectorStore` (embeddings saved as
+    one `vector_dtype` NumPy matrix and memory-mapped on load). Loading detects the
+    store an index was built with, so the option only matters when building.
+
+    `ann="hnsw"` (hnswlib) or `ann="ivfpq"` (faiss) additionally builds an approximate
+    nearest-neighbour index over the matrix, persisted alongside it and rebuilt on every
+    sync; it implies `vector_store="mmap"`. `ann_params` takes the build parameters
+    (`M`, `ef_construction` / `nlist`, `m`, `nbits`) and the search knobs `ef_search` /
+    `nprobe`, which also apply when loading.
+    """
+    data_path = Path(data_path) if data_path else default_chunks_path(DATA_DIR)
+    storage_dir = Path(storage_dir)
+    
+    if incremental and storage_dir.exists():
+        index = _load_index(storage_dir, ann_params)
+        update_hdb_index(index, data_path=data_path, storage_dir=storage_dir)
+    elif force_rebuild or not storage_dir.exists():
+        if ann and ann not in ANN_INDEXES:
+            raise ValueError(f"Unknown ann {ann!r}, expected one of {sorted(ANN_INDEXES)}")
+        documents = _load_documents(data_path)
+        
+        if vector_store == "mmap" or ann:
+            store = MmapVectorStore(dtype=vector_dtype, ann=ann, ann_params=dict(ann_params or {}))
+            storage_context = StorageContext.from_defaults(vector_store=store)
+        elif vector_store == "simple":
+            storage_context = StorageContext.from_defaults()
+            # A leftover mmap store would otherwise be picked up on the next load
+            shutil.rmtree(storage_dir / MMAP_DIR_NAME, ignore_errors=True)
+        else:
+            raise ValueError(f"Unknown vector_store {vector_store!r}, expected 'simple' or 'mmap'")
             
         print("Building Hybrid Vector Index...")
-        documents = [
-            Document(
-                text=c['text'], 
-                metadata={
-                    "chunk_id": c['chunk_id'], 
-                    "section": c['section'],
-                    "doc_id": c['doc_id']
-                }
-            ) for c in chunks
-        ]
-        index = VectorStoreIndex.from_documents(documents)
+        index = VectorStoreIndex.from_documents(documents, storage_context=storage_context)
         index.storage_context.persist(persist_dir=storage_dir)
+        _bump_index_version(storage_dir)
+        _persist_bm25(index, storage_dir)
+        _persist_metadata_index(index, storage_dir)
     else:
-        storage_context = StorageContext.from_defaults(persist_dir=storage_dir)
-        index = load_index_from_storage(storage_context)
+        index = _load_index(storage_dir, ann_params)
         
     return index
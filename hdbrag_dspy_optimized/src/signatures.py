@@ -31,5 +31,10 @@ class JudgeQA(dspy.Signature):
     """Evaluate if the predicted answer accurately reflects the gold answer for the given question."""
     question = dspy.InputField()
     gold_answer = dspy.InputField()
-    predicted_answer = dspy.OutputField()
+    predicted_answer = dspy.InputField()
     is_accurate = dspy.OutputField(desc="Boolean: True if the answer is factually correct, False otherwise")
+
+class JudgeQABatch(dspy.Signature):
+    """Evaluate, for each numbered item, if the predicted answer accurately reflects the gold answer for its question."""
+    items = dspy.InputField(desc="Numbered items, each with a question, a gold answer and a predicted answer")
+    verdicts: list[bool] = dspy.OutputField(desc="One boolean per item, in order: True if the predicted answer is factually correct")
@@ -0,0 +1,160 @@
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+# The query record spans are attached to. A ContextVar so that stages running on
+# HDBRAG's thread pool (which copies the caller's context) land in the same record.
+_current_record = contextvars.ContextVar("hdbrag_query_record", default=None)
+
+class QueryRecord:
+    """Timing spans collected for one question."""
+    def __init__(self, question):
+        self.question = question
+        self.timestamp = time.time()
+        self.total_ms = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, ms, attrs):
+        with self._lock:
+            self.spans.append({"name": name, "ms": ms, **attrs})
+
+    def to_dict(self):
+        return {
+            "question": self.question,
+            "timestamp": self.timestamp,
+            "total_ms": self.total_ms,
+            "spans": list(self.spans),
+        }
+
+class Tracer:
+    """
+    Per-stage timing for HDBRAG and HDBRetriever.
+
+    Wrap a question in `query()` and each stage in `span()`. When the query finishes its
+    record is passed to every sink. With no sinks attached nothing is recorded.
+    """
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def __deepcopy__(self, memo):
+        # Programs copied by DSPy optimizers keep reporting to the same sinks
+        return self
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    @contextmanager
+    def query(self, question):
+        # Nested queries (HDBRAG -> HDBRetriever) share the outer record
+        if not self.sinks or _current_record.get() is not None:
+            yield _current_record.get()
+            return
+
+        record = QueryRecord(question)
+        token = _current_record.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.total_ms = (time.perf_counter() - start) * 1000
+            _current_record.reset(token)
+            for sink in self.sinks:
+                sink.emit(record.to_dict())
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a stage. The yielded dict can be filled with counts (candidates, tokens, hits)."""
+        record = _current_record.get()
+        if record is None:
+            yield attrs
+            return
+
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            record.add(name, (time.perf_counter() - start) * 1000, attrs)
+
+class JSONLSink:
+    """Appends one JSON line per query to a file."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+class HistogramSink:
+    """Keeps the last `max_samples` durations per stage in memory for percentile reports."""
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        with self._lock:
+            self.samples["total"].append(record["total_ms"])
+            for span in record["spans"]:
+                self.samples[span["name"]].append(span["ms"])
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        """Return {stage: {"count": n, "p50": ms, ...}} over the recorded samples."""
+        with self._lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        report = {}
+        for name, values in samples.items():
+            stats = {"count": len(values)}
+            for q, value in zip(quantiles, np.percentile(values, quantiles)):
+                stats[f"p{q}"] = round(float(value), 2)
+            report[name] = stats
+        return report
+
+class RecentSink:
+    """Keeps the last `max_records` query records, e.g. to print the latest breakdown."""
+    def __init__(self, max_records=100):
+        self.records = deque(maxlen=max_records)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    @property
+    def last(self):
+        return self.records[-1] if self.records else None
+
+def format_breakdown(record):
+    """Render a query record as an aligned table of stage timings and counts."""
+    lines = [f"⏱️  {record['total_ms']:.0f} ms total"]
+    for span in record["spans"]:
+        extras = ", ".join(f"{k}={v}" for k, v in span.items() if k not in ("name", "ms"))
+        lines.append(f"   {span['name']:<24} {span['ms']:>8.1f} ms" + (f"  ({extras})" if extras else ""))
+    return "\n".join(lines)
+
+def lm_token_counts(prediction):
+    """Prompt/completion tokens of a prediction, when DSPy usage tracking is enabled."""
+    get_usage = getattr(prediction, "get_lm_usage", None)
+    usage = get_usage() if get_usage else None
+    if not usage:
+        return {}
+    counts = {"prompt_tokens": 0, "completion_tokens": 0}
+    for model_usage in usage.values():
+        for key in counts:
+            counts[key] += model_usage.get(key) or 0
+    return counts
+
+# Process-wide tracer used by HDBRAG and HDBRetriever unless one is passed in
+tracer = Tracer()
@@ -0,0 +1,278 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from .ann_index import ANN_INDEXES, SEARCH_PARAMS, ann_params_for, load_ann_index, make_ann_index
+
+MMAP_DIR_NAME = "mmap_vectors"
+EMBEDDINGS_FILE = "embeddings.npy"
+TABLE_FILE = "table.json"
+
+# Node metadata kept per row in the side table (the rest lives in the docstore)
+TABLE_METADATA_KEYS = ("chunk_id", "doc_id", "section")
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    Vector store that keeps embeddings as one contiguous float32/float16 NumPy matrix.
+
+    On load the matrix is memory-mapped read-only, so startup does not parse any JSON
+    floats and worker processes share the same pages. Rows are L2-normalised at insert
+    time, so top-k cosine search is a single matrix-vector product plus argpartition.
+    Node ids, ref doc ids and a few metadata fields live in a compact side table;
+    node text stays in the docstore (`stores_text=False`). Query `filters`
+    (LlamaIndex `MetadataFilters`) may use those fields (`TABLE_METADATA_KEYS`).
+
+    With `ann="hnsw"` or `ann="ivfpq"` an approximate index is built over the matrix
+    each time the store is persisted and saved next to it. Queries then score only the
+    ANN candidates (plus rows added since the last persist) exactly. `ann_params` holds
+    the build parameters and the `ef_search` / `nprobe` search knob; keys that do not
+    apply to the chosen kind are ignored with a warning.
+    """
+    stores_text: bool = False
+    is_embedding_query: bool = True
+    dtype: str = "float32"
+    ann: Optional[str] = None
+    ann_params: dict = Field(default_factory=dict)
+
+    _matrix: Any = PrivateAttr(default=None)        # persisted rows (possibly a read-only memmap)
+    _pending: List[Any] = PrivateAttr(default_factory=list)  # rows added since load
+    _node_ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[dict] = PrivateAttr(default_factory=list)
+    _deleted: Any = PrivateAttr(default=None)       # boolean row mask
+    _row_of: dict = PrivateAttr(default_factory=dict)
+    _ann: Any = PrivateAttr(default=None)           # ANN index over the first _ann_rows rows
+    _ann_rows: int = PrivateAttr(default=0)
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _all_rows(self):
+        """The full embedding matrix, stacking rows added after load onto the memmap."""
+        if self._pending:
+            stacked = np.vstack(self._pending).astype(self.dtype)
+            self._matrix = stacked if self._matrix is None else np.vstack([self._matrix, stacked])
+            self._pending = []
+        return self._matrix
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._pending.append((embeddings / norms).astype(self.dtype))
+
+        ids = []
+        for node in nodes:
+            if node.node_id in self._row_of:
+                # Re-added node: the old row is superseded
+                self._mark_deleted([self._row_of[node.node_id]])
+            self._row_of[node.node_id] = len(self._node_ids)
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+            self._metadata.append({key: node.metadata.get(key) for key in TABLE_METADATA_KEYS if key in node.metadata})
+            ids.append(node.node_id)
+        self._grow_mask()
+        return ids
+
+    def _grow_mask(self):
+        missing = len(self._node_ids) - (0 if self._deleted is None else len(self._deleted))
+        if missing > 0:
+            extra = np.zeros(missing, dtype=bool)
+            self._deleted = extra if self._deleted is None else np.concatenate([self._deleted, extra])
+
+    def _mark_deleted(self, rows):
+        self._grow_mask()
+        for row in rows:
+            self._deleted[row] = True
+            self._row_of.pop(self._node_ids[row], None)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        rows = [
+            row for row, ref in enumerate(self._ref_doc_ids)
+            if ref == ref_doc_id and not self._deleted[row]
+        ]
+        self._mark_deleted(rows)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **delete_kwargs: Any) -> None:
+        self._mark_deleted([self._row_of[node_id] for node_id in (node_ids or []) if node_id in self._row_of])
+
+    def clear(self) -> None:
+        self._matrix = None
+        self._pending = []
+        self._node_ids, self._ref_doc_ids, self._metadata = [], [], []
+        self._deleted = None
+        self._row_of = {}
+        self._ann = None
+        self._ann_rows = 0
+
+    def set_search_params(self, **params):
+        """Change the ANN recall/latency knobs (`ef_search`, `nprobe`) of a loaded store."""
+        unknown = set(params) - set(SEARCH_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown search parameters: {sorted(unknown)}")
+        if not self.ann:
+            return
+        # Only the knob of this store's ANN kind applies (ef_search for hnsw, nprobe for ivfpq)
+        key = ANN_INDEXES[self.ann].search_param
+        if key in params:
+            self.ann_params[key] = params[key]
+            if self._ann is not None:
+                setattr(self._ann, key, params[key])
+
+    def _filter_mask(self, filters: MetadataFilters):
+        """Boolean row mask of the rows whose side-table metadata matches `filters`."""
+        unknown = _filter_keys(filters) - set(TABLE_METADATA_KEYS)
+        if unknown:
+            raise ValueError(
+                f"MmapVectorStore can only filter on {', '.join(TABLE_METADATA_KEYS)}, not {', '.join(sorted(unknown))}"
+            )
+        matches = build_metadata_filter_fn(lambda row: self._metadata[row], filters)
+        return np.fromiter((matches(row) for row in range(len(self._node_ids))), dtype=bool, count=len(self._node_ids))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        matrix = self._all_rows()
+        if matrix is None or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        allowed = self._filter_mask(query.filters) if query.filters is not None else None
+
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm:
+            q = q / q_norm
+
+        # Candidate rows: all live rows, optionally restricted to the requested node ids
+        if query.node_ids is not None:
+            rows = np.array([self._row_of[n] for n in query.node_ids if n in self._row_of], dtype=np.int64)
+            if allowed is not None:
+                rows = rows[allowed[rows]]
+            scores = matrix[rows] @ q if len(rows) else np.empty(0, dtype=np.float32)
+        elif allowed is not None:
+            # Exact scores over the matching rows: ANN candidates might all fail the filter
+            rows = np.flatnonzero(allowed & ~self._deleted)
+            scores = (matrix[rows] @ q).astype(np.float32) if len(rows) else np.empty(0, dtype=np.float32)
+        elif self._ann is not None:
+            rows = self._ann_candidates(q, query.similarity_top_k)
+            scores = (matrix[rows] @ q).astype(np.float32) if len(rows) else np.empty(0, dtype=np.float32)
+        else:
+            rows = None
+            scores = (matrix @ q).astype(np.float32)
+            if self._deleted.any():
+                scores[self._deleted] = -np.inf
+
+        top_k = min(query.similarity_top_k, int(np.isfinite(scores).sum()))
+        if top_k <= 0:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        top_rows = top if rows is None else rows[top]
+
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=[float(scores[i]) for i in top],
+            ids=[self._node_ids[row] for row in top_rows],
+        )
+
+    def _ann_candidates(self, q, top_k):
+        """Live rows proposed by the ANN index, plus every row added after it was built."""
+        # Over-fetch by the number of deleted rows so deletions cannot starve the result
+        deleted = self._deleted[:self._ann_rows]
+        rows = self._ann.search(q, top_k * self._ann.refine_factor + int(deleted.sum()))
+        rows = rows[~deleted[rows]]
+        if len(self._node_ids) > self._ann_rows:
+            recent = np.arange(self._ann_rows, len(self._node_ids))
+            rows = np.concatenate([rows, recent[~self._deleted[recent]]])
+        return rows
+
+    def persist(self, persist_path: str, fs=None) -> None:
+        """Write the live rows to <persist dir>/mmap_vectors, compacting deleted rows away."""
+        out_dir = Path(persist_path).parent / MMAP_DIR_NAME
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        matrix = self._all_rows()
+        self._grow_mask()
+        live = np.flatnonzero(~self._deleted) if self._deleted is not None else np.empty(0, dtype=np.int64)
+        compact = np.ascontiguousarray(matrix[live]) if matrix is not None else np.empty((0, 0), dtype=self.dtype)
+
+        # The ANN index is rebuilt from scratch over the persisted rows
+        ann = None
+        if self.ann and len(live):
+            params = ann_params_for(self.ann, self.ann_params)
+            search = {key: value for key, value in params.items() if key in SEARCH_PARAMS}
+            ann = make_ann_index(self.ann, compact.shape[1], **params).build(compact)
+            ann.save(out_dir / ann.file_name)
+            # Build parameters may have been clamped to the corpus size
+            self.ann_params = {**ann.build_params(), **search}
+
+        # Replace files atomically; readers that already mapped the old file keep a valid view
+        tmp_embeddings = out_dir / (EMBEDDINGS_FILE + ".tmp")
+        with open(tmp_embeddings, "wb") as f:
+            np.save(f, compact.astype(self.dtype))
+        os.replace(tmp_embeddings, out_dir / EMBEDDINGS_FILE)
+
+        table = {
+            "dtype": self.dtype,
+            "ann": self.ann,
+            "ann_params": self.ann_params,
+            "node_ids": [self._node_ids[row] for row in live],
+            "ref_doc_ids": [self._ref_doc_ids[row] for row in live],
+            "metadata": [self._metadata[row] for row in live],
+        }
+        tmp_table = out_dir / (TABLE_FILE + ".tmp")
+        tmp_table.write_text(json.dumps(table), encoding="utf-8")
+        os.replace(tmp_table, out_dir / TABLE_FILE)
+
+        # Continue on the compacted rows so they line up with the files and the ANN ids
+        self._matrix = compact if len(live) else None
+        self._node_ids = table["node_ids"]
+        self._ref_doc_ids = table["ref_doc_ids"]
+        self._metadata = table["metadata"]
+        self._row_of = {node_id: row for row, node_id in enumerate(self._node_ids)}
+        self._deleted = np.zeros(len(self._node_ids), dtype=bool)
+        self._ann, self._ann_rows = ann, len(live) if ann is not None else 0
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, mmap: bool = True, **search_params) -> "MmapVectorStore":
+        """
+        Open a persisted store; the matrix is memory-mapped unless `mmap=False`.
+
+        `search_params` (`ef_search`, `nprobe`) override the persisted ANN search knobs.
+        """
+        store_dir = Path(persist_dir) / MMAP_DIR_NAME
+        table = json.loads((store_dir / TABLE_FILE).read_text(encoding="utf-8"))
+        store = cls(dtype=table["dtype"], ann=table.get("ann"), ann_params=table.get("ann_params", {}))
+        matrix = np.load(store_dir / EMBEDDINGS_FILE, mmap_mode="r" if mmap else None)
+        store._matrix = matrix if len(table["node_ids"]) else None
+        store._node_ids = table["node_ids"]
+        store._ref_doc_ids = table["ref_doc_ids"]
+        store._metadata = table["metadata"]
+        store._row_of = {node_id: row for row, node_id in enumerate(store._node_ids)}
+        store._deleted = np.zeros(len(store._node_ids), dtype=bool)
+        if store.ann and store._matrix is not None:
+            store._ann = load_ann_index(store_dir, store.ann, matrix.shape[1], len(store._node_ids), store.ann_params)
+            store._ann_rows = len(store._node_ids)
+        store.set_search_params(**search_params)
+        return store
+
+    @staticmethod
+    def exists(persist_dir) -> bool:
+        return (Path(persist_dir) / MMAP_DIR_NAME / TABLE_FILE).exists()
+
+def _filter_keys(filters):
+    """Metadata keys used anywhere in (possibly nested) `MetadataFilters`."""
+    keys = set()
+    for f in filters.filters:
+        keys |= _filter_keys(f) if isinstance(f, MetadataFilters) else {f.key}
+    return keys
@@ -0,0 +1,106 @@
+import gc
+import threading
+import time
+import dspy
+from conftest import make_chunks, write_chunks
+from src import cache as cache_module
+from src.cache import RetrievalCache, RetrievalSnapshot, SemanticCache
+from src.retriever import HDBRetriever, SnapshotRetriever, get_hdb_index
+
+def answer(text):
+    return dspy.Prediction(answer=text, context=[dspy.Prediction(long_text="[Singles Scheme] Singles aged 35 ...")])
+
+def test_semantic_cache_misses_after_rebuild(hdb_index, chunks_path, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    path = tmp_path / "semantic_cache.sqlite"
+    cache = SemanticCache(path=path, storage_dir=storage_dir, refresh_seconds=0)
+    cache.store("Can singles buy a flat?", answer("Yes, from 35."))
+    # Same words in another order embed identically
+    assert cache.lookup("Singles can buy a flat?").answer == "Yes, from 35."
+    assert cache.lookup("What is the housing loan interest rate?") is None
+    cache.flush()
+    assert SemanticCache(path=path, storage_dir=storage_dir).lookup("Can singles buy a flat?").answer == "Yes, from 35."
+
+    get_hdb_index(data_path=chunks_path, storage_dir=storage_dir, force_rebuild=True)
+    assert cache.lookup("Can singles buy a flat?") is None
+    cache.flush()
+    # Rows of the old index version are gone from the file too
+    assert SemanticCache(path=path, storage_dir=storage_dir).lookup("Can singles buy a flat?") is None
+
+def test_semantic_caches_are_not_kept_alive(offline_models, tmp_path):
+    gc.collect()
+    before = len(cache_module._SEMANTIC_CACHES)
+    caches = [SemanticCache(path=tmp_path / f"cache{i}.sqlite", storage_dir=tmp_path) for i in range(3)]
+    for cache in caches:
+        # Starts the background writer
+        cache.store("Can singles buy a flat?", answer("Yes."))
+        cache.flush()
+    assert len(cache_module._SEMANTIC_CACHES) == before + 3
+    del caches, cache
+    gc.collect()
+    assert len(cache_module._SEMANTIC_CACHES) == before
+    # Their writer threads exit
+    deadline = time.monotonic() + 5
+    while any(t.name == "semantic-cache-writer" for t in threading.enumerate()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not any(t.name == "semantic-cache-writer" for t in threading.enumerate())
+
+def test_fork_hook_resets_every_live_cache(offline_models, tmp_path):
+    caches = [SemanticCache(path=tmp_path / f"cache{i}.sqlite", storage_dir=tmp_path) for i in range(2)]
+    for cache in caches:
+        cache.store("Can singles buy a flat?", answer("Yes."))
+        cache._lock.acquire()  # held by a parent thread at fork time
+    cache_module._reset_semantic_caches_after_fork()
+    for cache in caches:
+        assert cache._pending is None and cache._lock.acquire(blocking=False)
+
+def test_retrieval_cache_reuses_embeddings_and_scores_until_a_chunk_changes(hdb_index, chunks_path, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    path = tmp_path / "retrieval_cache.sqlite"
+    query = "singles scheme age 35"
+    cache = RetrievalCache(path=path)
+    retriever = HDBRetriever(hdb_index, k=3, storage_dir=storage_dir, cache=cache)
+    first = retriever.retrieve_nodes(query)
+    pairs = cache.stats()["misses"]["score"]
+    assert cache.stats()["misses"]["embedding"] == 1 and pairs > 0
+
+    again = retriever.retrieve_nodes(query)
+    assert [(n.node.node_id, n.score) for n in again] == [(n.node.node_id, n.score) for n in first]
+    assert cache.stats()["hits"] == {"embedding": 1, "score": pairs}
+
+    # Rebuild with the top chunk edited; a new process reads the same cache file
+    chunks = make_chunks()
+    edited = next(c for c in chunks if c["chunk_id"] == first[0].node.metadata["chunk_id"])
+    edited["text"] += " Applicants must also attend a briefing."
+    write_chunks(chunks_path, chunks)
+    index = get_hdb_index(data_path=chunks_path, storage_dir=storage_dir, force_rebuild=True)
+    cache = RetrievalCache(path=path)
+    HDBRetriever(index, k=3, storage_dir=storage_dir, cache=cache).retrieve_nodes(query)
+    stats = cache.stats()
+    assert stats["hits"]["embedding"] == 1
+    assert stats["misses"]["score"] == 1 and stats["hits"]["score"] == pairs - 1
+
+def test_snapshot_replays_until_the_index_is_rebuilt(hdb_index, chunks_path, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    path = tmp_path / "retrieval_snapshot.sqlite"
+    questions = ["singles scheme age 35", "housing loan from HDB"]
+    retriever = SnapshotRetriever(hdb_index, RetrievalSnapshot(path=path), k=3, storage_dir=storage_dir)
+    assert retriever.precompute(questions + questions) == 2
+    live = HDBRetriever(hdb_index, k=3, storage_dir=storage_dir).retrieve_nodes(questions[0])
+
+    # Another run replays from the file without retrieving
+    snapshot = RetrievalSnapshot(path=path)
+    replayed = SnapshotRetriever(hdb_index, snapshot, k=3, storage_dir=storage_dir)
+    def retrieve_live(*args):
+        raise AssertionError("retrieved a recorded question")
+    replayed._retrieve_live = retrieve_live
+    assert [(n.node.node_id, n.score) for n in replayed.retrieve_nodes(questions[0])] == \
+        [(n.node.node_id, n.score) for n in live]
+    assert snapshot.stats()["hits"] == 1
+
+    # Other settings, or a rebuilt index, are retrieved again
+    assert SnapshotRetriever(hdb_index, snapshot, k=2, storage_dir=storage_dir).precompute(questions) == 2
+    index = get_hdb_index(data_path=chunks_path, storage_dir=storage_dir, force_rebuild=True)
+    snapshot = RetrievalSnapshot(path=path)
+    assert SnapshotRetriever(index, snapshot, k=3, storage_dir=storage_dir).precompute(questions) == 2
+    assert len(snapshot) == 2
@@ -0,0 +1,54 @@
+import hashlib
+import json
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from conftest import make_chunks, write_chunks
+from src.ingestion.chunk_store import ChunkStore, ChunkStoreWriter, convert_chunks, default_chunks_path, iter_chunks
+
+def test_store_reads_only_what_is_asked_for(tmp_path):
+    chunks = make_chunks()
+    chunks[0]["text"] = "Short."
+    del chunks[1]["source_path"]
+    store_path = tmp_path / "chunks.sqlite"
+    assert convert_chunks(write_chunks(tmp_path / "chunks.json", chunks), store_path) == len(chunks)
+
+    with ChunkStore(store_path) as store:
+        assert list(store) == chunks and len(store) == len(chunks)
+        assert "singles_scheme_3" in store and "singles_scheme_4" not in store
+        assert store.get("housing_loan_4") == chunks[4] and store.get("missing") is None
+        assert [c["chunk_id"] for c in store.filter(doc_id="housing_loan")] == ["housing_loan_4", "housing_loan_10",
+                                                                               "housing_loan_16", "housing_loan_22"]
+        assert [c["chunk_id"] for c in store.filter(doc_id="housing_loan", section="Nothing")] == []
+        assert store.chunk_ids(min_chars=10) == [c["chunk_id"] for c in chunks[1:]]
+        assert store.doc_ids()[0] == "enhanced_cpf_housing_grant" and len(store.doc_ids()) == 6
+    assert list(iter_chunks(store_path)) == chunks
+    assert default_chunks_path(tmp_path) == store_path
+
+def test_conversion_is_deterministic_and_atomic(tmp_path):
+    source = write_chunks(tmp_path / "chunks.json", make_chunks())
+    jsonl = tmp_path / "chunks.jsonl"
+    jsonl.write_text("".join(json.dumps(c) + "\n" for c in make_chunks()), encoding="utf-8")
+    digests = set()
+    for i, path in enumerate((source, source, jsonl)):
+        convert_chunks(path, tmp_path / f"{i}.sqlite")
+        digests.add(hashlib.sha256((tmp_path / f"{i}.sqlite").read_bytes()).hexdigest())
+    assert len(digests) == 1
+
+    # A failed write leaves the previous store in place
+    with pytest.raises(RuntimeError):
+        with ChunkStoreWriter(tmp_path / "0.sqlite") as writer:
+            writer.write(make_chunks()[0])
+            raise RuntimeError("crashed")
+    assert len(ChunkStore(tmp_path / "0.sqlite")) == len(make_chunks())
+    assert not (tmp_path / "0.sqlite.tmp").exists()
+
+def test_convert_chunks_cli(tmp_path):
+    source = write_chunks(tmp_path / "chunks.json", make_chunks())
+    output = tmp_path / "chunks.sqlite"
+    script = Path(__file__).parent / "src" / "ingestion" / "chunk_store.py"
+    result = subprocess.run([sys.executable, str(script), str(source), str(output)],
+                            capture_output=True, text=True, check=True)
+    assert f"Converted {len(make_chunks())} chunks" in result.stdout
+    assert list(iter_chunks(output)) == make_chunks()
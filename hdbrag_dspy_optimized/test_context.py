@@ -0,0 +1,66 @@
+import re
+from llama_index.core.schema import NodeWithScore, TextNode
+from src.context import count_tokens, pack_context
+from src.ingestion import html_parser
+
+def node(chunk_id, text, score, doc_id="singles-scheme"):
+    return NodeWithScore(node=TextNode(id_=chunk_id, text=text, metadata={"chunk_id": chunk_id, "doc_id": doc_id}),
+                         score=score)
+
+ELIGIBILITY = "Singles aged 35 and above can buy a 2-room Flexi flat in any town."
+INCOME = "The average gross monthly household income must not exceed $7,000."
+
+def test_near_duplicates_are_dropped():
+    stats = {}
+    passages = pack_context([
+        node("a_0", f"[Eligibility] {ELIGIBILITY}", 0.9, doc_id="a"),
+        node("b_4", f"[Who can buy] {ELIGIBILITY}", 0.8, doc_id="b"),
+        node("c_2", f"[Income] {INCOME}", 0.7, doc_id="c"),
+    ], max_tokens=1000, stats=stats)
+    assert passages == [f"[Eligibility] {ELIGIBILITY}", f"[Income] {INCOME}"]
+    assert stats["near_duplicates"] == 1
+
+def test_consecutive_chunks_are_merged_without_overlap():
+    stats = {}
+    passages = pack_context([
+        node("singles-scheme_1", f"[Eligibility] ... {ELIGIBILITY} {INCOME}", 0.5),
+        node("singles-scheme_0", f"[Eligibility] {ELIGIBILITY}", 0.9),
+    ], max_tokens=1000, stats=stats)
+    assert passages == [f"[Eligibility] {ELIGIBILITY} {INCOME}"]
+    assert stats["merged"] == 1
+
+def test_passages_stay_within_the_budget():
+    nodes = [node(f"doc{i}_0", f"[Section {i}] Passage {i} says " + "word " * 40, 1.0 - i / 10, doc_id=f"doc{i}")
+             for i in range(6)]
+    budget = 2 * count_tokens(nodes[0].node.get_content())
+    stats = {}
+    passages = pack_context(nodes, max_tokens=budget, stats=stats)
+    # The best-scored passages that fit, best first
+    assert [re.match(r"\[Section (\d)\]", p).group(1) for p in passages] == ["0", "1"]
+    assert stats["tokens"] == sum(count_tokens(p) for p in passages) <= budget
+    assert stats["over_budget"] == 4
+
+def test_chunker_and_packing_share_one_token_counter():
+    assert html_parser.count_tokens is count_tokens
+
+def spaced_count(text):
+    """A tokenizer where every word and every space is one token."""
+    return len(re.findall(r"\S+|\s", text))
+
+def test_chunks_never_exceed_chunk_tokens():
+    sentences = [f"Sentence {i} has " + " ".join(["word"] * (i % 7 + 1)) + "." for i in range(300)]
+    soup = html_parser.parse_html("<main><h2>Eligibility</h2><p>" + " ".join(sentences) + "</p></main>")
+    for count in (count_tokens, spaced_count):
+        chunks = html_parser.chunk_text_by_structure(soup, chunk_tokens=200, count=count)
+        assert len(chunks) > 1
+        assert max(count(c["text"]) for c in chunks) <= 200
+        # Filled chunks come close to the limit rather than far under it
+        assert max(count(c["text"]) for c in chunks) >= 180
+
+if __name__ == "__main__":
+    test_near_duplicates_are_dropped()
+    test_consecutive_chunks_are_merged_without_overlap()
+    test_passages_stay_within_the_budget()
+    test_chunker_and_packing_share_one_token_counter()
+    test_chunks_never_exceed_chunk_tokens()
+    print("All context packing tests passed")
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from src.ingestion.hdb_downloader import CRAWL_STATE_FILE, crawl_hdb_pages_async, url_to_filename
+
+@contextmanager
+def local_site(links, delay=0.0):
+    """
+    Serve /residential/<page> for every page in `links` (page -> linked pages) on localhost.
+
+    Pages carry an ETag and answer If-None-Match with 304. Yields the base URL and a
+    Counter of (path, status) for every request served.
+    """
+    served = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = self.path.rsplit("/", 1)[-1]
+            if page not in links:
+                self.send_response(404)
+                self.end_headers()
+                return
+            time.sleep(delay)
+            etag = f'"{page}-v1"'
+            if self.headers.get("If-None-Match") == etag:
+                served[(self.path, 304)] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = "".join(f'<a href="/residential/{target}">{target}</a>' for target in links[page])
+            body = f"<html><body><h1>{page}</h1>{body}</body></html>".encode("utf-8")
+            served[(self.path, 200)] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", served
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def crawl(base, output_dir, seeds, **kwargs):
+    kwargs = {"concurrency": 8, "per_host_limit": 8, "rate": 1000.0, **kwargs}
+    return asyncio.run(crawl_hdb_pages_async(
+        output_dir, seed_urls=[f"{base}/residential/{page}" for page in seeds],
+        url_filter=lambda url: url.startswith(f"{base}/residential/"), **kwargs,
+    ))
+
+def fetched(served, status=200):
+    return sorted(path.rsplit("/", 1)[-1] for (path, code), count in served.items() if code == status for _ in range(count))
+
+def test_max_pages_not_overshot():
+    # One hub page linking to many slow pages: every worker picks one up at once
+    links = {"hub": [f"p{i}" for i in range(30)], **{f"p{i}": [] for i in range(30)}}
+    with local_site(links, delay=0.05) as (base, served), tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        assert crawl(base, output_dir, ["hub"], max_pages=5) == 5
+        assert sum(served.values()) == 5
+        assert len(list(output_dir.glob("*.html"))) == 5
+
+def test_unchanged_pages_are_not_downloaded_again():
+    links = {"p0": ["p1", "p2"], "p1": ["p3"], "p2": ["p3"], "p3": ["p0"]}
+    with local_site(links) as (base, served), tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        assert crawl(base, output_dir, ["p0"]) == 4
+        assert fetched(served) == ["p0", "p1", "p2", "p3"]
+        saved = {path.name: path.stat().st_mtime_ns for path in output_dir.glob("*.html")}
+
+        # A new crawl revalidates every page; links are still followed from the saved copies
+        served.clear()
+        assert crawl(base, output_dir, ["p0"]) == 4
+        assert fetched(served) == []
+        assert fetched(served, 304) == ["p0", "p1", "p2", "p3"]
+        assert {path.name: path.stat().st_mtime_ns for path in output_dir.glob("*.html")} == saved
+
+def test_interrupted_crawl_resumes_from_saved_frontier():
+    links = {"p0": ["p1", "p2"], "p1": ["p3"], "p2": ["p3"], "p3": ["p0"]}
+    with local_site(links) as (base, served), tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        url = lambda page: f"{base}/residential/{page}"
+        # State left by a run that processed p0 and p1 and was stopped with p2 queued
+        (output_dir / CRAWL_STATE_FILE).write_text(json.dumps({
+            "pending": [[url("p2"), 1]],
+            "visited": [url("p0"), url("p1"), url("p2")],
+            "validators": {},
+            "pages_processed": 2,
+        }), encoding="utf-8")
+
+        assert crawl(base, output_dir, ["p0"]) == 4
+        assert fetched(served) == ["p2", "p3"]
+        assert sorted(path.name for path in output_dir.glob("*.html")) == [url_to_filename(url(p)) for p in ("p2", "p3")]
+        state = json.loads((output_dir / CRAWL_STATE_FILE).read_text(encoding="utf-8"))
+        assert state["pending"] == [] and state["pages_processed"] == 4
+
+if __name__ == "__main__":
+    test_max_pages_not_overshot()
+    test_unchanged_pages_are_not_downloaded_again()
+    test_interrupted_crawl_resumes_from_saved_frontier()
+    print("All crawler tests passed")
@@ -0,0 +1,46 @@
+import re
+from src.ingestion.html_parser import chunk_text_by_structure, parse_html, split_sentences
+
+def words(text):
+    return len(text.split())
+
+def sentence(i, n=5):
+    return f"Sentence {i} " + " ".join(["word"] * (n - 2)) + "."
+
+def chunk(html, **kwargs):
+    return chunk_text_by_structure(parse_html(f"<main>{html}</main>"), count=words, **kwargs)
+
+def body(text):
+    return re.sub(r"^\[[^\]]*\] (\.\.\. )?", "", text)
+
+def test_sentences_end_before_a_capital_or_digit():
+    assert split_sentences("Income is $7,000.00 or less! 2-room flats only? The MOP is 5 yrs. e.g. for resale.") == \
+        ["Income is $7,000.00 or less!", "2-room flats only?", "The MOP is 5 yrs. e.g. for resale."]
+
+def test_chunks_follow_headings():
+    chunks = chunk("<p>Intro text.</p><h2>Eligibility</h2><p>Singles can buy.</p><li>Age 35.</li>"
+                   "<h3>Grants</h3><p>Up to $120,000.</p><h3>Empty</h3>")
+    assert chunks == [
+        {"text": "[General] Intro text.", "section": "General"},
+        {"text": "[Eligibility] Singles can buy. Age 35.", "section": "Eligibility"},
+        {"text": "[Grants] Up to $120,000.", "section": "Grants"},
+    ]
+
+def test_full_chunks_continue_with_overlap():
+    sentences = [sentence(i) for i in range(40)]
+    chunks = chunk("<h2>Rules</h2><p>" + " ".join(sentences) + "</p>", chunk_tokens=30, overlap_tokens=10)
+    assert chunks[0]["text"].startswith("[Rules] Sentence 0 ")
+    assert all(c["text"].startswith("[Rules] ... ") for c in chunks[1:])
+    assert max(words(c["text"]) for c in chunks) <= 30
+    for previous, current in zip(chunks, chunks[1:]):
+        # The next chunk starts with the previous one's last two sentences (10 words)
+        assert body(previous["text"]).endswith(" ".join(split_sentences(body(current["text"]))[:2]))
+    # Every sentence is in some chunk, in order
+    seen = [s for c in chunks for s in split_sentences(body(c["text"]))]
+    assert list(dict.fromkeys(seen)) == sentences
+
+def test_long_sentences_are_split_at_words():
+    long = "Table " + " ".join(f"cell{i}" for i in range(100)) + "."
+    chunks = chunk(f"<h2>Fees</h2><p>{long}</p>", chunk_tokens=30, overlap_tokens=0)
+    assert len(chunks) > 3 and max(words(c["text"]) for c in chunks) <= 30
+    assert " ".join(body(c["text"]) for c in chunks) == long
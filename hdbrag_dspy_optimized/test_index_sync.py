@@ -0,0 +1,36 @@
+from conftest import make_chunks, write_chunks
+from src.retriever import HDBRetriever, get_hdb_index, get_index_version, update_hdb_index
+
+def retrieved_ids(index, storage_dir, query):
+    retriever = HDBRetriever(index, k=3, storage_dir=storage_dir)
+    return [n.node.metadata["chunk_id"] for n in retriever.retrieve_nodes(query)]
+
+def test_sync_embeds_only_the_changes(hdb_index, chunks_path, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    version = get_index_version(storage_dir)
+    chunks = make_chunks()
+    removed = chunks.pop(5)
+    changed = chunks[2]
+    changed["text"] = "[Fresh Start] Zebra crossings near the flat are covered by the renovation grant."
+    chunks.append({**chunks[0], "chunk_id": "housing_loan_99", "doc_id": "housing_loan",
+                   "text": "[Housing Loan] Giraffe loans have a tenure of up to 25 years."})
+    write_chunks(chunks_path, chunks)
+
+    stats = update_hdb_index(hdb_index, data_path=chunks_path, storage_dir=storage_dir)
+    assert stats == {"added": 1, "updated": 1, "removed": 1, "unchanged": len(chunks) - 2}
+    assert get_index_version(storage_dir) != version
+    assert set(hdb_index.docstore.get_all_ref_doc_info()) == {c["chunk_id"] for c in chunks}
+
+    # Reloading picks up the persisted sync, and retrieval (vector, BM25, rerank) reflects it
+    index = get_hdb_index(data_path=chunks_path, storage_dir=storage_dir)
+    assert retrieved_ids(index, storage_dir, "giraffe loans tenure")[0] == "housing_loan_99"
+    assert retrieved_ids(index, storage_dir, "zebra crossings renovation grant")[0] == changed["chunk_id"]
+    for query in ("singles scheme age 35", removed["text"]):
+        assert removed["chunk_id"] not in retrieved_ids(index, storage_dir, query)
+
+def test_sync_without_changes_keeps_the_index_version(hdb_index, chunks_path, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    version = get_index_version(storage_dir)
+    index = get_hdb_index(data_path=chunks_path, storage_dir=storage_dir, incremental=True)
+    assert update_hdb_index(index, data_path=chunks_path, storage_dir=storage_dir)["unchanged"] == len(make_chunks())
+    assert get_index_version(storage_dir) == version
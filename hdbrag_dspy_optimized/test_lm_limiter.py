@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+import litellm
+from src.lm_limiter import AIMDLimiter
+
+def finish(limiter, seconds, tokens=1, overloaded=False):
+    """Take a slot and release it as a call that took `seconds` for `tokens` output tokens."""
+    limiter.acquire()
+    limiter.release(time.monotonic() - seconds, overloaded=overloaded, tokens=tokens)
+
+def saturate(limiter):
+    """Fill every slot; returns their start times."""
+    return [limiter.acquire() for _ in range(int(limiter.limit))]
+
+def test_limit_grows_only_while_saturated():
+    limiter = AIMDLimiter("m", initial=2, max_limit=4)
+    # One call at a time never uses the limit, so it does not grow
+    for _ in range(5):
+        finish(limiter, 0.01)
+    assert limiter.limit == 2 and limiter.increases == 0
+
+    for started in saturate(limiter):
+        limiter.release(started - 0.01)
+    # Only the first release found every slot taken: +1/limit
+    assert limiter.limit == 2.5 and limiter.increases == 1
+
+def test_limit_is_capped_at_max_limit():
+    limiter = AIMDLimiter("m", initial=3, max_limit=4)
+    for _ in range(20):
+        for started in saturate(limiter):
+            limiter.release(started - 0.01)
+    assert limiter.limit == 4
+
+def test_overload_halves_the_limit_once_per_round_trip():
+    limiter = AIMDLimiter("m", initial=8, min_limit=1)
+    finish(limiter, 1.0)   # round trip of about a second
+    finish(limiter, 0, overloaded=True)
+    finish(limiter, 0, overloaded=True)
+    assert limiter.limit == 4 and limiter.decreases == 1
+    assert limiter.stats()["error_rate"] == round(2 / 3, 4)
+
+def test_limit_never_drops_below_min_limit():
+    limiter = AIMDLimiter("m", initial=2, min_limit=1)
+    for _ in range(5):
+        finish(limiter, 0, overloaded=True)
+        limiter._last_decrease = 0.0   # as if a round trip had passed
+    assert limiter.limit == 1
+
+def test_latency_growth_backs_off():
+    limiter = AIMDLimiter("m", initial=8, latency_tolerance=2.0)
+    finish(limiter, 0.01, tokens=10)   # baseline: 1 ms per token
+    for _ in range(10):
+        finish(limiter, 0.1, tokens=10)
+        limiter._last_decrease = 0.0
+        if limiter.decreases:
+            break
+    assert limiter.decreases == 1 and limiter.limit == 4
+
+def test_acquire_waits_for_a_free_slot():
+    limiter = AIMDLimiter("m", initial=1)
+    started = limiter.acquire()
+    acquired = threading.Event()
+    def waiter():
+        limiter.release(limiter.acquire())
+        acquired.set()
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while limiter.queued == 0:
+        time.sleep(0.001)
+    assert not acquired.is_set() and limiter.in_flight == 1
+    limiter.release(started)
+    assert acquired.wait(5)
+    thread.join(5)
+    assert limiter.in_flight == 0 and limiter.queued == 0
+
+def test_call_retries_overload_errors_only():
+    limiter = AIMDLimiter("m", initial=4)
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise litellm.RateLimitError("slow down", llm_provider="openai", model="m")
+        return SimpleNamespace(usage=SimpleNamespace(completion_tokens=5), cache_hit=False)
+    assert limiter.call(flaky, max_retries=3, retry_backoff=0).usage.completion_tokens == 5
+    assert len(attempts) == 3 and limiter.retries == 2 and limiter.in_flight == 0
+
+    def bad_request():
+        attempts.append(1)
+        raise ValueError("bad prompt")
+    attempts.clear()
+    try:
+        limiter.call(bad_request, max_retries=3, retry_backoff=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected the ValueError")
+    assert len(attempts) == 1 and limiter.in_flight == 0
+
+def test_call_gives_up_after_max_retries():
+    limiter = AIMDLimiter("m", initial=4)
+    attempts = []
+    def overloaded():
+        attempts.append(1)
+        raise litellm.RateLimitError("slow down", llm_provider="openai", model="m")
+    try:
+        limiter.call(overloaded, max_retries=2, retry_backoff=0)
+    except litellm.RateLimitError:
+        pass
+    else:
+        raise AssertionError("expected the RateLimitError")
+    assert len(attempts) == 3 and limiter.retries == 2
+
+def test_cache_hits_do_not_move_the_limit():
+    limiter = AIMDLimiter("m", initial=1, max_limit=4)
+    cached = SimpleNamespace(usage=None, cache_hit=True)
+    for _ in range(5):
+        limiter.call(lambda: cached)
+    assert limiter.limit == 1 and limiter.increases == 0 and limiter.stats()["latency_ms"] is None
+
+if __name__ == "__main__":
+    test_limit_grows_only_while_saturated()
+    test_limit_is_capped_at_max_limit()
+    test_overload_halves_the_limit_once_per_round_trip()
+    test_limit_never_drops_below_min_limit()
+    test_latency_growth_backs_off()
+    test_acquire_waits_for_a_free_slot()
+    test_call_retries_overload_errors_only()
+    test_call_gives_up_after_max_retries()
+    test_cache_hits_do_not_move_the_limit()
+    print("All limiter tests passed")
@@ -0,0 +1,34 @@
+import pytest
+from llama_index.core.schema import TextNode
+from src.metadata_index import MetadataIndex
+from src.retriever import HDBRetriever, load_metadata_index
+
+def test_filters_or_values_and_and_fields(tmp_path):
+    nodes = [TextNode(id_=f"n{i}", text="", metadata={"doc_id": ["singles_scheme", "housing_loan"][i % 2],
+                                                       "section": ["Eligibility", "Grants", "Fees"][i % 3]})
+             for i in range(12)]
+    index = MetadataIndex.from_nodes(nodes)
+    assert index.node_ids({}) is None
+    assert index.node_ids({"doc_id": "singles-scheme"}) == {f"n{i}" for i in range(0, 12, 2)}
+    assert index.node_ids({"doc_id": "singles_scheme", "section": ["Eligibility", "Fees"]}) == {"n0", "n2", "n6", "n8"}
+    assert index.node_ids({"section": "Income"}) == set()
+    assert index.values("section") == ["Eligibility", "Fees", "Grants"]
+    with pytest.raises(ValueError, match="source"):
+        index.node_ids({"source": "x"})
+
+    index.save(tmp_path / "postings.json")
+    assert MetadataIndex.load(tmp_path / "postings.json").node_ids({"section": "Grants"}) == {"n1", "n4", "n7", "n10"}
+
+def test_filtered_retrieval_returns_only_matching_pages(hdb_index, tmp_path):
+    storage_dir = tmp_path / "index_storage"
+    assert load_metadata_index(hdb_index, storage_dir=storage_dir).values("doc_id")[0] == "enhanced_cpf_housing_grant"
+    retriever = HDBRetriever(hdb_index, k=3, storage_dir=storage_dir)
+    # The page's file name, with dashes, finds its chunks although they are stored with underscores
+    for doc_id in ("housing-loan", "housing_loan"):
+        nodes = retriever.retrieve_nodes("singles scheme age 35", filters={"doc_id": doc_id})
+        assert len(nodes) == 3 and {n.node.metadata["doc_id"] for n in nodes} == {"housing_loan"}
+
+    nodes = retriever.retrieve_nodes(["housing loan", "singles scheme"],
+                                     filters={"doc_id": ["housing-loan", "singles-scheme"], "section": "Singles Scheme Age 35"})
+    assert nodes and {n.node.metadata["doc_id"] for n in nodes} == {"singles_scheme"}
+    assert retriever.retrieve_nodes("housing loan", filters={"doc_id": "no-such-page"}) == []
@@ -0,0 +1,58 @@
+import os
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+import dspy
+from dspy.streaming import StreamResponse
+from llama_index.core.schema import NodeWithScore
+from src.model import HDBRAG
+
+def drain(events):
+    """Collect the yielded events and the generator's return value."""
+    items = []
+    while True:
+        try:
+            items.append(next(events))
+        except StopIteration as stop:
+            return items, stop.value
+
+def test_stream_without_final_prediction_falls_back(hdb_index):
+    rag = HDBRAG(hdb_index, concurrent=False)
+    calls = []
+    rag._stream_answer = lambda **kwargs: iter([StreamResponse("predict", "answer", "Sing", False)])
+    rag.generate_answer = lambda **kwargs: calls.append(kwargs) or dspy.Prediction(answer="Singles can buy.")
+
+    events, prediction = drain(rag._generate("Can singles buy a flat?", nodes=[], tokens=True))
+    assert events == [("token", "Sing")]
+    assert prediction.answer == "Singles can buy."
+    assert len(calls) == 1
+
+def test_stream_with_final_prediction_does_not_call_again(hdb_index):
+    rag = HDBRAG(hdb_index, concurrent=False)
+    rag._stream_answer = lambda **kwargs: iter([dspy.Prediction(answer="Streamed.")])
+    def generate_answer(**kwargs):
+        raise AssertionError("answered twice")
+    rag.generate_answer = generate_answer
+
+    events, prediction = drain(rag._generate("Can singles buy a flat?", nodes=[], tokens=True))
+    assert events == [] and prediction.answer == "Streamed."
+
+def test_adaptive_skips_expansion_only_when_confident(hdb_index):
+    rag = HDBRAG(hdb_index, concurrent=False, adaptive=True)
+    nodes = rag.retriever.retrieve_nodes("singles scheme age 35")
+    expanded = []
+    rag._expand_queries = lambda question: expanded.append(question) or []
+    rag._hyde = lambda question: question
+
+    def retrieve(score, agreement):
+        def retrieve_nodes(queries, k=None, stats=None, filters=None):
+            if stats is not None:
+                stats["agreement"] = [agreement]
+            return [NodeWithScore(node=n.node, score=score) for n in nodes]
+        rag.retriever.retrieve_nodes = retrieve_nodes
+        return rag._retrieve_adaptive("Can singles buy a flat?")
+
+    # Confident on both signals, even with tied top scores
+    assert len(retrieve(0.95, 1.0)) == len(nodes) and expanded == []
+    retrieve(0.5, 1.0)
+    retrieve(0.95, 0.0)
+    assert len(expanded) == 2
+    assert rag.fast_path_stats.fast == 1 and rag.fast_path_stats.questions == 3
@@ -0,0 +1,37 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+from benchmark_qa_generation import SlowDummyLM, write_synthetic_chunks
+from src.ingestion.qa_generator import checkpoint_path, generate_usage_examples
+
+def test_resumes_from_checkpoint_and_writes_output_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_path = Path(tmp) / "chunks.json"
+        write_synthetic_chunks(chunks_path, 10)
+        chunks = json.loads(chunks_path.read_text(encoding="utf-8"))
+        output_path = Path(tmp) / "qa_pairs.json"
+
+        # A crashed run left two finished examples and a half-written line in the checkpoint
+        done = [{"doc_id": "synthetic", "section": "Eligibility", "question": f"q{i}", "answer": "a",
+                 "context": chunks[i]["text"]} for i in range(2)]
+        checkpoint = checkpoint_path(output_path)
+        checkpoint.write_text("".join(json.dumps(e) + "\n" for e in done) + '{"doc_id": "synth', encoding="utf-8")
+
+        results = generate_usage_examples(num_examples=5, output_file=str(output_path), workers=2,
+                                          lm=SlowDummyLM(0, num_answers=10), chunks_path=chunks_path)
+        saved = json.loads(output_path.read_text(encoding="utf-8"))
+        assert saved == results and len(saved) == 5
+        assert saved[:2] == done
+        assert len({e["context"] for e in saved}) == 5
+        assert not checkpoint.exists()
+
+        # The output is complete: nothing is generated again
+        again = generate_usage_examples(num_examples=5, output_file=str(output_path),
+                                        lm=SlowDummyLM(0, num_answers=0), chunks_path=chunks_path)
+        assert again == saved
+
+if __name__ == "__main__":
+    test_resumes_from_checkpoint_and_writes_output_once()
+    print("All QA generator tests passed")
@@ -0,0 +1,48 @@
+import os
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+import dspy
+from rag_optimizer import JudgeMetric, answers_match
+
+GOLD = ("Singles aged 35 and above can buy a 2-room Flexi flat in any town, as long as their "
+        "average gross monthly household income does not exceed the income ceiling of $7,000.")
+
+class CountingJudge(JudgeMetric):
+    """JudgeMetric whose LM judge rejects everything and counts the triples it was asked about."""
+    def __init__(self):
+        super().__init__(judge_lm=None)
+        self.judged = []
+
+    def _call_judge(self, triples):
+        self.judged.extend(triples)
+        return [0.0] * len(triples)
+
+def score(metric, predicted):
+    return metric(dspy.Example(question="Can singles buy a flat?", answer=GOLD), dspy.Prediction(answer=predicted))
+
+def test_near_exact_answers_skip_the_judge():
+    assert answers_match(GOLD, GOLD.upper())
+    assert answers_match(GOLD, GOLD.replace("Flexi flat", "Flexi flat,"))
+    # Harmless extra word
+    assert answers_match(GOLD, GOLD.replace("in any town", "in any HDB town"))
+
+    metric = CountingJudge()
+    assert score(metric, GOLD.replace("any town", "any HDB town")) == 1.0
+    assert metric.judged == [] and metric.short_circuits == 1
+
+def test_negated_or_changed_numbers_go_to_the_judge():
+    negated = GOLD.replace("can buy", "cannot buy")
+    inserted_not = GOLD.replace("can buy", "can not buy")
+    dropped_not = GOLD.replace("does not exceed", "does exceed")
+    numbers = GOLD.replace("$7,000", "$8,000")
+    for predicted in (negated, inserted_not, dropped_not, numbers):
+        assert not answers_match(GOLD, predicted), predicted
+    assert not answers_match("The buyer is eligible for the grant.", "The buyer is ineligible for the grant.")
+
+    metric = CountingJudge()
+    assert score(metric, inserted_not) == 0.0
+    assert len(metric.judged) == 1 and metric.short_circuits == 0
+
+if __name__ == "__main__":
+    test_near_exact_answers_skip_the_judge()
+    test_negated_or_changed_numbers_go_to_the_judge()
+    print("All judge metric tests passed")
@@ -0,0 +1,108 @@
+import threading
+import time
+from src.rerank import RerankScheduler
+
+class GatedModel:
+    """Cross-encoder stub: scores a pair by its passage length, and holds the first batch until `release` is set."""
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.batches.append(list(pairs))
+        if len(self.batches) == 1:
+            self.started.set()
+            self.release.wait(5)
+        return [float(len(passage)) for _, passage in pairs]
+
+def submit(scheduler, requests):
+    """Score each request from its own thread, in order; returns the threads and their results."""
+    results = [None] * len(requests)
+    def run(i, pairs):
+        results[i] = scheduler.score(pairs)
+    threads = []
+    for i, pairs in enumerate(requests):
+        queued = len(scheduler._queue)
+        thread = threading.Thread(target=run, args=(i, pairs))
+        thread.start()
+        threads.append(thread)
+        # Wait until this request is queued so the queue order is known
+        while len(scheduler._queue) == queued:
+            time.sleep(0.001)
+    return threads, results
+
+def start_busy(scheduler, pairs):
+    """Send a request to an idle scheduler and wait until the model is busy scoring it."""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(scheduler.score(pairs)))
+    thread.start()
+    assert scheduler.model.started.wait(5)
+    return thread, results
+
+def pairs_of(query, *lengths):
+    return [(query, "x" * n) for n in lengths]
+
+def test_idle_scheduler_dispatches_immediately():
+    model = GatedModel()
+    model.release.set()
+    scheduler = RerankScheduler(model, max_wait_ms=10_000)
+    started = time.perf_counter()
+    assert scheduler.score(pairs_of("q", 3, 1)) == [3.0, 1.0]
+    assert time.perf_counter() - started < 1.0
+    assert scheduler.stats()["batches"] == 1
+
+def test_requests_queued_while_busy_share_one_batch():
+    model = GatedModel()
+    scheduler = RerankScheduler(model, max_batch=128, max_wait_ms=20)
+    first, first_results = start_busy(scheduler, pairs_of("a", 1))
+    threads, results = submit(scheduler, [pairs_of("b", 2, 3), pairs_of("c", 4), pairs_of("d", 5, 6, 7)])
+    model.release.set()
+    for thread in [first] + threads:
+        thread.join(5)
+
+    assert [len(batch) for batch in model.batches] == [1, 6]
+    # Pairs keep the order of the requests, and each request gets back its own scores
+    assert [query for query, _ in model.batches[1]] == ["b", "b", "c", "d", "d", "d"]
+    assert first_results == [[1.0]]
+    assert results == [[2.0, 3.0], [4.0], [5.0, 6.0, 7.0]]
+    assert scheduler.stats()["batch_requests_mean"] == 2.0
+
+def test_batches_respect_max_batch_without_splitting_requests():
+    model = GatedModel()
+    scheduler = RerankScheduler(model, max_batch=4, max_wait_ms=20)
+    first, _ = start_busy(scheduler, pairs_of("a", 1))
+    threads, results = submit(scheduler, [pairs_of("b", 1, 1, 1), pairs_of("c", 2, 2), pairs_of("d", 3, 3),
+                                          pairs_of("e", *[4] * 6)])
+    model.release.set()
+    for thread in [first] + threads:
+        thread.join(5)
+
+    # c does not fit after b, and the oversized e runs on its own
+    assert [[query for query, _ in batch] for batch in model.batches] == [
+        ["a"], ["b", "b", "b"], ["c", "c", "d", "d"], ["e"] * 6,
+    ]
+    assert results == [[1.0] * 3, [2.0] * 2, [3.0] * 2, [4.0] * 6]
+
+def test_model_errors_reach_the_caller():
+    class FailingModel:
+        def predict(self, pairs, batch_size=None, show_progress_bar=False):
+            raise RuntimeError("model failed")
+    scheduler = RerankScheduler(FailingModel())
+    try:
+        scheduler.score(pairs_of("q", 1))
+    except RuntimeError as e:
+        assert str(e) == "model failed"
+    else:
+        raise AssertionError("expected the model error")
+    # The worker keeps serving after a failure
+    scheduler.model = GatedModel()
+    scheduler.model.release.set()
+    assert scheduler.score(pairs_of("q", 2)) == [2.0]
+
+if __name__ == "__main__":
+    test_idle_scheduler_dispatches_immediately()
+    test_requests_queued_while_busy_share_one_batch()
+    test_batches_respect_max_batch_without_splitting_requests()
+    test_model_errors_reach_the_caller()
+    print("All rerank scheduler tests passed")
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import (
+    FilterCondition, FilterOperator, MetadataFilter, MetadataFilters, VectorStoreQuery,
+)
+from src.vector_store import MMAP_DIR_NAME, MmapVectorStore
+
+def make_node(i, doc_id, dim=16):
+    embedding = np.zeros(dim)
+    embedding[i % dim] = 1.0
+    embedding[(i + 1) % dim] = 0.5
+    return TextNode(id_=f"{doc_id}_{i}", text=f"chunk {i}", embedding=embedding.tolist(),
+                    metadata={"chunk_id": f"{doc_id}_{i}", "doc_id": doc_id, "section": f"Section {i % 3}"})
+
+def make_store(dtype="float32", **kwargs):
+    store = MmapVectorStore(dtype=dtype, **kwargs)
+    store.add([make_node(i, "singles-scheme" if i % 2 else "housing-loan") for i in range(16)])
+    return store
+
+def query(store, i, k=3, **kwargs):
+    embedding = np.zeros(16)
+    embedding[i % 16] = 1.0
+    return store.query(VectorStoreQuery(query_embedding=embedding.tolist(), similarity_top_k=k, **kwargs))
+
+def test_persist_compacts_deleted_rows_and_reloads_memory_mapped(tmp_path):
+    store = make_store()
+    store.delete_nodes(["housing-loan_2"])
+    assert query(store, 2).ids[0] == "singles-scheme_1"
+    store.persist(str(tmp_path / "vector_store.json"))
+
+    reloaded = MmapVectorStore.from_persist_dir(tmp_path)
+    assert isinstance(reloaded._matrix, np.memmap)
+    assert len(reloaded._node_ids) == 15 and "housing-loan_2" not in reloaded._node_ids
+    assert np.load(tmp_path / MMAP_DIR_NAME / "embeddings.npy").shape == (15, 16)
+    for i in range(16):
+        assert query(reloaded, i).ids == query(store, i).ids
+
+    # Rows added after load are searched together with the memory-mapped ones
+    reloaded.add([make_node(100, "priority-schemes")])
+    assert "priority-schemes_100" in query(reloaded, 4, k=16).ids
+
+def test_float16_scores_close_to_float32():
+    full, half = make_store(), make_store(dtype="float16")
+    for i in range(16):
+        a, b = query(full, i), query(half, i)
+        assert set(a.ids) == set(b.ids)
+        assert np.allclose(a.similarities, b.similarities, atol=1e-2)
+
+def test_metadata_filters_restrict_the_candidates():
+    store = make_store()
+    by_doc = MetadataFilters(filters=[MetadataFilter(key="doc_id", value="singles-scheme")])
+    result = query(store, 2, k=5, filters=by_doc)
+    assert len(result.ids) == 5 and all(node_id.startswith("singles-scheme_") for node_id in result.ids)
+
+    either = MetadataFilters(filters=[
+        MetadataFilter(key="section", value="Section 0"),
+        MetadataFilter(key="chunk_id", value=["singles-scheme_1", "housing-loan_2"], operator=FilterOperator.IN),
+    ], condition=FilterCondition.OR)
+    ids = query(store, 0, k=16, filters=either).ids
+    assert set(ids) == {n for n in store._node_ids if int(n.rsplit("_", 1)[1]) % 3 == 0} | {"singles-scheme_1", "housing-loan_2"}
+
+    store.delete_nodes(["singles-scheme_1"])
+    assert "singles-scheme_1" not in query(store, 1, k=16, filters=by_doc).ids
+
+def test_filters_on_fields_outside_the_side_table_are_rejected():
+    with pytest.raises(ValueError, match="source"):
+        query(make_store(), 0, filters=MetadataFilters(filters=[MetadataFilter(key="source", value="x")]))
+
+def test_index_retriever_applies_filters(offline_models, chunks_path, tmp_path):
+    from src.retriever import get_hdb_index
+    index = get_hdb_index(data_path=chunks_path, storage_dir=tmp_path / "mmap", vector_store="mmap")
+    filters = MetadataFilters(filters=[MetadataFilter(key="doc_id", value="housing_loan")])
+    nodes = index.as_retriever(similarity_top_k=3, filters=filters).retrieve("singles scheme age 35")
+    assert len(nodes) == 3 and {n.node.metadata["doc_id"] for n in nodes} == {"housing_loan"}
+
+def random_nodes(n, dim=16, seed=0):
+    embeddings = np.random.default_rng(seed).normal(size=(n, dim))
+    return [TextNode(id_=f"n{i}", text="", embedding=e.tolist(), metadata={"chunk_id": f"n{i}"})
+            for i, e in enumerate(embeddings)]
+
+def recall(store, exact, queries, k=10):
+    hits = 0
+    for q in queries:
+        request = VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=k)
+        hits += len(set(store.query(request).ids) & set(exact.query(request).ids))
+    return hits / (k * len(queries))
+
+@pytest.mark.parametrize("ann, params", [("hnsw", {"ef_search": 128}), ("ivfpq", {"nlist": 4, "nprobe": 4})])
+def test_ann_candidates_are_rescored_exactly(tmp_path, ann, params):
+    nodes = random_nodes(400)
+    exact = MmapVectorStore()
+    exact.add(nodes)
+    store = MmapVectorStore(ann=ann, ann_params=params)
+    store.add(nodes)
+    store.persist(str(tmp_path / "vector_store.json"))
+
+    reloaded = MmapVectorStore.from_persist_dir(tmp_path)
+    assert reloaded._ann is not None and reloaded._ann_rows == 400
+    searched = []
+    search = reloaded._ann.search
+    reloaded._ann.search = lambda q, k: searched.append(k) or search(q, k)
+    queries = np.random.default_rng(1).normal(size=(20, 16))
+    assert recall(reloaded, exact, queries) >= 0.9
+    assert len(searched) == 20
+
+    # Rows deleted since the ANN index was built are skipped; rows added since are still found
+    top = reloaded.query(VectorStoreQuery(query_embedding=queries[0].tolist(), similarity_top_k=1)).ids[0]
+    reloaded.delete_nodes([top])
+    new = TextNode(id_="new", text="", embedding=queries[0].tolist(), metadata={"chunk_id": "new"})
+    reloaded.add([new])
+    ids = reloaded.query(VectorStoreQuery(query_embedding=queries[0].tolist(), similarity_top_k=5)).ids
+    assert ids[0] == "new" and top not in ids